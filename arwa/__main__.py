@@ -0,0 +1,4 @@
+from arwa.cli import main
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Sending templated messages to many groups of slack users.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, FrozenSet, List, Set, Tuple
+
+import jinja2
+import slack
+from tqdm import tqdm
+
+from arwa.ratelimit import TokenBucket
+from arwa.slack_client import client_call
+
+# conversations.open is Tier 3. chat.postMessage has its own limits of around
+# one message per second per channel with a larger workspace wide allowance.
+OPEN_PER_MINUTE = 50
+POST_PER_MINUTE = 300
+
+
+def delivery_key(user_ids: List[str], text: str, occurrence=0) -> str:
+    """
+    Key identifying a message to a group of users, used to skip deliveries
+    across runs. Items repeating a message to the same users are told apart by
+    `occurrence`, counting from 0.
+    """
+
+    parts: List = [sorted(user_ids), text]
+    if occurrence:
+        parts.append(occurrence)
+    return hashlib.sha1(json.dumps(parts).encode()).hexdigest()
+
+
+def default_delivery_log(bulk_post_config: str) -> str:
+    return os.path.splitext(bulk_post_config)[0] + ".delivered.jsonl"
+
+
+def load_delivery_log(path: str) -> Set[str]:
+    if not os.path.exists(path):
+        return set()
+
+    with open(path) as fp:
+        return {json.loads(line)["key"] for line in fp if line.strip()}
+
+
+def render_bulk_items(template_text: str, bulk_items: List[Dict]) -> List[Tuple[List[str], str]]:
+    """
+    Render message text for each item of the bulk post config. The template is
+    compiled once for all the items.
+    """
+
+    template = jinja2.Template(template_text)
+    return [
+        (item["user-ids"], template.render(**item.get("variables", {})))
+        for item in bulk_items
+    ]
+
+
+def dry_run_bulk_post(template_text: str, bulk_items: List[Dict]) -> Dict:
+    """
+    Render all messages without talking to slack and report the throughput.
+    """
+
+    start = time.perf_counter()
+    rendered = render_bulk_items(template_text, bulk_items)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "items": len(rendered),
+        "seconds": elapsed,
+        "items_per_second": len(rendered) / elapsed if elapsed else None
+    }
+
+
+def dispatch_bulk_post(client: slack.WebClient, template_text: str, bulk_items: List[Dict],
+                       delivery_log: str, n_workers=4) -> Dict:
+    """
+    Send a rendered message for each item of bulk post config to the
+    conversation with its users using a pool of `n_workers`.
+
+    Every delivery is appended to `delivery_log` as it happens and items already
+    in there are skipped, so a failed run can just be run again. Conversations
+    are opened once per distinct group of users.
+
+    Return counts of `delivered` and `skipped` items and a `failed` map from
+    item index to the error.
+    """
+
+    delivered = load_delivery_log(delivery_log)
+    rendered = render_bulk_items(template_text, bulk_items)
+
+    open_bucket = TokenBucket.per_minute(OPEN_PER_MINUTE)
+    post_bucket = TokenBucket.per_minute(POST_PER_MINUTE)
+
+    channels: Dict[FrozenSet[str], str] = {}
+    channel_locks: Dict[FrozenSet[str], threading.Lock] = {}
+    lock = threading.Lock()
+
+    summary: Dict = {"delivered": 0, "skipped": 0, "failed": {}}
+
+    def _open(user_ids: List[str]) -> str:
+        group = frozenset(user_ids)
+        with lock:
+            group_lock = channel_locks.setdefault(group, threading.Lock())
+
+        # Items for the same group wait for a single open call
+        with group_lock:
+            if group not in channels:
+                response = client_call(client, lambda: client.conversations_open(users=user_ids), open_bucket)
+                channels[group] = response["channel"]["id"]
+
+        return channels[group]
+
+    def _send(i: int, user_ids: List[str], text: str, key: str):
+        try:
+            channel_id = _open(user_ids)
+            response = client_call(client, lambda: client.chat_postMessage(channel=channel_id, text=text), post_bucket)
+        except Exception as e:
+            with lock:
+                summary["failed"][i] = str(e)
+            return
+
+        with lock:
+            log_fp.write(json.dumps({"key": key, "item": i, "channel": channel_id, "ts": response.get("ts")}) + "\n")
+            log_fp.flush()
+            summary["delivered"] += 1
+
+    occurrences: Dict[str, int] = {}
+    pending = []
+    for i, (user_ids, text) in enumerate(rendered):
+        key = delivery_key(user_ids, text)
+        occurrences[key] = occurrences.get(key, 0) + 1
+        if occurrences[key] > 1:
+            key = delivery_key(user_ids, text, occurrences[key] - 1)
+        if key in delivered:
+            summary["skipped"] += 1
+        else:
+            pending.append((i, user_ids, text, key))
+
+    with open(delivery_log, "a") as log_fp, ThreadPoolExecutor(max_workers=n_workers) as pool:
+        list(tqdm(pool.map(lambda args: _send(*args), pending), total=len(pending)))
+
+    return summary
@@ -0,0 +1,154 @@
+"""
+Meeting analytics over calendar exports of many users. This mirrors
+`report_events_summary` but works on whole frames of events at once.
+"""
+
+import datetime
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+CATEGORIES = ["total", "personal", "external", "1:1", "rest"]
+
+
+def event_features(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Add per event features to a frame of exported events. These are computed
+    once for all events instead of on every summary.
+    """
+
+    df = df.copy()
+
+    # Frames without events come back from parquet with float columns
+    attendees = df["attendees"].astype(object)
+
+    df["hours"] = (df["end_time"] - df["start_time"]).dt.total_seconds() / 3600
+    df["n_attendees"] = attendees.str.len()
+
+    domains = attendees.explode().str.split("@").str[1]
+    df["n_domains"] = domains.groupby(level=0).nunique().reindex(df.index, fill_value=0)
+
+    df["is_accepted"] = df["response_status"] == "accepted"
+    df["is_day_long"] = df["hours"] >= 24
+    df["is_external"] = df["n_domains"] > 1
+    df["is_personal"] = df["n_attendees"] == 1
+    df["is_one_on_one"] = df["n_attendees"] == 2
+
+    return df
+
+
+def shift_days(times: pd.Series, days) -> pd.Series:
+    """
+    Move times by `days` in local wall time so that midnights stay midnights
+    across DST changes.
+    """
+
+    tz = times.dt.tz
+    if tz is None:
+        return times + pd.to_timedelta(days, unit="D")
+
+    local = times.dt.tz_localize(None) + pd.to_timedelta(days, unit="D")
+    return local.dt.tz_localize(tz, ambiguous=True, nonexistent="shift_forward")
+
+
+def week_start(times: pd.Series) -> pd.Series:
+    """
+    Return start (Sunday midnight) of the week for each time.
+    """
+
+    tz = times.dt.tz
+    days = (times.dt.tz_localize(None) if tz is not None else times).dt.normalize()
+    weeks = days - pd.to_timedelta((days.dt.dayofweek + 1) % 7, unit="D")
+
+    if tz is None:
+        return weeks
+    return weeks.dt.tz_localize(tz, ambiguous=True, nonexistent="shift_forward")
+
+
+def split_at_week_boundaries(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Split events crossing into the next week so that each week gets its own
+    part. Events are expected to be shorter than a week.
+    """
+
+    df = df.copy()
+    df["week"] = week_start(df["start_time"])
+
+    boundary = shift_days(df["week"], 7)
+    crossing = df["end_time"] > boundary
+
+    tail = df[crossing].copy()
+    tail["start_time"] = boundary[crossing]
+    tail["week"] = boundary[crossing]
+
+    df.loc[crossing, "end_time"] = boundary[crossing]
+    df = pd.concat([df, tail], ignore_index=True)
+    df["hours"] = (df["end_time"] - df["start_time"]).dt.total_seconds() / 3600
+
+    return df
+
+
+def weekly_breakdown(df: pd.DataFrame, tz: Optional[datetime.tzinfo] = None) -> pd.DataFrame:
+    """
+    Return accepted hours per user and week in the same categories as
+    `report_events_summary`. Weeks start on Sunday in timezone `tz`, local
+    timezone by default.
+    """
+
+    tz = tz or datetime.datetime.now().astimezone().tzinfo
+
+    df = event_features(df)
+    df = df[~df["is_day_long"]]
+    df["start_time"] = df["start_time"].dt.tz_convert(tz)
+    df["end_time"] = df["end_time"].dt.tz_convert(tz)
+    df = split_at_week_boundaries(df)
+
+    hours = np.where(df["is_accepted"], df["hours"], 0.0)
+    internal = ~df["is_external"]
+    rest = internal & ~df["is_personal"]
+
+    breakdown = pd.DataFrame({
+        "email": df["email"],
+        "week": df["week"],
+        "total": hours,
+        "personal": hours * (internal & df["is_personal"]),
+        "external": hours * df["is_external"],
+        "1:1": hours * (rest & df["is_one_on_one"]),
+        "rest": hours * (rest & ~df["is_one_on_one"])
+    })
+
+    return breakdown.groupby(["email", "week"])[CATEGORIES].sum()
+
+
+def render_dashboard(breakdown: pd.DataFrame, output_html: str):
+    """
+    Write an offline html dashboard with hours by category over weeks for the
+    whole team and total hours for each user and week.
+    """
+
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+
+    team = breakdown.groupby(level="week").sum()
+    weeks = [w.date().isoformat() for w in team.index]
+
+    fig = make_subplots(
+        rows=2, cols=1, vertical_spacing=0.1,
+        subplot_titles=["Team hours by category", "Hours in meetings per user"]
+    )
+
+    for category in CATEGORIES[1:]:
+        fig.add_trace(go.Bar(x=weeks, y=team[category], name=category), row=1, col=1)
+
+    per_user = breakdown["total"].unstack("week").fillna(0)
+    fig.add_trace(go.Heatmap(
+        z=per_user.values,
+        x=[w.date().isoformat() for w in per_user.columns],
+        y=list(per_user.index),
+        colorscale="Blues",
+        colorbar={"title": "Hours", "len": 0.45, "y": 0.22}
+    ), row=2, col=1)
+
+    fig.update_layout(barmode="stack", height=max(800, 400 + 20 * len(per_user)))
+    fig.write_html(output_html, include_plotlyjs=True)
@@ -0,0 +1,163 @@
+"""
+Exporting calendars of many users to a directory of parquet files, one per
+user.
+"""
+
+import datetime
+import glob
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, Union
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from tqdm import tqdm
+
+from arwa.calendar_utils import as_aware, parse_google_calendar
+from arwa.storage import EventStore
+from arwa.types import CalendarEvent
+
+COLUMNS = ["email", "name", "start_time", "end_time", "attendees", "response_status"]
+
+# Parquet metadata key holding the time window a user's file covers
+WINDOW_KEY = b"arwa.window"
+
+
+def to_utc(value: Union[datetime.date, datetime.datetime]) -> datetime.datetime:
+    return as_aware(value).astimezone(datetime.timezone.utc)
+
+
+def user_events_path(output_dir: str, email: str) -> str:
+    return os.path.join(output_dir, f"{email}.parquet")
+
+
+def export_window(start_dt: datetime.datetime, end_dt: datetime.datetime) -> bytes:
+    return json.dumps([to_utc(start_dt).isoformat(), to_utc(end_dt).isoformat()]).encode()
+
+
+def read_export_window(path: str) -> Optional[bytes]:
+    """
+    Return the window saved in a user's file, None if there is no file or it
+    has no window.
+    """
+
+    if not os.path.exists(path):
+        return None
+    return (pq.read_schema(path).metadata or {}).get(WINDOW_KEY)
+
+
+def events_to_frame(email: str, events: List[CalendarEvent]) -> pd.DataFrame:
+    return pd.DataFrame({
+        "email": [email] * len(events),
+        "name": [ev.name for ev in events],
+        "start_time": pd.to_datetime([to_utc(ev.start_time) for ev in events], utc=True),
+        "end_time": pd.to_datetime([to_utc(ev.end_time) for ev in events], utc=True),
+        "attendees": [list(ev.attendees) for ev in events],
+        "response_status": [ev.response_status for ev in events]
+    }, columns=COLUMNS)
+
+
+def read_user_events(path: str) -> List[CalendarEvent]:
+    """
+    Read events of one user back from an export.
+    """
+
+    df = pd.read_parquet(path)
+    return [
+        CalendarEvent(
+            name=row.name,
+            start_time=row.start_time.to_pydatetime(),
+            end_time=row.end_time.to_pydatetime(),
+            attendees=list(row.attendees),
+            response_status=row.response_status
+        )
+        for row in df.itertuples(index=False)
+    ]
+
+
+def load_calendar_export(output_dir: str) -> pd.DataFrame:
+    """
+    Load events of all users in an export directory in one frame.
+    """
+
+    paths = sorted(glob.glob(os.path.join(output_dir, "*.parquet")))
+    if not paths:
+        return events_to_frame("", [])
+
+    return pd.concat([pd.read_parquet(path) for path in paths], ignore_index=True)
+
+
+def export_user_events(email: str, start_dt: datetime.datetime, end_dt: datetime.datetime,
+                       output_dir: str, max_retries=3, store: Optional[EventStore] = None) -> int:
+    """
+    Fetch and write events of one user, retrying failed fetches with
+    exponential backoff. Return the number of events written.
+    """
+
+    attempt = 0
+    while True:
+        try:
+            events = parse_google_calendar(email, start_dt, end_dt, store=store)
+            break
+        except Exception:
+            if attempt >= max_retries:
+                raise
+            time.sleep(2 ** attempt)
+            attempt += 1
+
+    path = user_events_path(output_dir, email)
+    table = pa.Table.from_pandas(events_to_frame(email, events), preserve_index=False)
+    metadata = {**(table.schema.metadata or {}), WINDOW_KEY: export_window(start_dt, end_dt)}
+    table = table.replace_schema_metadata(metadata)
+
+    # Write under a temporary name so only complete files are taken as done
+    pq.write_table(table, path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+    return len(events)
+
+
+def export_calendars(emails: List[str], start_dt: datetime.datetime, end_dt: datetime.datetime,
+                     output_dir: str, n_workers=4, max_retries=3, store: Optional[EventStore] = None) -> Dict:
+    """
+    Export calendars of all `emails` in `output_dir` fetching at most
+    `n_workers` of them at once. Each user's events are written as soon as they
+    are fetched along with the window they cover. Users with a file for the same
+    window are skipped, so rerunning an interrupted export continues it while
+    files from other windows are exported again.
+
+    Return a summary with `exported` and `skipped` emails and a `failed` map from
+    email to the error.
+    """
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    summary: Dict = {"exported": [], "skipped": [], "failed": {}}
+
+    window = export_window(start_dt, end_dt)
+
+    pending = []
+    for email in emails:
+        if read_export_window(user_events_path(output_dir, email)) == window:
+            summary["skipped"].append(email)
+        else:
+            pending.append(email)
+
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        futures = {
+            pool.submit(export_user_events, email, start_dt, end_dt, output_dir, max_retries, store): email
+            for email in pending
+        }
+
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            email = futures[future]
+            try:
+                future.result()
+                summary["exported"].append(email)
+            except Exception as e:
+                summary["failed"][email] = str(e)
+
+    return summary
@@ -2,19 +2,53 @@
 Utilities for interacting with online calendars, mostly Google's.
 """
 
+import bisect
 import calendar
+import dataclasses
 import datetime
-import operator as op
-from functools import reduce
-from typing import Dict, List, Optional, Tuple
-
-import portion as P
-from gcsa.google_calendar import GoogleCalendar
-import gcsa.event
+import functools
+import json
+import os
+import random
+import sys
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+import httplib2
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.errors import HttpError
 from pydash import py_
 
+from arwa import trace
+from arwa.storage import EventStore
 from arwa.types import CalendarEvent
 
+# Only the parts of event resources that we read
+EVENT_FIELDS = (
+    "items(id,status,summary,start,end,attendees(email,self,responseStatus)),"
+    "nextPageToken,nextSyncToken"
+)
+MAX_RESULTS = 2500
+
+# Google takes up to 1000 calls in a batch but advises against going above 50
+BATCH_SIZE = 50
+
+# Retries of calls that are rate limited or fail on Google's side
+NUM_RETRIES = 5
+
+# OAuth client secrets and the token kept across runs live here
+CREDENTIALS_DIR = os.path.expanduser("~/.credentials")
+SCOPES = ["https://www.googleapis.com/auth/calendar"]
+
+# Items and sync token of a calendar, or the error from listing it
+ListResult = Union[Tuple[List[Dict], Optional[str]], HttpError]
+
+_local = threading.local()
+_credentials = None
+_credentials_lock = threading.Lock()
+
 
 def get_last_sunday(dt=None) -> datetime.datetime:
     """
@@ -43,60 +77,355 @@ def get_last_day_of_month(dt=None) -> datetime.datetime:
     return dt.replace(day=day)
 
 
-def parse_google_calendar(email_id: str, start_time: datetime.datetime, end_time: datetime.datetime) -> List[CalendarEvent]:
+def as_aware(value: Union[datetime.date, datetime.datetime]) -> datetime.datetime:
     """
-    Parse google calendar and return events. End time is not inclusive. Use
-    empty string "" to refer to user's default calendar.
+    Return timezone aware datetime for the value. Dates (from day long events)
+    are taken as local midnight and so are naive datetimes.
     """
 
-    # HACK: Didn't want to change position of the arguments
-    if email_id:
-        cal = GoogleCalendar(email_id)
+    if not isinstance(value, datetime.datetime):
+        value = datetime.datetime.combine(value, datetime.time.min)
+
+    return value.astimezone() if value.tzinfo is None else value
+
+
+def parse_event_time(value: Dict) -> Union[datetime.date, datetime.datetime]:
+    """
+    Parse start or end time from an event resource. Day long events have dates
+    instead of datetimes.
+    """
+
+    if "dateTime" in value:
+        return datetime.datetime.fromisoformat(value["dateTime"].replace("Z", "+00:00"))
     else:
-        cal = GoogleCalendar()
-
-    events = []
-    for ev in cal[start_time:end_time]:
-        name = ev.summary
-        start_time = ev.start
-        end_time = ev.end
-
-        if not ev.attendees:
-            # This is likely a personal event
-            response_status: Optional[str] = "accepted"
-            attendees = [email_id]
+        return datetime.date.fromisoformat(value["date"])
+
+
+def load_credentials(credentials_dir=CREDENTIALS_DIR):
+    """
+    Return Google credentials from the token saved in `credentials_dir`. The
+    first run, or one after the token is revoked, goes through the OAuth flow
+    with the client secrets in `credentials.json` there.
+    """
+
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+    from google_auth_oauthlib.flow import InstalledAppFlow
+
+    token_path = os.path.join(credentials_dir, "token.json")
+
+    credentials = None
+    if os.path.exists(token_path):
+        credentials = Credentials.from_authorized_user_file(token_path, SCOPES)
+
+    if not credentials or not credentials.valid:
+        if credentials and credentials.expired and credentials.refresh_token:
+            credentials.refresh(Request())
         else:
-            attendee = py_.find(ev.attendees, lambda at: at.email == email_id)
-            try:
-                if attendee.response_status == "needsAction":
-                    response_status = None
-                else:
-                    response_status = attendee.response_status
-            except AttributeError:
-                response_status = None
-            attendees = [a.email for a in ev.attendees]
-
-        events.append(CalendarEvent(
-            name=name,
-            start_time=start_time,
-            end_time=end_time,
-            attendees=attendees,
-            response_status=response_status
-        ))
+            flow = InstalledAppFlow.from_client_secrets_file(os.path.join(credentials_dir, "credentials.json"), SCOPES)
+            credentials = flow.run_local_server()
+
+        with open(token_path, "w") as fp:
+            fp.write(credentials.to_json())
+
+    return credentials
+
+
+def get_calendar_service():
+    """
+    Return Calendar API service for the current thread.
+
+    Credentials are loaded once per process and shared. Services aren't thread
+    safe so each thread builds its own on first use. Setting
+    ARWA_CALENDAR_API_URL points the service to another server, like a local
+    stand-in, without any auth.
+    """
+
+    global _credentials
+
+    if getattr(_local, "service", None) is None:
+        api_url = os.environ.get("ARWA_CALENDAR_API_URL")
+        if api_url:
+            # Rooting the discovery document there moves batch calls too
+            doc = json.loads(get_static_doc("calendar", "v3"))
+            doc["rootUrl"] = api_url
+            doc["baseUrl"] = api_url + doc["servicePath"]
+            _local.service = build_from_document(doc, http=httplib2.Http())
+        else:
+            with _credentials_lock:
+                if _credentials is None:
+                    _credentials = load_credentials()
+            _local.service = build("calendar", "v3", credentials=_credentials, static_discovery=True)
+
+    return _local.service
+
+
+def event_from_resource(resource: Dict, email_id: str) -> CalendarEvent:
+    """
+    Make event from a Calendar API event resource as seen in the calendar of
+    `email_id`.
+    """
+
+    attendees = resource.get("attendees")
+
+    if not attendees:
+        # This is likely a personal event
+        response_status: Optional[str] = "accepted"
+        emails = [email_id]
+    else:
+        attendee = py_.find(attendees, lambda at: at.get("self") or at.get("email") == email_id)
+        if attendee and attendee.get("responseStatus") != "needsAction":
+            response_status = attendee.get("responseStatus")
+        else:
+            response_status = None
+        emails = [a.get("email") for a in attendees]
+
+    return CalendarEvent(
+        name=resource.get("summary"),
+        start_time=parse_event_time(resource["start"]),
+        end_time=parse_event_time(resource["end"]),
+        attendees=emails,
+        response_status=response_status
+    )
+
+
+def event_list_request(service, calendar_id: str, page_token: Optional[str] = None, **kwargs):
+    """
+    Return request for a page of events asking only for the fields we read.
+    """
+
+    return service.events().list(
+        calendarId=calendar_id, singleEvents=True, maxResults=MAX_RESULTS, fields=EVENT_FIELDS,
+        pageToken=page_token, **kwargs
+    )
+
+
+def list_event_resources(service, calendar_id: str, **kwargs) -> Tuple[List[Dict], Optional[str]]:
+    """
+    List event resources following all the pages. Return them with the sync
+    token for picking up changes later.
+    """
+
+    items = []
+    page_token = None
+    while True:
+        with trace.span("calendar.events.list", "calendar") as span:
+            response = event_list_request(service, calendar_id, page_token, **kwargs).execute(num_retries=NUM_RETRIES)
+            if span:
+                # The client only hands back parsed responses
+                span.add("bytes_received", len(json.dumps(response)))
+        items.extend(response.get("items", []))
+
+        page_token = response.get("nextPageToken")
+        if not page_token:
+            return items, response.get("nextSyncToken")
+
+
+def batch_list_event_resources(service, requests: Dict[str, Dict], batch_size=BATCH_SIZE) -> Dict[str, ListResult]:
+    """
+    List event resources of many calendars at once. `requests` maps calendar
+    id to the list arguments. The list calls, and then the calls for further
+    pages, go in batch requests of `batch_size` calls each.
+
+    Return map from calendar id to items and sync token like
+    `list_event_resources`, or to the error if listing failed. Calls that are
+    rate limited or fail on the server are sent again in the next round.
+    """
+
+    if len(requests) == 1:
+        # Nothing to gain from a batch
+        [(calendar_id, kwargs)] = requests.items()
+        try:
+            return {calendar_id: list_event_resources(service, calendar_id, **kwargs)}
+        except HttpError as e:
+            return {calendar_id: e}
+
+    results: Dict[str, ListResult] = {}
+    items: Dict[str, List[Dict]] = {calendar_id: [] for calendar_id in requests}
+    page_tokens: Dict[str, Optional[str]] = {calendar_id: None for calendar_id in requests}
+    attempts: Dict[str, int] = {calendar_id: 0 for calendar_id in requests}
+
+    def _callback(calendar_id, response, exception):
+        if exception is not None:
+            status = exception.resp.status if isinstance(exception, HttpError) else 0
+            if (status == 429 or status >= 500) and attempts[calendar_id] < NUM_RETRIES:
+                attempts[calendar_id] += 1
+                next_page_tokens[calendar_id] = page_tokens[calendar_id]
+                retried.append(calendar_id)
+                trace.current().add("retries", 1)
+            else:
+                results[calendar_id] = exception
+            return
+
+        span = trace.current()
+        if span:
+            span.add("bytes_received", len(json.dumps(response)))
+
+        items[calendar_id].extend(response.get("items", []))
+        if response.get("nextPageToken"):
+            next_page_tokens[calendar_id] = response["nextPageToken"]
+        else:
+            results[calendar_id] = (items[calendar_id], response.get("nextSyncToken"))
+
+    while page_tokens:
+        next_page_tokens: Dict[str, Optional[str]] = {}
+        retried: List[str] = []
+        calendar_ids = list(page_tokens)
+
+        for i in range(0, len(calendar_ids), batch_size):
+            batch = service.new_batch_http_request(callback=_callback)
+            chunk = calendar_ids[i:i + batch_size]
+            for calendar_id in chunk:
+                request = event_list_request(service, calendar_id, page_tokens[calendar_id], **requests[calendar_id])
+                batch.add(request, request_id=calendar_id)
+            with trace.span("calendar.batch", "calendar", calls=len(chunk)):
+                batch.execute()
+
+        if retried:
+            # Same backoff as the client library uses for single calls
+            delay = random.random() * 2 ** max(attempts[calendar_id] for calendar_id in retried)
+            time.sleep(delay)
+            trace.record_wait("calendar backoff", delay)
+        page_tokens = next_page_tokens
+
+    return results
+
+
+def _event_rows(items: List[Dict]) -> Tuple[List[Tuple], List[str]]:
+    upserts, deletes = [], []
+    for item in items:
+        if item.get("status") == "cancelled":
+            deletes.append(item["id"])
+        else:
+            upserts.append((
+                item["id"],
+                as_aware(parse_event_time(item["start"])).timestamp(),
+                as_aware(parse_event_time(item["end"])).timestamp(),
+                item
+            ))
+    return upserts, deletes
+
+
+def window_args(start_ts: float, end_ts: float) -> Dict[str, str]:
+    return {
+        "timeMin": datetime.datetime.fromtimestamp(start_ts, datetime.timezone.utc).isoformat(),
+        "timeMax": datetime.datetime.fromtimestamp(end_ts, datetime.timezone.utc).isoformat()
+    }
+
+
+def sync_calendars(store: EventStore, service, calendar_ids: List[str],
+                   start_time: datetime.datetime, end_time: datetime.datetime):
+    """
+    Bring events of the calendars in store up to date for the given window.
+
+    A window already covered by the store is refreshed with an incremental
+    sync pulling only changes since the last sync. Otherwise, or if there is no
+    usable sync token, the store is rebuilt over just the new window so a full
+    listing never costs more than the window asked for. Calendars are listed
+    together in batch requests.
+    """
+
+    start_ts, end_ts = as_aware(start_time).timestamp(), as_aware(end_time).timestamp()
+
+    incremental: Dict[str, Tuple] = {}
+    full: Dict[str, Tuple[float, float]] = {}
+    for calendar_id in calendar_ids:
+        state = store.get_sync_state(calendar_id)
+        # Listings can come back without a sync token, leaving nothing to pick
+        # up changes from
+        if state and state[0] and state[1] <= start_ts and end_ts <= state[2]:
+            incremental[calendar_id] = state
+        else:
+            full[calendar_id] = (start_ts, end_ts)
+
+    if incremental:
+        results = batch_list_event_resources(service, {
+            calendar_id: {"syncToken": state[0]} for calendar_id, state in incremental.items()
+        })
+
+        for calendar_id, result in results.items():
+            state = incremental[calendar_id]
+            if isinstance(result, HttpError):
+                if result.resp.status != 410:
+                    raise result
+                full[calendar_id] = (start_ts, end_ts)
+            else:
+                items, sync_token = result
+                upserts, deletes = _event_rows(items)
+                store.apply(calendar_id, upserts, deletes, sync_token, (state[1], state[2]))
+
+    if full:
+        results = batch_list_event_resources(service, {
+            calendar_id: window_args(*window) for calendar_id, window in full.items()
+        })
+
+        for calendar_id, result in results.items():
+            if isinstance(result, HttpError):
+                raise result
+            items, sync_token = result
+            upserts, _ = _event_rows(items)
+            store.apply(calendar_id, upserts, [], sync_token, full[calendar_id], replace=True)
+
+
+def sync_calendar(store: EventStore, service, calendar_id: str, start_time: datetime.datetime, end_time: datetime.datetime):
+    """
+    Bring events of one calendar in store up to date for the given window.
+    """
+
+    sync_calendars(store, service, [calendar_id], start_time, end_time)
+
+
+def parse_google_calendars(email_ids: List[str], start_time: datetime.datetime, end_time: datetime.datetime,
+                           store: Optional[EventStore] = None, service=None) -> Dict[str, List[CalendarEvent]]:
+    """
+    Parse calendars of all `email_ids` and return map from email id to events.
+    The calendars are listed together in batch requests with the process wide
+    service unless one is given.
+
+    With a `store`, the calendars are synced in there incrementally and events
+    are served from it.
+    """
+
+    service = service or get_calendar_service()
+    calendar_ids = {email_id: email_id or "primary" for email_id in email_ids}
+
+    start_ts, end_ts = as_aware(start_time).timestamp(), as_aware(end_time).timestamp()
+
+    if store is not None:
+        sync_calendars(store, service, list(calendar_ids.values()), start_time, end_time)
+        return {
+            email_id: [event_from_resource(resource, email_id) for resource in store.query(calendar_id, start_ts, end_ts)]
+            for email_id, calendar_id in calendar_ids.items()
+        }
+
+    results = batch_list_event_resources(service, {
+        calendar_id: window_args(start_ts, end_ts) for calendar_id in calendar_ids.values()
+    })
+
+    events = {}
+    for email_id, calendar_id in calendar_ids.items():
+        result = results[calendar_id]
+        if isinstance(result, HttpError):
+            raise result
+        items, _ = result
+        evs = [event_from_resource(item, email_id) for item in items if item.get("status") != "cancelled"]
+        # Listings aren't ordered, events from the store are by start time
+        events[email_id] = sorted(evs, key=lambda ev: as_aware(ev.start_time))
 
     return events
 
 
-def register_event(cal: GoogleCalendar, ev: CalendarEvent):
+def parse_google_calendar(email_id: str, start_time: datetime.datetime, end_time: datetime.datetime,
+                          store: Optional[EventStore] = None, service=None) -> List[CalendarEvent]:
     """
-    Push the event on Google Calendar.
+    Parse google calendar and return events. End time is not inclusive. Use
+    empty string "" to refer to user's default calendar.
 
-    APIs don't allow creating OOO and FocusTime event type on calendar at the
-    moment.
+    With a `store`, the calendar is synced in there incrementally and events
+    are served from it.
     """
 
-    gev = gcsa.event.Event(ev.name, start=ev.start_time, end=ev.end_time, attendees=ev.attendees)
-    return cal.add_event(gev)
+    return parse_google_calendars([email_id], start_time, end_time, store=store, service=service)[email_id]
 
 
 def is_event_personal(ev: CalendarEvent) -> bool:
@@ -108,8 +437,13 @@ def is_day_long_event(ev: CalendarEvent) -> bool:
     return ((ev.end_time - ev.start_time).total_seconds() / 3600) >= 24
 
 
+@functools.lru_cache(maxsize=4096)
+def email_domain(email: str) -> str:
+    return sys.intern(email.split("@")[1])
+
+
 def is_event_external(ev: CalendarEvent) -> bool:
-    return len({email.split("@")[1] for email in ev.attendees}) > 1
+    return len({email_domain(email) for email in ev.attendees}) > 1
 
 
 def is_event_one_on_one(ev: CalendarEvent) -> bool:
@@ -167,10 +501,10 @@ def is_overlapping(event_a: CalendarEvent, event_b: CalendarEvent) -> bool:
     Tell if two events (with datetime) are overlapping.
     """
 
-    interval_a = P.closedopen(event_a.start_time, event_a.end_time)
-    interval_b = P.closedopen(event_b.start_time, event_b.end_time)
-
-    return not (interval_a & interval_b).empty
+    return (
+        event_a.start_time < event_a.end_time and event_b.start_time < event_b.end_time and
+        event_a.start_time < event_b.end_time and event_b.start_time < event_a.end_time
+    )
 
 
 def get_focus_wrap(ev: CalendarEvent) -> Tuple[CalendarEvent, CalendarEvent]:
@@ -204,37 +538,144 @@ def get_focus_wrap(ev: CalendarEvent) -> Tuple[CalendarEvent, CalendarEvent]:
     return [pre_ev, post_ev]
 
 
-def find_interstices(events: List[CalendarEvent]) -> List[CalendarEvent]:
+def merge_intervals(intervals: Iterable[Tuple[datetime.datetime, datetime.datetime]]) -> List[Tuple[datetime.datetime, datetime.datetime]]:
     """
-    Return gaps where there are no events.
+    Merge overlapping and touching (start, end) intervals in a single sweep
+    over them sorted by start.
     """
 
-    # TODO: Assert for events in the same date.
+    merged: List[Tuple[datetime.datetime, datetime.datetime]] = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
 
-    date = events[0].start_time.date()
+    return merged
 
-    def _time_to_mins(t: datetime.time) -> int:
-        # TODO: Handle border case
-        return t.hour * 60 + t.minute
 
-    def _mins_to_time(mins: int) -> datetime.time:
-        return datetime.time(mins // 60, mins % 60)
+def find_interstices(events: List[CalendarEvent]) -> List[CalendarEvent]:
+    """
+    Return gaps where there are no events. Events are taken to be on the date
+    of the earliest one.
+    """
 
-    intervals = []
-    for ev in events:
-        start_time = ev.start_time.time()
-        end_time = ev.end_time.time()
-        intervals.append(P.closed(_time_to_mins(start_time), _time_to_mins(end_time)))
+    if not events:
+        return []
 
-    gaps = reduce(op.or_, intervals).complement()
-    gaps = [g for g in gaps if (g.lower > -P.inf) and (g.upper < P.inf)]
+    date = min(ev.start_time for ev in events).date()
+
+    busy = merge_intervals(
+        (datetime.datetime.combine(date, ev.start_time.time()), datetime.datetime.combine(date, ev.end_time.time()))
+        for ev in events
+    )
 
     return [
-        CalendarEvent(
-            str(i),
-            start_time=datetime.datetime.combine(date, _mins_to_time(interval.lower)),
-            end_time=datetime.datetime.combine(date, _mins_to_time(interval.upper)),
-            attendees=[]
-        )
-        for i, interval in enumerate(gaps)
+        CalendarEvent(str(i), start_time=prev_end, end_time=next_start, attendees=[])
+        for i, ((_, prev_end), (next_start, _)) in enumerate(zip(busy, busy[1:]))
     ]
+
+
+def _localize(dt: datetime.datetime, tz: datetime.tzinfo) -> datetime.datetime:
+    # pytz zones need localize to pick the right offset
+    return tz.localize(dt) if hasattr(tz, "localize") else dt.replace(tzinfo=tz)
+
+
+def find_free_slots(calendars: List[List[CalendarEvent]], start_time: datetime.datetime, end_time: datetime.datetime,
+                    min_duration: datetime.timedelta,
+                    working_hours: Tuple[datetime.time, datetime.time] = (datetime.time(9), datetime.time(18)),
+                    tz: Optional[datetime.tzinfo] = None, weekdays_only=True) -> List[Tuple[datetime.datetime, datetime.datetime]]:
+    """
+    Return (start, end) slots of at least `min_duration` between start and end
+    time where every calendar is free. Slots are limited to `working_hours` of
+    each day in timezone `tz` (local timezone by default), skipping weekends if
+    `weekdays_only` is set.
+
+    Declined and day long events don't block time. Busy time across all
+    calendars is merged in one sort and sweep, and working hours are walked
+    over it once.
+    """
+
+    tz = tz or datetime.datetime.now().astimezone().tzinfo
+    start_time, end_time = as_aware(start_time), as_aware(end_time)
+
+    busy = merge_intervals(
+        (as_aware(ev.start_time), as_aware(ev.end_time))
+        for events in calendars for ev in events
+        if ev.response_status != "declined" and not is_day_long_event(ev)
+    )
+
+    slots = []
+    i = 0
+    day = start_time.astimezone(tz).date()
+    while day <= end_time.astimezone(tz).date():
+        if weekdays_only and day.isoweekday() > 5:
+            day += datetime.timedelta(days=1)
+            continue
+
+        window_start = max(_localize(datetime.datetime.combine(day, working_hours[0]), tz), start_time)
+        window_end = min(_localize(datetime.datetime.combine(day, working_hours[1]), tz), end_time)
+
+        # Busy intervals ending before this window don't matter for any later one
+        while i < len(busy) and busy[i][1] <= window_start:
+            i += 1
+
+        cursor = window_start
+        j = i
+        while cursor < window_end:
+            if j < len(busy) and busy[j][0] < window_end:
+                free_end = busy[j][0]
+                next_cursor = max(cursor, busy[j][1])
+                j += 1
+            else:
+                free_end = window_end
+                next_cursor = window_end
+
+            if free_end - cursor >= min_duration:
+                slots.append((cursor, free_end))
+            cursor = next_cursor
+
+        day += datetime.timedelta(days=1)
+
+    return slots
+
+
+def clip_event(ev: CalendarEvent, start_time: datetime.datetime, end_time: datetime.datetime) -> Optional[CalendarEvent]:
+    """
+    Return part of the event falling between start (inclusive) and end
+    (exclusive) time, None if there is nothing there.
+    """
+
+    ev_start, ev_end = as_aware(ev.start_time), as_aware(ev.end_time)
+    start_time, end_time = as_aware(start_time), as_aware(end_time)
+
+    if ev_end <= start_time or ev_start >= end_time:
+        return None
+
+    if ev_start >= start_time and ev_end <= end_time:
+        return ev
+
+    return dataclasses.replace(ev, start_time=max(ev_start, start_time), end_time=min(ev_end, end_time))
+
+
+def bucket_events(events: List[CalendarEvent], boundaries: List[datetime.datetime]) -> List[List[CalendarEvent]]:
+    """
+    Put events in buckets between consecutive `boundaries` which should be
+    sorted. Events crossing a boundary are split and a part goes in each
+    bucket. Events outside the boundaries are dropped.
+    """
+
+    boundaries = [as_aware(b) for b in boundaries]
+    buckets: List[List[CalendarEvent]] = [[] for _ in range(len(boundaries) - 1)]
+
+    for ev in events:
+        # First bucket the event could fall in
+        i = max(bisect.bisect_right(boundaries, as_aware(ev.start_time)) - 1, 0)
+        while i < len(buckets) and boundaries[i] < as_aware(ev.end_time):
+            part = clip_event(ev, boundaries[i], boundaries[i + 1])
+            if part:
+                buckets[i].append(part)
+            i += 1
+
+    return buckets
@@ -2,197 +2,106 @@
 arwa
 
 Usage:
-  arwa slack bulk-invite <channel-name>
-  arwa slack export conversations --conversation-id=<conversation-id> --output-jsonl=<output-jsonl>
-  arwa slack export users --output-json=output-json
-  arwa slack post --text-file=<text-file> --channel-name=<channel-name>
-  arwa slack post --file=<file-to-upload> --channel-name=<channel-name>
-  arwa slack post bulk --template-file=<template-file> --bulk-post-config=<bulk-post-config>
-  arwa calendar report <email-id> [--n-next=<n-next>] [--n-prev=<n-prev>]
-  arwa calendar export --users-json=<users-json> --output-pickle=<output-pickle> [--n-next=<n-next>] [--n-prev=<n-prev>]
-  arwa calendar focus-wrap [--n-next=<n-next>]
+  arwa slack bulk-invite <channel-name> [--batch-size=<batch-size>] [--summary-json=<summary-json>] [--trace=<trace-file>]
+  arwa slack export conversations --conversation-id=<conversation-id> --output-jsonl=<output-jsonl> [--resume] [--oldest=<oldest>] [--threads] [--n-workers=<n-workers>] [--trace=<trace-file>]
+  arwa slack export workspace --output-dir=<output-dir> [--concurrency=<concurrency>] [--compression=<compression>] [--trace=<trace-file>]
+  arwa slack export users --output-json=output-json [--user-db=<user-db>] [--trace=<trace-file>]
+  arwa slack post --text-file=<text-file> --channel-name=<channel-name> [--trace=<trace-file>]
+  arwa slack post --file=<file-to-upload> --channel-name=<channel-name> [--trace=<trace-file>]
+  arwa slack post bulk --template-file=<template-file> --bulk-post-config=<bulk-post-config> [--delivery-log=<delivery-log>] [--n-workers=<n-workers>] [--dry-run] [--trace=<trace-file>]
+  arwa slack listen [--rtm-db=<rtm-db>] [--queue-size=<queue-size>] [--stats-interval=<stats-interval>] [--trace=<trace-file>]
+  arwa slack index [<export-path>...] [--rtm-db=<rtm-db>] [--index-db=<index-db>] [--trace=<trace-file>]
+  arwa slack search <query> [--channel=<channel>] [--user=<user>] [--limit=<limit>] [--index-db=<index-db>] [--trace=<trace-file>]
+  arwa slack schedule --text-file=<text-file> --channel-name=<channel-name> --at=<at> [--thread-ts=<thread-ts>] [--action-db=<action-db>] [--trace=<trace-file>]
+  arwa slack scheduler [--action-db=<action-db>] [--n-workers=<n-workers>] [--trace=<trace-file>]
+  arwa slack geo-report --ip2location-bin=<ip2location-bin> [--output-csv=<output-csv>] [--n-pages=<n-pages>] [--n-workers=<n-workers>] [--trace=<trace-file>]
+  arwa calendar report <email-id>... [--n-next=<n-next>] [--n-prev=<n-prev>] [--trace=<trace-file>]
+  arwa calendar export --users-json=<users-json> --output-dir=<output-dir> [--n-next=<n-next>] [--n-prev=<n-prev>] [--n-workers=<n-workers>] [--trace=<trace-file>]
+  arwa calendar analyze --input-dir=<input-dir> [--output-csv=<output-csv>] [--output-html=<output-html>] [--trace=<trace-file>]
+  arwa calendar free-slots <email-id>... [--n-days=<n-days>] [--min-duration=<min-duration>] [--working-hours=<working-hours>] [--timezone=<timezone>] [--trace=<trace-file>]
+  arwa calendar focus-wrap [--n-next=<n-next>] [--trace=<trace-file>]
 
 Options:
+  --batch-size=<batch-size>                   Number of users to invite in one call [default: 100].
+  --summary-json=<summary-json>               Write summary of invited and failed users here
+                                              instead of stdout.
+  --resume                                    Continue from the checkpoint saved next to the output
+                                              file. A completed export fetches only newer messages.
+  --oldest=<oldest>                           Only export messages after this ts.
+  --threads                                   Also export thread replies.
+  --n-workers=<n-workers>                     Number of parallel workers [default: 4].
+  --concurrency=<concurrency>                 Number of channels to export at once [default: 4].
+  --compression=<compression>                 Shard compression, gzip, zstd or none [default: gzip].
+  --user-db=<user-db>                         Local user directory, defaults to one in the arwa
+                                              cache directory.
+  --output-csv=<output-csv>                   Write the per user table here, weekly breakdown for
+                                              analyze and locations for geo-report.
+  --output-html=<output-html>                 Write an offline html dashboard here.
+  --n-days=<n-days>                           Number of days to look for free slots in [default: 14].
+  --min-duration=<min-duration>               Minimum length of a free slot in minutes [default: 30].
+  --working-hours=<working-hours>             Working hours as HH:MM-HH:MM [default: 09:00-18:00].
+  --timezone=<timezone>                       Timezone for working hours, local by default.
+  --rtm-db=<rtm-db>                           Sqlite store of live messages, defaults to one in the
+                                              arwa cache directory.
+  --queue-size=<queue-size>                   Messages held in memory before reading from slack
+                                              waits for writes [default: 10000].
+  --stats-interval=<stats-interval>           Seconds between printing listener counters [default: 60].
+  --index-db=<index-db>                       Search index, defaults to one in the arwa cache
+                                              directory.
+  --channel=<channel>                         Only search messages in this channel id.
+  --user=<user>                               Only search messages by this user id.
+  --limit=<limit>                             Number of results to show [default: 20].
+  --at=<at>                                   Time to send the message at, in ISO format. Local
+                                              time if no offset is given.
+  --thread-ts=<thread-ts>                     Send the message as a reply in this thread.
+  --action-db=<action-db>                     Store of scheduled messages, defaults to one in the
+                                              arwa cache directory.
+  --ip2location-bin=<ip2location-bin>         IP2Location BIN database file.
+  --n-pages=<n-pages>                         Most pages of access logs to look at [default: 100].
   --bulk-post-config=<bulk-post-config>       Yaml config for bulk text.
+  --delivery-log=<delivery-log>               Log of delivered bulk messages which are skipped on
+                                              rerun. Defaults to one next to the bulk post config.
+  --dry-run                                   Only render the messages and report throughput.
   --n-next=<n-next>                           Number of future weeks to look in [default: 2].
   --n-prev=<n-prev>                           Number of past weeks to look in [default: 2].
+  --trace=<trace-file>                        Write a timeline of API calls with their latency,
+                                              payload size, retries and rate limit waits here and
+                                              print latencies per method at the end. Chrome trace
+                                              format, or JSON lines if the name ends in .jsonl.
 
 Arguments:
+  <export-path>                               Conversation export or directory of workspace export
+                                              shards to index.
   focus-wrap                                  Add focus time blocks before and after every
-                                              meeting starting now.
+                                              meeting starting now. Blocks already on the
+                                              calendar are not added again.
 """
 
-import dataclasses
-import datetime
-import json
-import os
-import pickle
-
-import jinja2
-import jsonlines
-import slack
-import yaml
 from docopt import docopt
-from pydash import py_
-from tabulate import tabulate
-from tqdm import tqdm
-from gcsa.google_calendar import GoogleCalendar
 
 from arwa import __version__
-from arwa.calendar_utils import (get_last_day_of_month, get_last_sunday,
-                                 parse_google_calendar, report_events_summary,
-                                 is_event_personal, register_event,
-                                 get_focus_wrap, is_day_long_event)
-from arwa.slack_utils import (channel_name_to_id, get_message_batches,
-                              list_users)
-from arwa.types import SlackUser
 
 
 def main():
     args = docopt(__doc__, version=__version__)
 
-    if args["slack"]:
-        if args["bulk-invite"]:
-            client = slack.WebClient(os.environ["SLACK_BOT_USER_TOKEN"])
-            channel_id = channel_name_to_id(args["<channel-name>"], client)
-            users = list_users(client)
-
-            print(f"Inviting {len(users)} to {args['<channel-name>']}")
-
-            for u in tqdm(users):
-                try:
-                    client.conversations_invite(channel=channel_id, users=[u.id])
-                except Exception as e:
-                    print(e)
-
-        elif args["export"]:
-            client = slack.WebClient(os.environ["SLACK_USER_TOKEN"])
-
-            if args["conversations"]:
-                conversation_id = args["--conversation-id"]
-                with jsonlines.open(args["--output-jsonl"], mode="w") as fp:
-                    bar = tqdm()
-                    for batch in get_message_batches(conversation_id, client):
-                        fp.write_all(batch)
-                        bar.update(len(batch))
-
-            elif args["users"]:
-                with open(args["--output-json"], "w") as fp:
-                    users = list_users(client)
-                    json.dump([dataclasses.asdict(u) for u in users], fp)
-
-        elif args["post"]:
-            client = slack.WebClient(os.environ["SLACK_BOT_USER_TOKEN"])
-
-            if args["--text-file"]:
-                with open(args["--text-file"]) as fp:
-                    text = fp.read()
-
-                channel_id = channel_name_to_id(args["--channel-name"], client)
-                client.chat_postMessage(
-                    channel=channel_id,
-                    text="",
-                    blocks=[{
-                        "type": "section",
-                        "text": {
-                            "type": "mrkdwn",
-                            "text": text
-                        }
-                    }]
-                )
-
-            if args["--file"]:
-                response = client.files_upload(
-                    channels=args["--channel-name"],
-                    file=args["--file"],
-                    initial_comment=""
-                )
-
-            if args["bulk"]:
-                with open(args["--template-file"]) as fp:
-                    template = jinja2.Template(fp.read())
-
-                with open(args["--bulk-post-config"]) as fp:
-                    bulk_items = yaml.safe_load(fp)
-
-                for item in tqdm(bulk_items):
-                    variables = item.get("variables", {})
-                    response = client.conversations_open(users=item["user-ids"])
-                    client.chat_postMessage(channel=response["channel"]["id"], text=template.render(**variables))
-
-    if args["calendar"]:
-        if args["report"]:
-            email_id = args["<email-id>"]
-            n_prev = int(args["--n-prev"])
-            n_next = int(args["--n-next"])
-
-            anchor_dt = get_last_sunday()
-            delta = datetime.timedelta(days=7)
-
-            start_dts = [anchor_dt - (delta * i) for i in range(n_prev, -(n_next + 1), -1)]
-
-            headers = ["Start", "End", "Total Hours", "Personal Block", "External", "1:1", "Rest"]
-
-            table = []
-            for start_time in start_dts:
-                end_time = start_time + delta
-                evs = parse_google_calendar(email_id, start_time, end_time)
-                summary = report_events_summary(evs)
-
-                table.append((
-                    start_time.date(), end_time.date(),
-                    summary["total"], summary["personal"], summary["external"], summary["1:1"], summary["rest"]
-                ))
-
-            print(tabulate(
-                table,
-                headers=headers,
-                tablefmt="fancy_grid"
-            ))
-
-        elif args["export"]:
-            with open(args["--users-json"]) as fp:
-                users = [SlackUser(**it) for it in json.load(fp)]
-
-            n_prev = int(args["--n-prev"])
-            n_next = int(args["--n-next"])
-
-            today = datetime.datetime.today()
-            anchor_dt = today.replace(day=1, hour=0, minute=0, second=0, microsecond=0)  # First day of the month
-
-            start_dt = anchor_dt
-            for _ in range(n_prev):
-                start_dt -= datetime.timedelta(days=1)  # Subtracting a day to go to past month
-                start_dt = start_dt.replace(day=1)
-
-            end_dt = get_last_day_of_month(anchor_dt)
-            for _ in range(n_next):
-                end_dt += datetime.timedelta(days=1)
-                end_dt = get_last_day_of_month(end_dt)
-
-            output = {}
-            for user in tqdm(users):
-                if user.email:
-                    events = parse_google_calendar(user.email, start_dt, end_dt)
-                    output[user.email] = events
-
-            with open(args["--output-pickle"], "wb") as fp:
-                pickle.dump(output, fp)
-
-        elif args["focus-wrap"]:
-            n_next = int(args["--n-next"])
-
-            start_dt = datetime.datetime.now()
-            delta = datetime.timedelta(days=7)
-
-            evs = parse_google_calendar("", start_dt, start_dt + (delta * n_next))
-            cal = GoogleCalendar()
-
-            for ev in tqdm(evs):
-                if is_event_personal(ev) or is_day_long_event(ev):
-                    # Personal events cover focus time too
-                    continue
-
-                pre_ev, post_ev = get_focus_wrap(ev)
-                register_event(cal, pre_ev)
-                register_event(cal, post_ev)
+    # Commands import their dependencies only when run, which keeps startup
+    # and --help fast
+    group = "slack" if args["slack"] else "calendar"
+    if group == "slack":
+        from arwa.commands import slack as commands
+    else:
+        from arwa.commands import calendar as commands
+
+    if args["--trace"]:
+        from arwa import trace
+
+        command = next(command for command in commands.COMMANDS if args[command])
+        trace.start(args["--trace"])
+        try:
+            with trace.span(f"arwa {group} {command}", "cli"):
+                commands.run(args)
+        finally:
+            trace.stop()
+    else:
+        commands.run(args)
@@ -0,0 +1,4 @@
+"""
+Handlers for the cli subcommands. Each handler imports what it needs when
+called so that a command loads only its own dependencies.
+"""
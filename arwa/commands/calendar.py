@@ -0,0 +1,187 @@
+"""
+Handlers for `arwa calendar` commands.
+"""
+
+import datetime
+import json
+from typing import Dict
+
+from arwa.storage import EventStore, default_cache_path
+
+
+def report(args: Dict, store: EventStore):
+    from tabulate import tabulate
+
+    from arwa.calendar_utils import (bucket_events, get_last_sunday, is_day_long_event, parse_google_calendars,
+                                     report_events_summary)
+
+    email_ids = args["<email-id>"]
+    n_prev = int(args["--n-prev"])
+    n_next = int(args["--n-next"])
+
+    anchor_dt = get_last_sunday()
+    delta = datetime.timedelta(days=7)
+
+    boundaries = [anchor_dt - (delta * i) for i in range(n_prev, -(n_next + 2), -1)]
+
+    # One fetch for the whole range per user, bucketing in weeks is local
+    calendars = parse_google_calendars(email_ids, boundaries[0], boundaries[-1], store=store)
+    user_events = [calendars[email_id] for email_id in email_ids]
+
+    headers = ["Start", "End", "Total Hours", "Personal Block", "External", "1:1", "Rest"]
+    if len(email_ids) > 1:
+        headers = ["User"] + headers
+
+    table = []
+    for email_id, evs in zip(email_ids, user_events):
+        evs = [ev for ev in evs if not is_day_long_event(ev)]
+        for start_time, end_time, week_evs in zip(boundaries, boundaries[1:], bucket_events(evs, boundaries)):
+            summary = report_events_summary(week_evs)
+
+            row = (
+                start_time.date(), end_time.date(),
+                summary["total"], summary["personal"], summary["external"], summary["1:1"], summary["rest"]
+            )
+            table.append(((email_id,) + row) if len(email_ids) > 1 else row)
+
+    print(tabulate(
+        table,
+        headers=headers,
+        tablefmt="fancy_grid"
+    ))
+
+
+def export(args: Dict, store: EventStore):
+    from arwa.calendar_export import export_calendars
+    from arwa.calendar_utils import get_last_day_of_month
+    from arwa.types import SlackUser
+
+    with open(args["--users-json"]) as fp:
+        users = [SlackUser(**it) for it in json.load(fp)]
+
+    n_prev = int(args["--n-prev"])
+    n_next = int(args["--n-next"])
+
+    today = datetime.datetime.today()
+    anchor_dt = today.replace(day=1, hour=0, minute=0, second=0, microsecond=0)  # First day of the month
+
+    start_dt = anchor_dt
+    for _ in range(n_prev):
+        start_dt -= datetime.timedelta(days=1)  # Subtracting a day to go to past month
+        start_dt = start_dt.replace(day=1)
+
+    end_dt = get_last_day_of_month(anchor_dt)
+    for _ in range(n_next):
+        end_dt += datetime.timedelta(days=1)
+        end_dt = get_last_day_of_month(end_dt)
+
+    summary = export_calendars(
+        [user.email for user in users if user.email], start_dt, end_dt,
+        args["--output-dir"], n_workers=int(args["--n-workers"]), store=store
+    )
+    print(f"Exported {len(summary['exported'])}, skipped {len(summary['skipped'])}, failed {len(summary['failed'])}")
+    for email, error in summary["failed"].items():
+        print(f"{email}: {error}")
+
+
+def analyze(args: Dict, store: EventStore):
+    from tabulate import tabulate
+
+    from arwa.calendar_analytics import render_dashboard, weekly_breakdown
+    from arwa.calendar_export import load_calendar_export
+
+    breakdown = weekly_breakdown(load_calendar_export(args["--input-dir"]))
+
+    if args["--output-csv"]:
+        breakdown.to_csv(args["--output-csv"])
+    if args["--output-html"]:
+        render_dashboard(breakdown, args["--output-html"])
+
+    team = breakdown.groupby(level="week").sum()
+    print(tabulate(
+        [(week.date(), *row) for week, row in zip(team.index, team.itertuples(index=False))],
+        headers=["Week", "Total Hours", "Personal Block", "External", "1:1", "Rest"],
+        tablefmt="fancy_grid"
+    ))
+
+
+def free_slots(args: Dict, store: EventStore):
+    import pytz
+    from tabulate import tabulate
+
+    from arwa.calendar_utils import find_free_slots, parse_google_calendars
+
+    email_ids = args["<email-id>"]
+    start_dt = datetime.datetime.now().astimezone()
+    end_dt = start_dt + datetime.timedelta(days=int(args["--n-days"]))
+
+    # Whole days so the window stays put through the day and the store keeps
+    # serving it with incremental syncs
+    day_start = datetime.datetime.combine(start_dt.date(), datetime.time.min)
+    user_calendars = parse_google_calendars(
+        email_ids, day_start, day_start + datetime.timedelta(days=int(args["--n-days"]) + 1), store=store
+    )
+    calendars = [user_calendars[email_id] for email_id in email_ids]
+
+    working_hours = tuple(
+        datetime.datetime.strptime(t, "%H:%M").time()
+        for t in args["--working-hours"].split("-")
+    )
+    tz = pytz.timezone(args["--timezone"]) if args["--timezone"] else None
+
+    slots = find_free_slots(
+        calendars, start_dt, end_dt,
+        datetime.timedelta(minutes=int(args["--min-duration"])),
+        working_hours=working_hours, tz=tz
+    )
+
+    print(tabulate(
+        [(start.astimezone(tz).strftime("%a %Y-%m-%d %H:%M"), end.astimezone(tz).strftime("%H:%M"),
+          (end - start).total_seconds() / 60)
+         for start, end in slots],
+        headers=["Start", "End", "Minutes"],
+        tablefmt="fancy_grid"
+    ))
+
+
+def focus_wrap(args: Dict, store: EventStore):
+    from arwa.calendar_utils import as_aware, get_calendar_service, get_last_sunday, parse_google_calendar
+    from arwa.focus_wrap import insert_events, plan_focus_blocks
+
+    n_next = int(args["--n-next"])
+
+    anchor_dt = get_last_sunday()
+    delta = datetime.timedelta(days=7)
+
+    # Whole weeks like report, so the window stays put through the week and
+    # the store keeps serving it with incremental syncs
+    evs = parse_google_calendar("", anchor_dt, anchor_dt + (delta * (n_next + 1)), store=store)
+
+    now = datetime.datetime.now().astimezone()
+    blocks = [block for block in plan_focus_blocks(evs) if as_aware(block.start_time) >= now]
+
+    if blocks:
+        summary = insert_events(get_calendar_service(), blocks)
+        print(f"Added {summary['inserted']} focus blocks, failed {len(summary['failed'])}")
+        for failure in summary["failed"]:
+            print(failure["error"])
+    else:
+        print("Focus blocks are already in place")
+
+
+COMMANDS = {
+    "report": report,
+    "export": export,
+    "analyze": analyze,
+    "free-slots": free_slots,
+    "focus-wrap": focus_wrap,
+}
+
+
+def run(args: Dict):
+    # Calendars are synced incrementally in a local store and served from there
+    store = EventStore(default_cache_path("calendar.db"))
+
+    for command, handler in COMMANDS.items():
+        if args[command]:
+            return handler(args, store)
@@ -0,0 +1,278 @@
+"""
+Handlers for `arwa slack` commands.
+"""
+
+import asyncio
+import datetime
+import json
+import os
+import signal
+from typing import Dict
+
+from arwa.storage import default_cache_path
+
+
+def bulk_invite(args: Dict):
+    from arwa.slack_client import get_client
+    from arwa.slack_utils import bulk_invite, channel_name_to_id, list_users
+
+    client = get_client("SLACK_BOT_USER_TOKEN")
+    channel_id = channel_name_to_id(args["<channel-name>"], client)
+    users = list_users(client)
+
+    summary = bulk_invite(client, channel_id, [u.id for u in users], batch_size=int(args["--batch-size"]))
+
+    if args["--summary-json"]:
+        with open(args["--summary-json"], "w") as fp:
+            json.dump(summary, fp)
+        print(f"Invited {len(summary['invited'])}, skipped {len(summary['skipped'])}, failed {len(summary['failed'])}")
+    else:
+        print(json.dumps(summary))
+
+
+def export(args: Dict):
+    from arwa.slack_client import get_client
+
+    client = get_client("SLACK_USER_TOKEN")
+
+    if args["conversations"]:
+        from arwa.slack_export import export_conversation
+
+        export_conversation(
+            client, args["--conversation-id"], args["--output-jsonl"],
+            resume=args["--resume"], oldest=args["--oldest"],
+            threads=args["--threads"], n_workers=int(args["--n-workers"])
+        )
+
+    elif args["workspace"]:
+        from arwa.slack_export import export_workspace
+
+        entries = export_workspace(
+            client, args["--output-dir"],
+            concurrency=int(args["--concurrency"]), compression=args["--compression"]
+        )
+        n_messages = sum(it.get("messages", 0) for it in entries)
+        failed = [it["name"] or it["id"] for it in entries if "error" in it]
+        print(f"Exported {n_messages} messages from {len(entries) - len(failed)} channels")
+        if failed:
+            print(f"Failed channels: {', '.join(failed)}")
+
+    elif args["users"]:
+        import dataclasses
+
+        from arwa.slack_utils import refresh_user_directory
+        from arwa.storage import UserDirectory
+
+        directory = UserDirectory(args["--user-db"] or default_cache_path("users.db"))
+        refresh_user_directory(directory, client)
+
+        with open(args["--output-json"], "w") as fp:
+            fp.write("[")
+            for i, u in enumerate(directory.iter_users()):
+                if i > 0:
+                    fp.write(", ")
+                json.dump(dataclasses.asdict(u), fp)
+            fp.write("]")
+
+
+def listen(args: Dict):
+    from arwa.slack_client import get_async_client
+    from arwa.slack_listen import SlackListener
+    from arwa.storage import SqliteDB
+
+    async def _listen():
+        client = get_async_client("SLACK_CLASSIC_BOT_USER_TOKEN")
+        db = SqliteDB(args["--rtm-db"] or default_cache_path("rtm.db"))
+        listener = SlackListener(client, db, queue_size=int(args["--queue-size"]))
+
+        loop = asyncio.get_running_loop()
+        for sig in [signal.SIGINT, signal.SIGTERM]:
+            loop.add_signal_handler(sig, listener.stop.set)
+
+        try:
+            await listener.run(stats_interval=float(args["--stats-interval"]))
+        finally:
+            await client.close()
+            db.close()
+
+    asyncio.run(_listen())
+
+
+def geo_report(args: Dict):
+    import csv
+
+    from tabulate import tabulate
+
+    from arwa.geo import GEO_REPORT_COLUMNS, GeoLocator, geo_report
+    from arwa.slack_client import get_client
+    from arwa.slack_utils import last_user_access, list_users
+
+    # Access logs need an admin user's token
+    client = get_client("SLACK_USER_TOKEN")
+    users = list_users(client)
+
+    access = last_user_access(
+        client, n_pages=int(args["--n-pages"]), user_ids=[u.id for u in users],
+        n_workers=int(args["--n-workers"])
+    )
+    rows = geo_report(access, GeoLocator(args["--ip2location-bin"]))
+
+    if args["--output-csv"]:
+        with open(args["--output-csv"], "w", newline="") as fp:
+            writer = csv.DictWriter(fp, fieldnames=GEO_REPORT_COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+    else:
+        print(tabulate(rows, headers="keys", tablefmt="fancy_grid"))
+
+
+def index(args: Dict):
+    from arwa.search import SearchIndex, export_files
+    from arwa.storage import SqliteDB
+
+    search_index = SearchIndex(args["--index-db"] or default_cache_path("search.db"))
+
+    n_indexed = 0
+    for path in args["<export-path>"]:
+        for export_file in export_files(path):
+            n_indexed += search_index.index_export(export_file)
+
+    rtm_db = args["--rtm-db"] or default_cache_path("rtm.db")
+    if os.path.exists(rtm_db):
+        with SqliteDB(rtm_db) as db:
+            n_indexed += search_index.index_store(db)
+
+    print(f"Indexed {n_indexed} new messages")
+
+
+def search(args: Dict):
+    from tabulate import tabulate
+
+    from arwa.search import SearchIndex
+
+    search_index = SearchIndex(args["--index-db"] or default_cache_path("search.db"))
+    results = search_index.search(
+        args["<query>"], channel=args["--channel"], user=args["--user"], limit=int(args["--limit"])
+    )
+
+    print(tabulate(
+        [(r["channel"], r["user"], r["ts"], r["text"]) for r in results],
+        headers=["Channel", "User", "Ts", "Text"],
+        tablefmt="fancy_grid", disable_numparse=True
+    ))
+
+
+def schedule(args: Dict):
+    from arwa.slack_client import get_client
+    from arwa.slack_utils import channel_name_to_id
+    from arwa.storage import ActionStore
+    from arwa.types import SlackMessageAction
+
+    client = get_client("SLACK_BOT_USER_TOKEN")
+    with open(args["--text-file"]) as fp:
+        text = fp.read()
+
+    store = ActionStore(args["--action-db"] or default_cache_path("actions.db"))
+    action_id = store.add(SlackMessageAction(
+        scheduled=datetime.datetime.fromisoformat(args["--at"]),
+        message=text,
+        channel=channel_name_to_id(args["--channel-name"], client),
+        thread_ts=args["--thread-ts"]
+    ))
+    print(f"Scheduled message {action_id}")
+
+
+def scheduler(args: Dict):
+    from arwa.scheduler import Scheduler
+    from arwa.slack_client import get_async_client
+    from arwa.storage import ActionStore
+
+    async def _schedule():
+        client = get_async_client("SLACK_BOT_USER_TOKEN")
+        store = ActionStore(args["--action-db"] or default_cache_path("actions.db"))
+        action_scheduler = Scheduler(client, store, concurrency=int(args["--n-workers"]))
+
+        loop = asyncio.get_running_loop()
+        for sig in [signal.SIGINT, signal.SIGTERM]:
+            loop.add_signal_handler(sig, action_scheduler.stop.set)
+
+        try:
+            await action_scheduler.run()
+        finally:
+            await client.close()
+            print(json.dumps(store.counts()))
+
+    asyncio.run(_schedule())
+
+
+def post(args: Dict):
+    from arwa.slack_client import get_client
+
+    # Dry runs are offline
+    client = None if args["--dry-run"] else get_client("SLACK_BOT_USER_TOKEN")
+
+    if args["--text-file"]:
+        from arwa.slack_utils import channel_name_to_id
+
+        with open(args["--text-file"]) as fp:
+            text = fp.read()
+
+        channel_id = channel_name_to_id(args["--channel-name"], client)
+        client.chat_postMessage(
+            channel=channel_id,
+            text="",
+            blocks=[{
+                "type": "section",
+                "text": {
+                    "type": "mrkdwn",
+                    "text": text
+                }
+            }]
+        )
+
+    if args["--file"]:
+        client.files_upload(
+            channels=args["--channel-name"],
+            file=args["--file"],
+            initial_comment=""
+        )
+
+    if args["bulk"]:
+        import yaml
+
+        from arwa.bulk_post import default_delivery_log, dispatch_bulk_post, dry_run_bulk_post
+
+        with open(args["--template-file"]) as fp:
+            template_text = fp.read()
+
+        with open(args["--bulk-post-config"]) as fp:
+            bulk_items = yaml.safe_load(fp)
+
+        if args["--dry-run"]:
+            summary = dry_run_bulk_post(template_text, bulk_items)
+        else:
+            summary = dispatch_bulk_post(
+                client, template_text, bulk_items,
+                args["--delivery-log"] or default_delivery_log(args["--bulk-post-config"]),
+                n_workers=int(args["--n-workers"])
+            )
+        print(json.dumps(summary))
+
+
+COMMANDS = {
+    "bulk-invite": bulk_invite,
+    "export": export,
+    "listen": listen,
+    "geo-report": geo_report,
+    "index": index,
+    "search": search,
+    "schedule": schedule,
+    "scheduler": scheduler,
+    "post": post,
+}
+
+
+def run(args: Dict):
+    for command, handler in COMMANDS.items():
+        if args[command]:
+            return handler(args)
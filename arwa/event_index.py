@@ -0,0 +1,115 @@
+"""
+Index over calendar events for answering overlap queries without checking
+every pair of events.
+"""
+
+import datetime
+from typing import Iterable, List, Union
+
+from arwa.calendar_utils import as_aware
+from arwa.types import CalendarEvent
+
+Time = Union[datetime.date, datetime.datetime, float]
+
+
+def to_timestamp(t: Time) -> float:
+    return t if isinstance(t, (int, float)) else as_aware(t).timestamp()
+
+
+class EventIndex:
+    """
+    Static interval tree over events. Events are kept in arrays sorted by start
+    and an implicit balanced tree over those arrays stores the latest end time
+    in each subtree, which lets queries skip subtrees that can't overlap.
+
+    Intervals are half open, [start, end), as in `is_overlapping`, so zero
+    length events never overlap anything and are left out. Queries take
+    datetimes or epoch seconds and return events sorted by start time.
+    """
+
+    def __init__(self, events: Iterable[CalendarEvent]):
+        rows = [(to_timestamp(ev.start_time), to_timestamp(ev.end_time), ev) for ev in events]
+        rows = sorted((it for it in rows if it[0] < it[1]), key=lambda it: (it[0], it[1]))
+
+        self.starts = [it[0] for it in rows]
+        self.ends = [it[1] for it in rows]
+        self.events = [it[2] for it in rows]
+        self.max_end = [0.0] * len(rows)
+        self._build(0, len(rows))
+
+    def _build(self, lo: int, hi: int) -> float:
+        if lo >= hi:
+            return float("-inf")
+
+        mid = (lo + hi) // 2
+        self.max_end[mid] = max(self.ends[mid], self._build(lo, mid), self._build(mid + 1, hi))
+        return self.max_end[mid]
+
+    def __len__(self) -> int:
+        return len(self.events)
+
+    def __iter__(self):
+        return iter(self.events)
+
+    def _query(self, start: float, end: float, closed_start: bool, first_only=False) -> List[int]:
+        found = []
+        stack = [(0, len(self.events))]
+
+        while stack:
+            lo, hi = stack.pop()
+            if lo >= hi:
+                continue
+
+            mid = (lo + hi) // 2
+            if self.max_end[mid] <= start:
+                # Everything in this subtree is over before the query starts
+                continue
+
+            stack.append((lo, mid))
+
+            ev_start = self.starts[mid]
+            if ev_start < end or (closed_start and ev_start == end):
+                if self.ends[mid] > start:
+                    found.append(mid)
+                    if first_only:
+                        break
+                stack.append((mid + 1, hi))
+
+        return sorted(found)
+
+    def stab(self, t: Time) -> List[CalendarEvent]:
+        """
+        Return events going on at time `t`.
+        """
+
+        ts = to_timestamp(t)
+        return [self.events[i] for i in self._query(ts, ts, closed_start=True)]
+
+    def overlapping(self, start: Time, end: Time) -> List[CalendarEvent]:
+        """
+        Return events overlapping the time range.
+        """
+
+        qs, qe = to_timestamp(start), to_timestamp(end)
+        if qs >= qe:
+            return []
+
+        return [self.events[i] for i in self._query(qs, qe, closed_start=False)]
+
+    def overlaps(self, start: Time, end: Time) -> bool:
+        """
+        Tell if any event overlaps the time range.
+        """
+
+        qs, qe = to_timestamp(start), to_timestamp(end)
+        if qs >= qe:
+            return False
+
+        return bool(self._query(qs, qe, closed_start=False, first_only=True))
+
+    def overlapping_events(self, ev: CalendarEvent) -> List[CalendarEvent]:
+        """
+        Return events overlapping the given event.
+        """
+
+        return self.overlapping(ev.start_time, ev.end_time)
@@ -0,0 +1,130 @@
+"""
+Array backed storage for large numbers of calendar events.
+"""
+
+import datetime
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+
+from arwa.calendar_utils import as_aware
+from arwa.types import CalendarEvent
+
+
+class StringTable:
+    """
+    Shared table giving each distinct string an integer id.
+    """
+
+    def __init__(self):
+        self.strings: List[str] = []
+        self.ids: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.strings)
+
+    def add(self, value: str) -> int:
+        if value not in self.ids:
+            self.ids[value] = len(self.strings)
+            self.strings.append(value)
+        return self.ids[value]
+
+
+class EventTable:
+    """
+    Columnar table of events. Start and end times are int64 epoch seconds and
+    names, attendees and response statuses are ids into a string table that
+    can be shared across tables. Attendees of event `i` are
+    `attendee_ids[attendee_offsets[i]:attendee_offsets[i + 1]]`.
+
+    Iterating or indexing gives `CalendarEvent` views made on the fly, with
+    times in timezone `tz`, so helpers working on lists of events work on the
+    table too. Times are local by default, like `as_aware` takes them, so day
+    long events come back as datetimes at local midnight.
+    """
+
+    def __init__(self, names: np.ndarray, starts: np.ndarray, ends: np.ndarray,
+                 attendee_offsets: np.ndarray, attendee_ids: np.ndarray, response_status: np.ndarray,
+                 strings: StringTable, tz: Optional[datetime.tzinfo] = None):
+        self.names = names
+        self.starts = starts
+        self.ends = ends
+        self.attendee_offsets = attendee_offsets
+        self.attendee_ids = attendee_ids
+        self.response_status = response_status
+        self.strings = strings
+        self.tz = tz
+
+    @classmethod
+    def from_events(cls, events: Iterable[CalendarEvent], strings: Optional[StringTable] = None,
+                    tz: Optional[datetime.tzinfo] = None) -> "EventTable":
+        strings = StringTable() if strings is None else strings
+
+        names, starts, ends, statuses = [], [], [], []
+        offsets, attendee_ids = [0], []
+
+        for ev in events:
+            names.append(strings.add(ev.name or ""))
+            starts.append(int(as_aware(ev.start_time).timestamp()))
+            ends.append(int(as_aware(ev.end_time).timestamp()))
+            # -1 marks a missing response
+            statuses.append(strings.add(ev.response_status) if ev.response_status else -1)
+            attendee_ids.extend(strings.add(email) for email in ev.attendees)
+            offsets.append(len(attendee_ids))
+
+        return cls(
+            names=np.array(names, dtype=np.int32),
+            starts=np.array(starts, dtype=np.int64),
+            ends=np.array(ends, dtype=np.int64),
+            attendee_offsets=np.array(offsets, dtype=np.int64),
+            attendee_ids=np.array(attendee_ids, dtype=np.int32),
+            response_status=np.array(statuses, dtype=np.int32),
+            strings=strings,
+            tz=tz
+        )
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Bytes taken by the arrays, leaving out the shared string table.
+        """
+
+        return sum(a.nbytes for a in [
+            self.names, self.starts, self.ends, self.attendee_offsets, self.attendee_ids, self.response_status
+        ])
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def __getitem__(self, i: int) -> CalendarEvent:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("event index out of range")
+
+        strings = self.strings.strings
+        lo, hi = self.attendee_offsets[i], self.attendee_offsets[i + 1]
+        status = self.response_status[i]
+
+        return CalendarEvent(
+            name=strings[self.names[i]],
+            start_time=self._datetime(self.starts[i]),
+            end_time=self._datetime(self.ends[i]),
+            attendees=[strings[j] for j in self.attendee_ids[lo:hi]],
+            response_status=strings[status] if status >= 0 else None
+        )
+
+    def _datetime(self, ts: np.int64) -> datetime.datetime:
+        if self.tz is None:
+            return datetime.datetime.fromtimestamp(int(ts)).astimezone()
+        return datetime.datetime.fromtimestamp(int(ts), self.tz)
+
+    def __iter__(self) -> Iterator[CalendarEvent]:
+        return (self[i] for i in range(len(self)))
+
+    def durations(self) -> np.ndarray:
+        """
+        Return event durations in minutes.
+        """
+
+        return (self.ends - self.starts) / 60
@@ -0,0 +1,108 @@
+"""
+Adding focus time blocks around meetings. Blocks are planned against what is
+already on the calendar so that running again only adds what's missing.
+"""
+
+import datetime
+from typing import Dict, List, Tuple
+
+from arwa import trace
+from arwa.calendar_utils import BATCH_SIZE, as_aware, get_focus_wrap, is_day_long_event, is_event_personal
+from arwa.event_index import EventIndex
+from arwa.types import CalendarEvent
+
+FOCUS_PREFIX = "ARWA: "
+MERGED_BLOCK_NAME = "ARWA: Focus Block"
+
+
+def is_focus_block(ev: CalendarEvent) -> bool:
+    return bool(ev.name) and ev.name.startswith(FOCUS_PREFIX)
+
+
+def subtract_busy(ev: CalendarEvent, busy: EventIndex) -> List[Tuple[datetime.datetime, datetime.datetime]]:
+    """
+    Return parts of the event's time not covered by any event in `busy`.
+    """
+
+    start, end = as_aware(ev.start_time), as_aware(ev.end_time)
+
+    free = []
+    for other in busy.overlapping(start, end):
+        other_start, other_end = as_aware(other.start_time), as_aware(other.end_time)
+        if other_start > start:
+            free.append((start, other_start))
+        start = max(start, other_end)
+        if start >= end:
+            return free
+
+    free.append((start, end))
+    return free
+
+
+def plan_focus_blocks(events: List[CalendarEvent]) -> List[CalendarEvent]:
+    """
+    Return focus blocks to add around meetings in `events`. Parts of blocks
+    falling on other events, including blocks added earlier, are left out and
+    blocks touching each other are merged into one.
+    """
+
+    busy = EventIndex(ev for ev in events if not is_day_long_event(ev))
+
+    pieces: List[Tuple[datetime.datetime, datetime.datetime, str]] = []
+    for ev in events:
+        if is_focus_block(ev) or is_event_personal(ev) or is_day_long_event(ev):
+            # Personal events cover focus time too
+            continue
+
+        for block in get_focus_wrap(ev):
+            pieces.extend((start, end, block.name) for start, end in subtract_busy(block, busy))
+
+    blocks: List[CalendarEvent] = []
+    for start, end, name in sorted(pieces):
+        if blocks and start <= blocks[-1].end_time:
+            last = blocks[-1]
+            if end > last.end_time or name != last.name:
+                blocks[-1] = CalendarEvent(
+                    last.name if name == last.name else MERGED_BLOCK_NAME,
+                    start_time=last.start_time,
+                    end_time=max(end, last.end_time),
+                    attendees=[]
+                )
+        else:
+            blocks.append(CalendarEvent(name, start_time=start, end_time=end, attendees=[]))
+
+    return blocks
+
+
+def event_body(ev: CalendarEvent) -> Dict:
+    return {
+        "summary": ev.name,
+        "start": {"dateTime": as_aware(ev.start_time).isoformat()},
+        "end": {"dateTime": as_aware(ev.end_time).isoformat()}
+    }
+
+
+def insert_events(service, events: List[CalendarEvent], calendar_id="primary", batch_size=BATCH_SIZE) -> Dict:
+    """
+    Insert events on the calendar using batch requests of at most `batch_size`
+    calls each. Return counts of `inserted` events and a list of `failed`
+    ones with their errors.
+    """
+
+    summary: Dict = {"inserted": 0, "failed": []}
+
+    def _callback(request_id, response, exception):
+        if exception is None:
+            summary["inserted"] += 1
+        else:
+            summary["failed"].append({"event": request_id, "error": str(exception)})
+
+    for i in range(0, len(events), batch_size):
+        batch = service.new_batch_http_request(callback=_callback)
+        chunk = events[i:i + batch_size]
+        for j, ev in enumerate(chunk, start=i):
+            batch.add(service.events().insert(calendarId=calendar_id, body=event_body(ev)), request_id=str(j))
+        with trace.span("calendar.batch", "calendar", calls=len(chunk)):
+            batch.execute()
+
+    return summary
@@ -1,14 +1,58 @@
+import functools
+from typing import Dict, Iterable, List
+
 import IP2Location
 
+from arwa.types import SlackUser
+
+LOOKUP_CACHE_SIZE = 65536
+
+GEO_REPORT_COLUMNS = ["user_id", "name", "ip", "country", "region", "city", "date_last"]
+
 
 class GeoLocator:
     """
     Simple IP address geolocator.
+
+    The BIN file is memory mapped by default so lookups read pages from the
+    OS cache instead of seeking the file, and results are cached per IP.
     """
 
-    def __init__(self, ip2location_bin: str):
-        self.ip2l = IP2Location.IP2Location()
+    def __init__(self, ip2location_bin: str, mode="SHARED_MEMORY", cache_size=LOOKUP_CACHE_SIZE):
+        self.ip2l = IP2Location.IP2Location(mode=mode)
         self.ip2l.open(ip2location_bin)
+        self.lookup = functools.lru_cache(maxsize=cache_size)(self._lookup)
 
-    def lookup(self, ip: str):
+    def _lookup(self, ip: str):
         return self.ip2l.get_all(ip)
+
+    def lookup_many(self, ips: Iterable[str]) -> Dict:
+        """
+        Return map from IP to location, looking up each distinct IP once.
+        """
+
+        return {ip: self.lookup(ip) for ip in set(ips)}
+
+
+def geo_report(access: Dict[SlackUser, Dict], locator: GeoLocator) -> List[Dict]:
+    """
+    Return location of the latest access of each user, as rows sorted by
+    country and user name.
+    """
+
+    locations = locator.lookup_many(login["ip"] for login in access.values() if login.get("ip"))
+
+    rows = []
+    for user, login in access.items():
+        location = locations.get(login.get("ip"))
+        rows.append({
+            "user_id": user.id,
+            "name": user.name,
+            "ip": login.get("ip"),
+            "country": location.country_long if location else None,
+            "region": location.region if location else None,
+            "city": location.city if location else None,
+            "date_last": login.get("date_last")
+        })
+
+    return sorted(rows, key=lambda row: (row["country"] or "", row["name"] or ""))
@@ -0,0 +1,150 @@
+"""
+Rate limiting helpers for staying within Slack's API budgets.
+"""
+
+import asyncio
+import threading
+import time
+from typing import Callable, Optional, TypeVar
+
+from slack.errors import SlackApiError
+
+from arwa import trace
+
+T = TypeVar("T")
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket. Tokens refill continuously at `rate` per second
+    up to `capacity`. A `pause` (from a `Retry-After` header, for example)
+    blocks all takers till the given time has passed.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def per_minute(cls, n: int, burst: Optional[int] = None) -> "TokenBucket":
+        return cls(n / 60, burst if burst is not None else max(1, n // 10))
+
+    def _refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def reserve(self, tokens: float = 1) -> float:
+        """
+        Take `tokens` if available right now and return 0. Otherwise take
+        nothing and return the time (in seconds) to wait before trying again.
+        """
+
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+
+            if now < self.paused_until:
+                return self.paused_until - now
+            elif self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0
+            else:
+                return (tokens - self.tokens) / self.rate
+
+    def acquire(self, tokens: float = 1) -> float:
+        """
+        Block till `tokens` are available and take them. Return the time (in
+        seconds) spent waiting.
+        """
+
+        waited = 0.0
+        while True:
+            wait = self.reserve(tokens)
+            if not wait:
+                return waited
+
+            time.sleep(wait)
+            waited += wait
+
+    async def acquire_async(self, tokens: float = 1) -> float:
+        """
+        Like `acquire` but waits without blocking the event loop.
+        """
+
+        waited = 0.0
+        while True:
+            wait = self.reserve(tokens)
+            if not wait:
+                return waited
+
+            await asyncio.sleep(wait)
+            waited += wait
+
+    def pause(self, seconds: float):
+        """
+        Stop handing out tokens for the next `seconds`.
+        """
+
+        with self.lock:
+            now = time.monotonic()
+            self.paused_until = max(self.paused_until, now + seconds)
+            # Whatever was accumulated is not valid after a rate limit hit
+            self.tokens = 0
+            self.updated = max(self.updated, self.paused_until)
+
+
+def response_status(e: SlackApiError) -> Optional[int]:
+    # Responses that failed to parse are plain dicts
+    return getattr(e.response, "status_code", None) or e.response.get("status")
+
+
+def is_ratelimited(e: SlackApiError) -> bool:
+    return response_status(e) == 429 or e.response.get("error") == "ratelimited"
+
+
+def retry_after(e: SlackApiError, default: float = 30) -> float:
+    """
+    Return seconds to wait as asked by the server for a rate limited response.
+    """
+
+    headers = getattr(e.response, "headers", None) or e.response.get("headers") or {}
+    for key, value in headers.items():
+        if key.lower() == "retry-after":
+            try:
+                return float(value)
+            except (TypeError, ValueError):
+                break
+
+    return default
+
+
+def call_with_retry(fn: Callable[[], T], bucket: Optional[TokenBucket] = None, max_retries: int = 5) -> T:
+    """
+    Call `fn` taking a token from `bucket` for each attempt. Rate limited
+    responses pause the bucket for `Retry-After` seconds and are retried at most
+    `max_retries` times. Other errors are raised as is.
+    """
+
+    attempt = 0
+    while True:
+        if bucket:
+            trace.record_wait("ratelimit wait", bucket.acquire())
+
+        try:
+            return fn()
+        except SlackApiError as e:
+            if not is_ratelimited(e) or attempt >= max_retries:
+                raise
+
+            wait = retry_after(e)
+            if bucket:
+                bucket.pause(wait)
+            else:
+                time.sleep(wait)
+                trace.record_wait("ratelimit wait", wait)
+            attempt += 1
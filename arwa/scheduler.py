@@ -0,0 +1,147 @@
+"""
+Sending scheduled slack messages when they are due.
+"""
+
+import asyncio
+import heapq
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from arwa.slack_client import AsyncArwaWebClient
+from arwa.storage import ActionStore
+from arwa.types import SlackMessageAction
+
+# Seconds between looking for actions added by other processes
+REFRESH_INTERVAL = 5.0
+
+
+class Scheduler:
+    """
+    Send pending actions from `store` at their scheduled time.
+
+    Due times are kept in a heap and the scheduler sleeps till the earliest of
+    them, waking early when an action is added with `add`. Actions added to
+    the store by other processes are picked up every `refresh_interval`
+    seconds. Due messages are sent concurrently, at most `concurrency` at a
+    time, through the client's rate budgets.
+
+    Outcomes are written to the store in one transaction every time the
+    scheduler wakes up. Everything pending is loaded back from the store on
+    start, so an action sent just before the process died is sent again.
+    """
+
+    def __init__(self, client: AsyncArwaWebClient, store: ActionStore, concurrency=16,
+                 refresh_interval=REFRESH_INTERVAL):
+        self.client = client
+        self.store = store
+        self.concurrency = concurrency
+        self.refresh_interval = refresh_interval
+
+        self.heap: List[Tuple[float, int]] = []
+        self.actions: Dict[int, SlackMessageAction] = {}
+        # Largest id loaded from the store, ids from `add` can run ahead of it
+        # while actions inserted by other processes are still to be loaded
+        self.last_id = 0
+        self.added: Set[int] = set()
+
+        self.wakeup = asyncio.Event()
+        self.stop = asyncio.Event()
+
+        # Outcomes not yet written to the store
+        self.sent: List[Tuple[int, Optional[str]]] = []
+        self.failed: List[Tuple[int, str]] = []
+
+        self.n_sent = 0
+        self.n_failed = 0
+        # Largest delay in seconds between the scheduled time and sending
+        self.max_latency = 0.0
+
+    def _push(self, action_id: int, action: SlackMessageAction):
+        self.actions[action_id] = action
+        heapq.heappush(self.heap, (action.scheduled.timestamp(), action_id))
+
+    def load(self) -> int:
+        """
+        Load pending actions added to the store since the last load.
+        """
+
+        n_loaded = 0
+        for action_id, action in self.store.load_pending(after_id=self.last_id):
+            self.last_id = action_id
+            if action_id in self.added:
+                continue
+            self._push(action_id, action)
+            n_loaded += 1
+
+        self.added = {action_id for action_id in self.added if action_id > self.last_id}
+        return n_loaded
+
+    def add(self, action: SlackMessageAction) -> int:
+        action_id = self.store.add(action)
+        self.added.add(action_id)
+        self._push(action_id, action)
+        self.wakeup.set()
+        return action_id
+
+    async def run(self):
+        """
+        Send actions as they fall due till `stop` is set. Sends in progress
+        are completed before returning.
+        """
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        in_flight: Set[asyncio.Future] = set()
+
+        self.load()
+        while not self.stop.is_set():
+            now = time.time()
+            while self.heap and self.heap[0][0] <= now:
+                _, action_id = heapq.heappop(self.heap)
+                task = asyncio.ensure_future(self._send(action_id, self.actions.pop(action_id), semaphore))
+                in_flight.add(task)
+                task.add_done_callback(in_flight.discard)
+
+            timeout = self.refresh_interval
+            if self.heap:
+                timeout = min(timeout, self.heap[0][0] - now)
+
+            await self._sleep(timeout)
+            self.flush()
+            self.load()
+
+        if in_flight:
+            await asyncio.gather(*in_flight)
+        self.flush()
+
+    def flush(self):
+        sent, self.sent = self.sent, []
+        failed, self.failed = self.failed, []
+
+        if sent:
+            self.store.mark_sent(sent)
+        if failed:
+            self.store.mark_failed(failed)
+
+    async def _sleep(self, seconds: float):
+        wakeup = asyncio.ensure_future(self.wakeup.wait())
+        stop = asyncio.ensure_future(self.stop.wait())
+
+        await asyncio.wait([wakeup, stop], timeout=max(seconds, 0), return_when=asyncio.FIRST_COMPLETED)
+        wakeup.cancel()
+        stop.cancel()
+        self.wakeup.clear()
+
+    async def _send(self, action_id: int, action: SlackMessageAction, semaphore: asyncio.Semaphore):
+        async with semaphore:
+            try:
+                response = await self.client.chat_postMessage(
+                    channel=action.channel, text=action.message, thread_ts=action.thread_ts
+                )
+            except Exception as e:
+                self.failed.append((action_id, str(e)))
+                self.n_failed += 1
+                return
+
+        self.sent.append((action_id, response.get("ts")))
+        self.n_sent += 1
+        self.max_latency = max(self.max_latency, time.time() - action.scheduled.timestamp())
@@ -0,0 +1,201 @@
+"""
+Full text search over slack messages from conversation exports and the live
+message store.
+"""
+
+import glob
+import hashlib
+import json
+import os
+import sqlite3
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from arwa.slack_export import checkpoint_path, open_compressed
+from arwa.storage import SqliteCache, SqliteDB
+
+# Bytes of a plain export checked to tell if it was rewritten since last time
+HEAD_SIZE = 4096
+BATCH_SIZE = 5000
+
+EXPORT_PATTERNS = ["*.jsonl", "*.jsonl.gz", "*.jsonl.zst"]
+
+Row = Tuple[str, Optional[str], Optional[str], Optional[str], str]
+
+
+def export_files(path: str) -> List[str]:
+    """
+    Return export files at `path`, a file or a directory of them. Hidden files
+    are partial shards of a running workspace export and are left out.
+    """
+
+    if not os.path.isdir(path):
+        return [path]
+
+    files = set()
+    for pattern in EXPORT_PATTERNS:
+        files.update(glob.glob(os.path.join(path, pattern)))
+    return sorted(files)
+
+
+def export_channel(path: str) -> str:
+    """
+    Return id of the conversation an export file is from, using the export
+    checkpoint if present. Workspace shards are named by channel id.
+    """
+
+    checkpoint = checkpoint_path(path)
+    if os.path.exists(checkpoint):
+        with open(checkpoint) as fp:
+            return json.load(fp)["conversation_id"]
+
+    return os.path.basename(path).split(".jsonl")[0]
+
+
+def file_head(path: str, size: int) -> str:
+    with open(path, "rb") as fp:
+        return hashlib.sha1(fp.read(min(size, HEAD_SIZE))).hexdigest()
+
+
+class SearchIndex(SqliteCache):
+    """
+    FTS5 index of message text with channel, user and ts alongside.
+
+    Indexing is incremental. Plain JSONL exports are read on from the byte
+    offset reached last time as long as the start of the file is unchanged.
+    Compressed shards are written once so they are indexed again only if
+    their size or mtime changes. Rows of the live store are followed by rowid.
+    """
+
+    schema = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS messages USING fts5(
+      text, channel UNINDEXED, user UNINDEXED, ts UNINDEXED, source UNINDEXED,
+      tokenize = 'porter unicode61'
+    );
+    CREATE TABLE IF NOT EXISTS sources (
+      path TEXT PRIMARY KEY,
+      size INTEGER,
+      mtime REAL,
+      offset INTEGER,
+      head TEXT
+    );
+    """
+
+    def _insert(self, rows: Iterable[Row]) -> int:
+        n_rows = 0
+        batch: List[Row] = []
+
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= BATCH_SIZE:
+                self.conn.executemany("INSERT INTO messages (text, channel, user, ts, source) VALUES (?, ?, ?, ?, ?)", batch)
+                n_rows += len(batch)
+                batch = []
+
+        self.conn.executemany("INSERT INTO messages (text, channel, user, ts, source) VALUES (?, ?, ?, ?, ?)", batch)
+        return n_rows + len(batch)
+
+    def index_export(self, path: str) -> int:
+        """
+        Index new messages of an export file. Return number of messages added.
+        """
+
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        known = self.conn.execute("SELECT size, mtime, offset, head FROM sources WHERE path = ?", (path,)).fetchone()
+        compressed = path.endswith((".gz", ".zst"))
+
+        if known and known[0] == stat.st_size and known[1] == stat.st_mtime:
+            return 0
+
+        offset = 0
+        if known and not compressed and known[2] <= stat.st_size and known[3] == file_head(path, known[2]):
+            offset = known[2]
+
+        channel = export_channel(path)
+
+        def _rows(fp) -> Iterator[Row]:
+            for line in fp:
+                if not line.strip():
+                    continue
+                message = json.loads(line)
+                if message.get("text"):
+                    yield message["text"], message.get("channel", channel), message.get("user"), message.get("ts"), path
+
+        with self.lock, self.conn:
+            if offset == 0:
+                self.conn.execute("DELETE FROM messages WHERE source = ?", (path,))
+
+            if compressed:
+                with open_compressed(path, "rt") as fp:
+                    n_rows = self._insert(_rows(fp))
+                end = stat.st_size
+            else:
+                with open(path, "rb") as fp:
+                    fp.seek(offset)
+                    # A line still being written is picked up next time
+                    lines = []
+                    end = offset
+                    for line in fp:
+                        if not line.endswith(b"\n"):
+                            break
+                        lines.append(line.decode("utf-8"))
+                        end += len(line)
+                    n_rows = self._insert(_rows(lines))
+
+            self.conn.execute(
+                "INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?, ?)",
+                (path, stat.st_size, stat.st_mtime, end, file_head(path, end))
+            )
+
+        return n_rows
+
+    def index_store(self, db: SqliteDB) -> int:
+        """
+        Index messages added to the live store since last time. Return number
+        of messages added.
+        """
+
+        source = "slack_rtm"
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'slack_rtm_rowid'").fetchone()
+        last_rowid = int(row[0]) if row else 0
+
+        def _rows() -> Iterator[Row]:
+            nonlocal last_rowid
+            for rowid, msg in db.load_rows(after_rowid=last_rowid):
+                last_rowid = rowid
+                if msg.message:
+                    yield msg.message, msg.channel, msg.user, msg.ts, source
+
+        with self.lock, self.conn:
+            n_rows = self._insert(_rows())
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('slack_rtm_rowid', ?)", (str(last_rowid),))
+
+        return n_rows
+
+    def search(self, query: str, channel: Optional[str] = None, user: Optional[str] = None, limit=20) -> List[Dict]:
+        """
+        Return best matches for the query, written in FTS5 query syntax. Plain
+        text that isn't valid syntax is searched for as separate words.
+        """
+
+        sql = """
+        SELECT snippet(messages, 0, '[', ']', '...', 16), channel, user, ts, bm25(messages)
+        FROM messages WHERE messages MATCH ?
+        """
+        params: List = []
+        for clause, value in [("channel = ?", channel), ("user = ?", user)]:
+            if value is not None:
+                sql += " AND " + clause
+                params.append(value)
+        sql += " ORDER BY rank LIMIT ?"
+
+        try:
+            rows = self.conn.execute(sql, [query] + params + [limit]).fetchall()
+        except sqlite3.OperationalError:
+            quoted = " ".join('"' + word.replace('"', '""') + '"' for word in query.split())
+            rows = self.conn.execute(sql, [quoted] + params + [limit]).fetchall()
+
+        return [
+            {"text": text, "channel": channel, "user": user, "ts": ts, "score": -score}
+            for text, channel, user, ts, score in rows
+        ]
@@ -0,0 +1,265 @@
+"""
+Slack web client shared by all the commands. On top of the stock client this
+pools HTTP connections, keeps every API method within its rate tier and
+retries rate limited and transient failures.
+"""
+
+import asyncio
+import json
+import os
+import random
+import socket
+import threading
+import time
+import urllib.error
+from typing import Callable, Dict, Optional, Tuple, TypeVar
+from urllib.parse import urlencode
+
+import aiohttp
+import requests
+import slack
+from requests.adapters import HTTPAdapter
+from slack.errors import SlackApiError
+
+from arwa import trace
+from arwa.ratelimit import TokenBucket, call_with_retry, is_ratelimited, response_status, retry_after
+
+# Requests per minute allowed in each of Slack's rate limit tiers
+TIER_PER_MINUTE = {1: 1, 2: 20, 3: 50, 4: 100}
+
+METHOD_TIERS = {
+    "chat.postMessage": None,
+    "conversations.history": 3,
+    "conversations.invite": 3,
+    "conversations.list": 2,
+    "conversations.members": 4,
+    "conversations.open": 3,
+    "conversations.replies": 3,
+    "files.upload": 2,
+    "team.accessLogs": 2,
+    "usergroups.list": 2,
+    "users.conversations": 3,
+    "users.info": 4,
+    "users.list": 2,
+}
+
+# Budget for methods outside the tiers. chat.postMessage is limited to around
+# one message per second per channel with a larger workspace wide allowance.
+SPECIAL_PER_MINUTE = 300
+DEFAULT_TIER = 3
+
+TRANSIENT_ERRORS: Tuple = (
+    ConnectionError, TimeoutError, socket.timeout, urllib.error.URLError,
+    requests.ConnectionError, requests.Timeout, aiohttp.ClientError, asyncio.TimeoutError
+)
+
+T = TypeVar("T")
+
+_buckets: Dict[Tuple[Optional[str], str], TokenBucket] = {}
+_buckets_lock = threading.Lock()
+
+
+def method_bucket(token: Optional[str], api_method: str) -> TokenBucket:
+    """
+    Return the rate limit budget for an API method. Slack counts limits per
+    token, so all clients with the same token in this process share budgets.
+    """
+
+    key = (token, api_method)
+    with _buckets_lock:
+        if key not in _buckets:
+            tier = METHOD_TIERS.get(api_method, DEFAULT_TIER)
+            per_minute = SPECIAL_PER_MINUTE if tier is None else TIER_PER_MINUTE[tier]
+            _buckets[key] = TokenBucket.per_minute(per_minute)
+        return _buckets[key]
+
+
+def backoff(attempt: int, base=1.0, cap=60.0) -> float:
+    """
+    Exponential backoff with full jitter.
+    """
+
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def retry_delay(e: Exception, attempt: int, max_retries: int, bucket: TokenBucket) -> Optional[float]:
+    """
+    Return seconds to wait before retrying a call that failed with `e`, or None
+    if it shouldn't be retried. Rate limited calls pause the method's bucket
+    for as long as the server asked.
+    """
+
+    if attempt >= max_retries:
+        return None
+
+    if isinstance(e, SlackApiError):
+        if is_ratelimited(e):
+            bucket.pause(retry_after(e))
+            return 0
+        elif (response_status(e) or 0) >= 500:
+            return backoff(attempt)
+        else:
+            return None
+    elif isinstance(e, TRANSIENT_ERRORS):
+        return backoff(attempt)
+    else:
+        return None
+
+
+class ArwaWebClient(slack.WebClient):
+    """
+    Blocking web client with pooled connections, per method rate budgets and
+    retries.
+    """
+
+    def __init__(self, token: Optional[str] = None, max_retries=5, pool_size=16, **kwargs):
+        super().__init__(token, **kwargs)
+        self.max_retries = max_retries
+
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.http.mount("https://", adapter)
+        self.http.mount("http://", adapter)
+
+    def api_call(self, api_method: str, **kwargs):
+        bucket = method_bucket(self.token, api_method)
+
+        with trace.span(api_method, "slack") as span:
+            attempt = 0
+            while True:
+                span.add("ratelimit_wait", bucket.acquire())
+                try:
+                    return super().api_call(api_method, **kwargs)
+                except Exception as e:
+                    delay = retry_delay(e, attempt, self.max_retries, bucket)
+                    if delay is None:
+                        raise
+                    time.sleep(delay)
+                    attempt += 1
+                    span.add("retries", 1)
+
+    def _perform_urllib_http_request(self, *, url: str, args: Dict) -> Dict:
+        span = trace.current()
+
+        if args["data"] or args["files"] or self.ssl:
+            # Uploads and custom ssl contexts take the stock urllib path.
+            # Multipart bodies get their length set in the headers on the way.
+            response = super()._perform_urllib_http_request(url=url, args=args)
+            if span:
+                sent = args["headers"].get("Content-Length")
+                if sent is None:
+                    sent = len(json.dumps(args["json"]) if args["json"] else urlencode(args["params"] or {}))
+                span.add("bytes_sent", int(sent))
+                span.add("bytes_received", len(response.get("body", "").encode("utf-8")))
+            return response
+
+        headers = args["headers"]
+        if args["json"]:
+            body: Optional[str] = json.dumps(args["json"])
+            headers["Content-Type"] = "application/json;charset=utf-8"
+        elif args["params"]:
+            body = urlencode(args["params"])
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        else:
+            body = None
+
+        data = body.encode("utf-8") if body else None
+        proxies = {"http": self.proxy, "https": self.proxy} if self.proxy else None
+        response = self.http.post(url, data=data, headers=headers, timeout=self.timeout, proxies=proxies)
+
+        span.add("bytes_sent", len(data or b""))
+        span.add("bytes_received", len(response.content))
+        return {"status": response.status_code, "headers": response.headers, "body": response.text}
+
+
+class AsyncArwaWebClient(slack.WebClient):
+    """
+    Asyncio variant of `ArwaWebClient`. API methods return awaitables. Call
+    `close` once done to release the pooled connections.
+    """
+
+    def __init__(self, token: Optional[str] = None, max_retries=5, pool_size=16, **kwargs):
+        super().__init__(token, run_async=True, **kwargs)
+        self.max_retries = max_retries
+        self.pool_size = pool_size
+
+    def api_call(self, api_method: str, **kwargs):
+        return asyncio.ensure_future(self._api_call(api_method, **kwargs))
+
+    async def _api_call(self, api_method: str, **kwargs):
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                trace_configs=[_size_trace_config()]
+            )
+
+        self._event_loop = asyncio.get_running_loop()
+        bucket = method_bucket(self.token, api_method)
+
+        with trace.span(api_method, "slack") as span:
+            attempt = 0
+            while True:
+                span.add("ratelimit_wait", await bucket.acquire_async())
+                try:
+                    return await super().api_call(api_method, **kwargs)
+                except Exception as e:
+                    delay = retry_delay(e, attempt, self.max_retries, bucket)
+                    if delay is None:
+                        raise
+                    await asyncio.sleep(delay)
+                    attempt += 1
+                    span.add("retries", 1)
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+
+
+async def _on_request_chunk_sent(session, context, params):
+    trace.current().add("bytes_sent", len(params.chunk))
+
+
+async def _on_response_chunk_received(session, context, params):
+    trace.current().add("bytes_received", len(params.chunk))
+
+
+def _size_trace_config() -> aiohttp.TraceConfig:
+    """
+    Return aiohttp hooks adding request and response body sizes to the span
+    of the call being made.
+    """
+
+    config = aiohttp.TraceConfig()
+    config.on_request_chunk_sent.append(_on_request_chunk_sent)
+    config.on_response_chunk_received.append(_on_response_chunk_received)
+    return config
+
+
+def client_call(client: slack.WebClient, fn: Callable[[], T], bucket: Optional[TokenBucket] = None) -> T:
+    """
+    Make the call `fn` with `client`. Arwa's clients keep every method within
+    its budget and retry on their own, so only other clients go through
+    `call_with_retry` with `bucket`.
+    """
+
+    if isinstance(client, (ArwaWebClient, AsyncArwaWebClient)):
+        return fn()
+    return call_with_retry(fn, bucket)
+
+
+def get_client(token_env="SLACK_USER_TOKEN", **kwargs) -> ArwaWebClient:
+    """
+    Return web client for the token in environment variable `token_env`.
+    """
+
+    return ArwaWebClient(os.environ[token_env], **kwargs)
+
+
+def get_async_client(token_env="SLACK_USER_TOKEN", **kwargs) -> AsyncArwaWebClient:
+    """
+    Return asyncio web client for the token in environment variable
+    `token_env`.
+    """
+
+    return AsyncArwaWebClient(os.environ[token_env], **kwargs)
@@ -0,0 +1,273 @@
+"""
+Exporting slack conversations to jsonlines files.
+"""
+
+import contextlib
+import datetime
+import gzip
+import json
+import os
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
+from typing import IO, Dict, List, Optional, Set
+
+import jsonlines
+import slack
+from tqdm import tqdm
+
+from arwa.ratelimit import TokenBucket
+from arwa.slack_utils import get_message_pages, get_public_channels, get_thread_replies
+
+COMPRESSION_EXTENSIONS = {"gzip": ".gz", "zstd": ".zst", "none": ""}
+
+
+def check_compression(compression: str):
+    """
+    Raise if `compression` is unknown or needs a package that isn't installed.
+    """
+
+    if compression not in COMPRESSION_EXTENSIONS:
+        raise ValueError(f"Unknown compression {compression}")
+
+    if compression == "zstd":
+        try:
+            import zstandard  # noqa: F401
+        except ImportError:
+            raise RuntimeError("zstd compression needs the `zstandard` package, install arwa[zstd]")
+
+
+def open_compressed(path: str, mode="rt") -> IO:
+    """
+    Open a text file, (de)compressing based on the extension of `path`.
+    """
+
+    if path.endswith(".gz"):
+        return gzip.open(path, mode)
+    elif path.endswith(".zst"):
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError("zstd compression needs the `zstandard` package, install arwa[zstd]")
+        return zstandard.open(path, mode)
+    else:
+        return open(path, mode.replace("t", ""))
+
+
+def checkpoint_path(output_jsonl: str) -> str:
+    return output_jsonl + ".checkpoint.json"
+
+
+def load_checkpoint(output_jsonl: str) -> Optional[Dict]:
+    path = checkpoint_path(output_jsonl)
+    if not os.path.exists(path):
+        return None
+
+    with open(path) as fp:
+        return json.load(fp)
+
+
+def save_checkpoint(output_jsonl: str, checkpoint: Dict):
+    """
+    Atomically replace the checkpoint sidecar for `output_jsonl`.
+    """
+
+    path = checkpoint_path(output_jsonl)
+    with open(path + ".tmp", "w") as fp:
+        json.dump(checkpoint, fp)
+    os.replace(path + ".tmp", path)
+
+
+def is_thread_parent(message: Dict) -> bool:
+    return message.get("thread_ts") == message["ts"] and message.get("reply_count", 0) > 0
+
+
+def export_conversation(client: slack.WebClient, conversation_id: str, output_jsonl: str,
+                        resume=False, oldest: Optional[str] = None, threads=False, n_workers=4) -> int:
+    """
+    Export messages from a conversation to `output_jsonl` and return number of
+    messages written.
+
+    Progress is saved in a sidecar checkpoint after every page of history. With
+    `resume`, an interrupted export continues from the saved cursor, dropping
+    anything written after the last checkpoint. Resuming a completed export
+    fetches only messages newer than the latest one exported earlier.
+
+    With `threads`, replies are fetched by a pool of `n_workers` while the
+    history pagination continues and are written out as they arrive.
+    """
+
+    checkpoint = load_checkpoint(output_jsonl) if resume else None
+
+    if checkpoint and checkpoint["conversation_id"] != conversation_id:
+        raise ValueError(f"Checkpoint for {output_jsonl} belongs to conversation {checkpoint['conversation_id']}")
+
+    if checkpoint and not checkpoint["complete"]:
+        cursor = checkpoint["cursor"]
+        oldest = checkpoint["oldest"]
+        latest_ts = checkpoint["latest_ts"]
+        pending_threads = checkpoint["pending_threads"]
+    else:
+        cursor = None
+        if checkpoint:
+            oldest = oldest or checkpoint["latest_ts"]
+            latest_ts = checkpoint["latest_ts"]
+        else:
+            latest_ts = None
+        pending_threads = []
+
+    if checkpoint:
+        with open(output_jsonl, "a") as fp:
+            fp.truncate(checkpoint["offset"])
+        mode = "a"
+    else:
+        mode = "w"
+
+    # Both the methods are Tier 3 with separate budgets
+    history_bucket = TokenBucket.per_minute(50)
+    replies_bucket = TokenBucket.per_minute(50)
+
+    n_written = 0
+    bar = tqdm()
+
+    with open(output_jsonl, mode) as fp, ThreadPoolExecutor(max_workers=n_workers) as pool:
+        writer = jsonlines.Writer(fp)
+        in_flight: Dict[Future, str] = {}
+
+        def _write(messages):
+            nonlocal n_written
+            writer.write_all(messages)
+            n_written += len(messages)
+            bar.update(len(messages))
+
+        def _submit(thread_ts: str):
+            future = pool.submit(get_thread_replies, conversation_id, thread_ts, client, replies_bucket)
+            in_flight[future] = thread_ts
+
+        def _collect(done: Set[Future]):
+            for future in done:
+                in_flight.pop(future)
+                _write(future.result())
+
+        def _checkpoint(cursor: Optional[str], complete=False):
+            fp.flush()
+            save_checkpoint(output_jsonl, {
+                "conversation_id": conversation_id,
+                "oldest": oldest,
+                "cursor": cursor,
+                "latest_ts": latest_ts,
+                "pending_threads": list(in_flight.values()),
+                "complete": complete,
+                "offset": fp.tell()
+            })
+
+        for thread_ts in pending_threads:
+            _submit(thread_ts)
+
+        if not (checkpoint and not checkpoint["complete"] and cursor is None):
+            for messages, cursor in get_message_pages(conversation_id, client, oldest=oldest, cursor=cursor, bucket=history_bucket):
+                _write(messages)
+
+                for message in messages:
+                    if latest_ts is None or float(message["ts"]) > float(latest_ts):
+                        latest_ts = message["ts"]
+
+                    if threads and is_thread_parent(message):
+                        _submit(message["ts"])
+
+                # Keep the number of in flight thread fetches bounded
+                while len(in_flight) > n_workers * 4:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    _collect(done)
+
+                _checkpoint(cursor)
+
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            _collect(done)
+            _checkpoint(None)
+
+        _checkpoint(None, complete=True)
+
+    bar.close()
+    return n_written
+
+
+def export_channel_shard(client: slack.WebClient, channel: Dict, output_dir: str,
+                         compression: str, bucket: TokenBucket) -> Dict:
+    """
+    Export all messages of a channel into one compressed jsonlines shard and
+    return its manifest entry.
+    """
+
+    shard = channel["id"] + ".jsonl" + COMPRESSION_EXTENSIONS[compression]
+    path = os.path.join(output_dir, shard)
+    # Partial shard stays hidden till the channel is exported fully
+    tmp_path = os.path.join(output_dir, "." + shard)
+
+    entry = {
+        "id": channel["id"], "name": channel.get("name"), "shard": shard,
+        "messages": 0, "oldest_ts": None, "latest_ts": None
+    }
+
+    try:
+        with open_compressed(tmp_path, "wt") as fp:
+            writer = jsonlines.Writer(fp)
+            for messages, _ in get_message_pages(channel["id"], client, bucket=bucket):
+                writer.write_all(messages)
+                entry["messages"] += len(messages)
+
+                for message in messages:
+                    if entry["oldest_ts"] is None or float(message["ts"]) < float(entry["oldest_ts"]):
+                        entry["oldest_ts"] = message["ts"]
+                    if entry["latest_ts"] is None or float(message["ts"]) > float(entry["latest_ts"]):
+                        entry["latest_ts"] = message["ts"]
+    except Exception:
+        # Opening can fail before the file is there
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_path)
+        raise
+
+    os.replace(tmp_path, path)
+    return entry
+
+
+def export_workspace(client: slack.WebClient, output_dir: str, concurrency=4, compression="gzip",
+                     bucket: Optional[TokenBucket] = None) -> List[Dict]:
+    """
+    Export all public channels in `output_dir`, one shard per channel, with at
+    most `concurrency` channels in flight. All the exports draw from a single
+    rate limit budget. A `manifest.json` with message counts and time ranges of
+    each shard is written at the end and its entries are returned. Channels that
+    fail carry an `error` in their entry instead of stopping the export.
+    """
+
+    check_compression(compression)
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    channels = list(get_public_channels(client, bucket=TokenBucket.per_minute(50)))
+    bucket = bucket or TokenBucket.per_minute(50)
+
+    entries = []
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = {
+            pool.submit(export_channel_shard, client, channel, output_dir, compression, bucket): channel
+            for channel in channels
+        }
+
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            channel = futures[future]
+            try:
+                entries.append(future.result())
+            except Exception as e:
+                entries.append({"id": channel["id"], "name": channel.get("name"), "error": str(e)})
+
+    entries.sort(key=lambda it: it["name"] or it["id"])
+
+    with open(os.path.join(output_dir, "manifest.json"), "w") as fp:
+        json.dump({
+            "exported_at": datetime.datetime.now().isoformat(),
+            "compression": compression,
+            "channels": entries
+        }, fp, indent=2)
+
+    return entries
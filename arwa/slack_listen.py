@@ -0,0 +1,192 @@
+"""
+Listening to slack's RTM API and storing messages as they come.
+"""
+
+import asyncio
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import aiohttp
+from slack.errors import SlackApiError
+
+from arwa.slack_client import TRANSIENT_ERRORS, AsyncArwaWebClient, backoff
+from arwa.storage import SqliteDB
+from arwa.types import SlackMessage
+
+QUEUE_SIZE = 10000
+MAX_BATCH_SIZE = 1000
+
+# Subtypes that are new messages and not edits, joins and the like
+MESSAGE_SUBTYPES = {None, "bot_message", "file_share", "me_message", "thread_broadcast"}
+
+_STOP = object()
+
+
+def event_to_message(event: Dict) -> Optional[SlackMessage]:
+    """
+    Make message from an RTM event if it's a new message.
+    """
+
+    if event.get("type") != "message" or event.get("subtype") not in MESSAGE_SUBTYPES:
+        return None
+
+    return SlackMessage(
+        message=event.get("text", ""),
+        channel=event.get("channel"),
+        thread_ts=event.get("thread_ts"),
+        ts=event.get("ts"),
+        user=event.get("user") or event.get("bot_id")
+    )
+
+
+class SlackListener:
+    """
+    Read RTM events and store messages in `db`.
+
+    The socket reader only parses events and puts messages on a bounded queue.
+    A writer takes everything waiting in the queue, up to `MAX_BATCH_SIZE`, and
+    saves it in one transaction on a worker thread, so batches grow with
+    traffic and disk writes never hold up the socket. A full queue makes the
+    reader wait. Dropped connections are opened again with backoff.
+    """
+
+    def __init__(self, client: AsyncArwaWebClient, db: SqliteDB, queue_size=QUEUE_SIZE):
+        self.client = client
+        self.db = db
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.stop = asyncio.Event()
+
+        self.received = 0
+        self.written = 0
+        self.reconnects = 0
+        # Seconds between a message's ts and it getting written
+        self.lag: Optional[float] = None
+
+    def stats(self) -> Dict:
+        return {
+            "received": self.received,
+            "written": self.written,
+            "reconnects": self.reconnects,
+            "queue_depth": self.queue.qsize(),
+            "lag": self.lag
+        }
+
+    async def run(self, stats_interval: Optional[float] = None):
+        """
+        Listen till `stop` is set, then write out what's queued. If writing
+        fails, reading stops and the error is raised.
+        """
+
+        reader = asyncio.ensure_future(self._read_loop())
+        writer = asyncio.ensure_future(self._write_loop())
+        reporter = asyncio.ensure_future(self._report_loop(stats_interval)) if stats_interval else None
+
+        try:
+            await asyncio.wait([reader, writer], return_when=asyncio.FIRST_COMPLETED)
+
+            if writer.done():
+                # The writer only returns early when saving failed
+                reader.cancel()
+                await asyncio.gather(reader, return_exceptions=True)
+                writer.result()
+                raise RuntimeError("Message writer stopped while reading")
+
+            try:
+                reader.result()
+            finally:
+                stopping = asyncio.ensure_future(self.queue.put(_STOP))
+                await asyncio.wait([stopping, writer], return_when=asyncio.FIRST_COMPLETED)
+                stopping.cancel()
+                await writer
+        finally:
+            for task in [reader, writer, reporter]:
+                if task and not task.done():
+                    task.cancel()
+
+    async def _read_loop(self):
+        attempt = 0
+
+        async with aiohttp.ClientSession() as session:
+            while not self.stop.is_set():
+                try:
+                    response = await self.client.rtm_connect()
+                    async with session.ws_connect(response["url"], heartbeat=30) as ws:
+                        attempt = 0
+                        await self._read_socket(ws)
+                except (SlackApiError, *TRANSIENT_ERRORS) as e:
+                    print(f"RTM connection failed: {e}", file=sys.stderr)
+
+                if self.stop.is_set():
+                    return
+
+                self.reconnects += 1
+                await self._sleep(backoff(attempt))
+                attempt += 1
+
+    async def _read_socket(self, ws: aiohttp.ClientWebSocketResponse):
+        stopping = asyncio.ensure_future(self.stop.wait())
+
+        try:
+            while True:
+                receiving = asyncio.ensure_future(ws.receive())
+                await asyncio.wait([receiving, stopping], return_when=asyncio.FIRST_COMPLETED)
+
+                if not receiving.done():
+                    receiving.cancel()
+                    return
+
+                data = receiving.result()
+                if data.type != aiohttp.WSMsgType.TEXT:
+                    # Closed or errored, either way we connect again
+                    return
+
+                event = json.loads(data.data)
+                if event.get("type") == "goodbye":
+                    return
+
+                msg = event_to_message(event)
+                if msg is not None:
+                    self.received += 1
+                    await self.queue.put(msg)
+        finally:
+            stopping.cancel()
+
+    async def _sleep(self, seconds: float):
+        try:
+            await asyncio.wait_for(self.stop.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _write_loop(self):
+        loop = asyncio.get_running_loop()
+
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            done = False
+            while not done:
+                batch: List[SlackMessage] = []
+                item = await self.queue.get()
+
+                while item is not _STOP:
+                    batch.append(item)
+                    if len(batch) >= MAX_BATCH_SIZE or self.queue.empty():
+                        break
+                    item = self.queue.get_nowait()
+                done = item is _STOP
+
+                if batch:
+                    await loop.run_in_executor(pool, self._save, batch)
+                    self.written += len(batch)
+                    if batch[-1].ts:
+                        self.lag = time.time() - float(batch[-1].ts)
+
+    def _save(self, batch: List[SlackMessage]):
+        self.db.save_messages(batch)
+        self.db.flush()
+
+    async def _report_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            print(json.dumps(self.stats()), file=sys.stderr)
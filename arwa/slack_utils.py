@@ -1,35 +1,124 @@
-from typing import Dict, Iterator, List
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
 import slack
 from pydash import py_
-from tqdm import trange
+from slack.errors import SlackApiError
+from tqdm import tqdm
 
+from arwa.ratelimit import TokenBucket
+from arwa.slack_client import ArwaWebClient, client_call
+from arwa.storage import ChannelIndex, UserDirectory, default_cache_path
 from arwa.types import SlackUser
 
+# Seconds after which the user directory is refreshed from slack
+USER_DIRECTORY_TTL = 24 * 60 * 60
 
-def last_user_access(client: slack.WebClient, n_pages=10) -> Dict[SlackUser, Dict]:
+# Seconds after which the channel name index is rebuilt
+CHANNEL_INDEX_TTL = 24 * 60 * 60
+
+# conversations.invite errors caused by some of the invited users. Anything
+# else, like a missing channel or a bad token, fails the whole batch.
+USER_INVITE_ERRORS = {
+    "already_in_channel", "cant_invite", "cant_invite_self", "failed_for_some_users", "user_not_found",
+    "user_is_restricted", "user_is_ultra_restricted", "ura_max_channels"
+}
+
+_memory_directory: Optional[UserDirectory] = None
+
+
+def last_user_access(client: slack.WebClient, n_pages=100, user_ids: Optional[Iterable[str]] = None,
+                     n_workers=4, bucket: Optional[TokenBucket] = None) -> Dict[SlackUser, Dict]:
     """
     Return latest user slack access information.
 
+    Access log pages are fetched `n_workers` at a time, up to `n_pages` of
+    them. Given `user_ids`, fetching stops once all of them have been seen.
+
     HACK: This is an approximation and since we are only going to use this for
           geolocation, it's alright.
     """
 
-    access = {}
+    # team.accessLogs is Tier 2
+    bucket = bucket or TokenBucket.per_minute(20)
+    remaining = set(user_ids) if user_ids is not None else None
+
+    def _page(page_number: int) -> Dict:
+        return client_call(client, lambda: client.team_accessLogs(count=1000, page=page_number), bucket)
 
-    for page_number in trange(1, n_pages + 1):
-        response = client.team_accessLogs(count=100, page=page_number)
+    access: Dict[SlackUser, Dict] = {}
 
-        # We probably don't need sorting
-        for login in sorted(response["logins"], key=lambda it: it["date_last"], reverse=True):
+    def _collect(response: Dict):
+        # Logins come latest first, so the first one seen for a user is the
+        # latest
+        for login in response["logins"]:
             # Note that this name does not align with names from other sources
             user = SlackUser(login["user_id"], login["username"])
             if user not in access:
                 access[user] = login
+                if remaining is not None:
+                    remaining.discard(user.id)
+
+    first = _page(1)
+    _collect(first)
+    n_pages = min(n_pages, first.get("paging", {}).get("pages", n_pages))
+
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        for wave_start in range(2, n_pages + 1, n_workers):
+            if remaining is not None and not remaining:
+                break
+
+            # Pages are taken in order so that earlier logins win
+            for response in pool.map(_page, range(wave_start, min(wave_start + n_workers, n_pages + 1))):
+                _collect(response)
 
     return access
 
 
+def get_members(client: slack.WebClient, bucket: Optional[TokenBucket] = None) -> Iterator[Dict]:
+    """
+    Get raw member objects of all the users in workspace, following the
+    pagination cursor.
+    """
+
+    cursor = None
+    while True:
+        response = client_call(client, lambda: client.users_list(limit=200, cursor=cursor), bucket)
+        yield from response["members"]
+
+        cursor = response.get("response_metadata", {}).get("next_cursor")
+        if not cursor:
+            break
+
+
+def member_to_user(member: Dict) -> SlackUser:
+    return SlackUser(
+        member["id"], member["profile"]["real_name"],
+        is_bot=member["is_bot"],
+        is_deleted=member["deleted"],
+        email=member["profile"].get("email")
+    )
+
+
+def is_regular_user(user: SlackUser) -> bool:
+    return not (user.is_bot or user.is_deleted or user.id == "USLACKBOT")
+
+
+def iter_users(client: slack.WebClient, all_users=False) -> Iterator[SlackUser]:
+    """
+    Iterate over workspace users. If `all_users` is True, return bots and
+    deactivated users also.
+
+    Notice that reading email needs `users:read.email` slack scope.
+    """
+
+    for member in get_members(client):
+        user = member_to_user(member)
+        if all_users or is_regular_user(user):
+            yield user
+
+
 def list_users(client: slack.WebClient, all_users=False) -> List[SlackUser]:
     """
     List workspace users. If `all_users` is True, return bots and deactivated
@@ -38,25 +127,18 @@ def list_users(client: slack.WebClient, all_users=False) -> List[SlackUser]:
     Notice that reading email needs `users:read.email` slack scope.
     """
 
-    response = client.users_list()
-    members = response["members"]
+    return list(iter_users(client, all_users=all_users))
 
-    users = []
-    for member in members:
-        users.append(SlackUser(
-            member["id"], member["profile"]["real_name"],
-            is_bot=member["is_bot"],
-            is_deleted=member["deleted"],
-            email=member["profile"].get("email")
-        ))
 
-    if all_users:
-        return users
-    else:
-        return [
-            u for u in users
-            if not (u.is_bot or u.is_deleted or u.id == "USLACKBOT")
-        ]
+def refresh_user_directory(directory: UserDirectory, client: slack.WebClient) -> int:
+    """
+    Bring the local user directory up to date with the workspace and return
+    number of users that changed.
+    """
+
+    n_updated = directory.update(get_members(client))
+    directory.mark_refreshed()
+    return n_updated
 
 
 def list_usergroups(client: slack.WebClient) -> List[str]:
@@ -68,70 +150,296 @@ def list_usergroups(client: slack.WebClient) -> List[str]:
     return [u["handle"] for u in usergroups]
 
 
-def list_users_from_usergroup(client: slack.WebClient, usergroup: str) -> List[SlackUser]:
+def get_user_directory(client: slack.WebClient, directory: Optional[UserDirectory] = None,
+                       max_age=USER_DIRECTORY_TTL) -> UserDirectory:
+    """
+    Return user directory refreshed if older than `max_age` seconds. Without a
+    `directory`, one kept in memory for the whole process is used.
+    """
+
+    global _memory_directory
+
+    if directory is None:
+        if _memory_directory is None:
+            _memory_directory = UserDirectory(":memory:")
+        directory = _memory_directory
+
+    if directory.is_stale(max_age):
+        refresh_user_directory(directory, client)
+
+    return directory
+
+
+def resolve_users(client: slack.WebClient, user_ids: List[str], directory: UserDirectory, n_workers=8) -> List[SlackUser]:
+    """
+    Return users for given ids from the directory. Ids missing there are
+    fetched concurrently from `users.info` and added to the directory.
+    """
+
+    found = directory.get_many(user_ids)
+    missing = [i for i in py_.uniq(user_ids) if i not in found]
+
+    if missing:
+        # users.info is a Tier 4 method
+        bucket = TokenBucket.per_minute(100)
+        with ThreadPoolExecutor(max_workers=n_workers) as pool:
+            members = list(pool.map(lambda i: client_call(client, lambda: client.users_info(user=i), bucket)["user"], missing))
+
+        directory.update(members)
+        found.update({m["id"]: member_to_user(m) for m in members})
+
+    return [found[i] for i in user_ids]
+
+
+def list_users_from_usergroups(client: slack.WebClient, usergroups: List[str],
+                               directory: Optional[UserDirectory] = None) -> Dict[str, List[SlackUser]]:
+    """
+    List users in each of the given usergroup handles, fetching all groups in
+    one call.
+    """
+
+    groups = {
+        it["handle"]: it
+        for it in client.usergroups_list(include_users=True)["usergroups"]
+    }
+
+    for usergroup in usergroups:
+        if usergroup not in groups:
+            raise ValueError(f"Usergroup {usergroup} not found")
+
+    directory = get_user_directory(client, directory)
+    user_ids = py_.uniq(py_.flatten([groups[usergroup]["users"] for usergroup in usergroups]))
+    users = {u.id: u for u in resolve_users(client, user_ids, directory)}
+
+    return {
+        usergroup: [users[i] for i in groups[usergroup]["users"]]
+        for usergroup in usergroups
+    }
+
+
+def list_users_from_usergroup(client: slack.WebClient, usergroup: str,
+                              directory: Optional[UserDirectory] = None) -> List[SlackUser]:
     """
     List users in a given usergroup handle.
     """
 
-    usergroups = client.usergroups_list(include_users=True)["usergroups"]
-    group = py_.find(usergroups, lambda it: it["handle"] == usergroup)
-    user_ids = group["users"]
+    return list_users_from_usergroups(client, [usergroup], directory)[usergroup]
 
-    users = []
-    for i in user_ids:
-        u = client.users_info(user=i)["user"]
-        users.append(SlackUser(u["id"], u["profile"]["real_name"], email=u["profile"].get("email")))
 
-    return users
+def get_conversations(client: slack.WebClient, types="public_channel,private_channel,mpim,im",
+                      bucket: Optional[TokenBucket] = None) -> Iterator[List[Dict]]:
+    """
+    Get pages of conversations the slack client is part of.
+    """
+
+    cursor = None
+    while True:
+        response = client_call(
+            client,
+            lambda: client.users_conversations(types=types, exclude_archived=True, limit=1000, cursor=cursor),
+            bucket
+        )
+        yield response["channels"]
 
+        cursor = response.get("response_metadata", {}).get("next_cursor")
+        if not cursor:
+            break
 
-def channel_name_to_id(name: str, client: slack.WebClient) -> str:
+
+def get_channel_index(client: slack.WebClient) -> ChannelIndex:
+    """
+    Return the on disk channel index for the client's token. Different tokens
+    see different conversations so they don't share an index.
+    """
+
+    token_hash = hashlib.sha1((client.token or "").encode()).hexdigest()[:12]
+    return ChannelIndex(default_cache_path(f"channels-{token_hash}.db"))
+
+
+def channel_name_to_id(name: str, client: slack.WebClient, index: Optional[ChannelIndex] = None,
+                       max_age=CHANNEL_INDEX_TTL) -> str:
     """
     Return slack id for given channel name. This only works for the channel the
     slack client is part of.
-    """
 
-    response = client.users_conversations(types="public_channel,private_channel,mpim,im", exclude_archived=True)
-    channels = response["channels"]
+    Names are resolved from a local index which is rebuilt once older than
+    `max_age` seconds. A name missing from a fresh index is looked up by
+    paginating conversations till it's found, adding everything seen to the
+    index on the way.
+    """
 
-    result = py_.find(channels, lambda ch: ch.get("name", "") == name)
+    index = index or get_channel_index(client)
 
-    if result:
-        return result["id"]
+    if index.is_stale(max_age):
+        index.clear()
+        for channels in get_conversations(client):
+            index.update(channels)
+        index.mark_refreshed()
+    else:
+        channel_id = index.get(name)
+        if channel_id:
+            return channel_id
+
+        for channels in get_conversations(client):
+            index.update(channels)
+            if index.get(name):
+                break
+
+    channel_id = index.get(name)
+    if channel_id:
+        return channel_id
     else:
         raise ValueError(f"Channel {name} not found")
 
 
-def get_public_channels(client: slack.WebClient) -> Iterator[Dict]:
+def get_public_channels(client: slack.WebClient, bucket: Optional[TokenBucket] = None) -> Iterator[Dict]:
     """
     Get list of public channels.
     """
 
-    response = client.users_conversations(exclude_archived=True, types="public_channel")
-    for channel in response["channels"]:
-        yield channel
+    for channels in get_conversations(client, types="public_channel", bucket=bucket):
+        yield from channels
+
+
+def get_message_pages(conversation_id: str, client: slack.WebClient, oldest: Optional[str] = None,
+                      cursor: Optional[str] = None, bucket: Optional[TokenBucket] = None) -> Iterator[Tuple[List[Dict], Optional[str]]]:
+    """
+    Get pages of messages along with the cursor for the page after. Starting
+    with a saved `cursor` resumes the walk from there. Only messages after
+    `oldest` ts are returned if given.
+    """
+
+    kwargs = {"channel": conversation_id, "limit": 200}
+    if oldest:
+        kwargs["oldest"] = oldest
 
-    while response["has_more"]:
-        next_cursor = response["response_metadata"]["next_cursor"]
-        response = client.users_conversations(exclude_archived=True, types="public_channel", cursor=next_cursor)
-        for channel in response["channels"]:
-            yield channel
+    while True:
+        response = client_call(client, lambda: client.conversations_history(**kwargs, cursor=cursor), bucket)
+        cursor = response.get("response_metadata", {}).get("next_cursor") if response["has_more"] else None
+        yield response["messages"], cursor
 
+        if not cursor:
+            break
 
-def get_message_batches(conversation_id: str, client: slack.WebClient) -> Iterator[List[Dict]]:
+
+def get_message_batches(conversation_id: str, client: slack.WebClient, oldest: Optional[str] = None) -> Iterator[List[Dict]]:
     """
     Get messages in batches of requests.
     """
 
-    response = client.conversations_history(channel=conversation_id)
-    message_batch = response["messages"]
+    for message_batch, _ in get_message_pages(conversation_id, client, oldest=oldest):
+        if not message_batch:
+            return
+        yield message_batch
+
+
+def get_thread_replies(conversation_id: str, thread_ts: str, client: slack.WebClient,
+                       bucket: Optional[TokenBucket] = None) -> List[Dict]:
+    """
+    Get all replies in the thread started at `thread_ts`, without the parent
+    message.
+    """
 
-    if not message_batch:
-        return
+    replies = []
+    cursor = None
+    while True:
+        response = client_call(
+            client,
+            lambda: client.conversations_replies(channel=conversation_id, ts=thread_ts, limit=200, cursor=cursor),
+            bucket
+        )
+        replies.extend(m for m in response["messages"] if m["ts"] != thread_ts)
 
-    yield message_batch
+        cursor = response.get("response_metadata", {}).get("next_cursor") if response.get("has_more") else None
+        if not cursor:
+            return replies
+
+
+def get_conversation_members(conversation_id: str, client: slack.WebClient) -> Iterator[str]:
+    """
+    Get ids of all members of a conversation.
+    """
+
+    cursor = None
+    while True:
+        response = client_call(client, lambda: client.conversations_members(channel=conversation_id, limit=1000, cursor=cursor))
+        yield from response["members"]
+
+        cursor = response.get("response_metadata", {}).get("next_cursor")
+        if not cursor:
+            break
+
+
+def bulk_invite(client: slack.WebClient, channel_id: str, user_ids: Iterable[str],
+                batch_size=100, bucket: Optional[TokenBucket] = None, max_retries=3) -> Dict:
+    """
+    Invite users to a channel in batches of `batch_size` ids per call. Users
+    already in the channel are skipped. When a batch fails, only its failing
+    ids are retried: ids reported in the error are dropped and the rest are
+    sent again, unreported failures are bisected till the culprits are found.
+
+    Return a summary with lists of `invited` and `skipped` ids and a `failed`
+    map from id to the error. `bucket` and `max_retries` only apply to clients
+    other than arwa's own, which budget and retry every call themselves.
+    """
 
-    while response["has_more"]:
-        next_cursor = response["response_metadata"]["next_cursor"]
-        response = client.conversations_history(channel=conversation_id, cursor=next_cursor)
-        yield response["messages"]
+    # conversations.invite is a Tier 3 method
+    bucket = bucket or TokenBucket.per_minute(50)
+
+    members = set(get_conversation_members(channel_id, client))
+    summary: Dict = {"channel": channel_id, "invited": [], "skipped": [], "failed": {}}
+
+    pending = []
+    for uid in py_.uniq(list(user_ids)):
+        if uid in members:
+            summary["skipped"].append(uid)
+        else:
+            pending.append(uid)
+
+    batches = [(batch, 0) for batch in py_.chunk(pending, batch_size)]
+    bar = tqdm(total=len(pending))
+
+    while batches:
+        batch, attempt = batches.pop()
+
+        try:
+            client_call(client, lambda: client.conversations_invite(channel=channel_id, users=batch), bucket)
+        except SlackApiError as e:
+            user_errors = {it["user"]: it["error"] for it in e.response.get("errors", []) if "user" in it}
+
+            if user_errors:
+                for uid, error in user_errors.items():
+                    if error == "already_in_channel":
+                        summary["skipped"].append(uid)
+                    else:
+                        summary["failed"][uid] = error
+                    bar.update()
+                rest = [uid for uid in batch if uid not in user_errors]
+                if rest:
+                    batches.append((rest, attempt))
+            elif len(batch) > 1 and e.response.get("error") in USER_INVITE_ERRORS:
+                # One of the users is at fault, but Slack didn't say which
+                mid = len(batch) // 2
+                batches.extend([(batch[:mid], attempt), (batch[mid:], attempt)])
+            elif e.response.get("error") == "already_in_channel":
+                summary["skipped"].extend(batch)
+                bar.update(len(batch))
+            else:
+                for uid in batch:
+                    summary["failed"][uid] = e.response.get("error", str(e))
+                bar.update(len(batch))
+        except Exception as e:
+            # Transport level failures are worth another try, arwa's clients
+            # have already retried them
+            if attempt < max_retries and not isinstance(client, ArwaWebClient):
+                batches.append((batch, attempt + 1))
+            else:
+                for uid in batch:
+                    summary["failed"][uid] = str(e)
+                bar.update(len(batch))
+        else:
+            summary["invited"].extend(batch)
+            bar.update(len(batch))
+
+    bar.close()
+    return summary
@@ -1,28 +1,451 @@
+import datetime
+import json
 import os
 import sqlite3
-from typing import List
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
-from arwa.types import SlackMessage
+from arwa.types import SlackMessage, SlackMessageAction, SlackUser
+
+
+def default_cache_path(name: str) -> str:
+    """
+    Return path for a cache file, creating the cache directory if needed. The
+    directory is `$ARWA_CACHE_DIR`, falling back to `~/.cache/arwa`.
+    """
+
+    cache_dir = os.environ.get("ARWA_CACHE_DIR", os.path.expanduser("~/.cache/arwa"))
+    os.makedirs(cache_dir, exist_ok=True)
+    return os.path.join(cache_dir, name)
 
 
 class SqliteDB:
-    def __init__(self, path: str):
-        if not os.path.exists(path):
-            raise RuntimeError(f"arwa db path {path} not found")
-        self.conn = sqlite3.connect(path)
+    """
+    Store of slack messages seen live. Writes are buffered in a transaction
+    that's committed once `commit_size` messages are pending or
+    `commit_interval` seconds have passed since the last commit, so call
+    `flush` (or `close`) to make sure everything is on disk.
+
+    Message ts are kept as text, which sorts in time order for slack's fixed
+    format ts.
+    """
+
+    slack_table = "slack_rtm"
+
+    def __init__(self, path: str, commit_size=1000, commit_interval=1.0):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.RLock()
+        self.commit_size = commit_size
+        self.commit_interval = commit_interval
+
+        self.pending = 0
+        self.last_commit = time.monotonic()
+
+        # WAL lets readers go on while a writer commits and makes commits
+        # cheaper, with normal sync being safe under it.
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.migrate()
+
+    def migrate(self):
+        """
+        Create the table or add columns missing in tables made by older
+        versions.
+        """
+
+        with self.lock, self.conn:
+            self.conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {self.slack_table} (
+              message TEXT, channel TEXT, thread_ts TEXT, ts TEXT, user TEXT
+            )""")
 
-        self.slack_table = "slack_rtm"
+            columns = {row[1] for row in self.conn.execute(f"PRAGMA table_info({self.slack_table})")}
+            for column in ["ts", "user"]:
+                if column not in columns:
+                    self.conn.execute(f"ALTER TABLE {self.slack_table} ADD COLUMN {column} TEXT")
+
+            self.conn.execute(f"CREATE INDEX IF NOT EXISTS {self.slack_table}_channel ON {self.slack_table} (channel, ts)")
+            self.conn.execute(f"CREATE INDEX IF NOT EXISTS {self.slack_table}_thread ON {self.slack_table} (thread_ts)")
+
+    def save_messages(self, msgs: Iterable[SlackMessage]) -> int:
+        """
+        Insert messages in one go and commit if a threshold is crossed. Return
+        number of messages inserted.
+        """
+
+        rows = [(msg.message, msg.channel, msg.thread_ts, msg.ts, msg.user) for msg in msgs]
+
+        with self.lock:
+            self.conn.executemany(
+                f"INSERT INTO {self.slack_table} (message, channel, thread_ts, ts, user) VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+            self.pending += len(rows)
+
+            if self.pending >= self.commit_size or (time.monotonic() - self.last_commit) >= self.commit_interval:
+                self.flush()
+
+        return len(rows)
 
     def save_message(self, msg: SlackMessage):
-        cur = self.conn.cursor()
-        cur.execute(
-            f"""INSERT INTO {self.slack_table} (message, channel, thread_ts) VALUES (?, ?, ?)""",
-            (msg.message, msg.channel, msg.thread_ts)
-        )
-        self.conn.commit()
-
-    def load_messages(self) -> List[SlackMessage]:
-        cur = self.conn.cursor()
-        cur.execute(f"""SELECT message, channel, thread_ts FROM {self.slack_table}""")
-
-        return [SlackMessage(*it) for it in cur.fetchall()]
+        self.save_messages([msg])
+
+    def flush(self):
+        with self.lock:
+            self.conn.commit()
+            self.pending = 0
+            self.last_commit = time.monotonic()
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def load_messages(self, channel: Optional[str] = None, thread_ts: Optional[str] = None,
+                      oldest: Optional[str] = None, latest: Optional[str] = None,
+                      batch_size=1000) -> Iterator[SlackMessage]:
+        """
+        Yield messages in insertion order, optionally only the ones in a
+        channel, a thread or with ts in [oldest, latest). Rows are read in
+        batches of `batch_size` so memory stays flat for large stores.
+        """
+
+        conditions, params = [], []
+        for clause, value in [("channel = ?", channel), ("thread_ts = ?", thread_ts), ("ts >= ?", oldest), ("ts < ?", latest)]:
+            if value is not None:
+                conditions.append(clause)
+                params.append(value)
+
+        query = f"SELECT message, channel, thread_ts, ts, user FROM {self.slack_table}"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY rowid"
+
+        for row in self._stream(query, params, batch_size):
+            yield SlackMessage(*row)
+
+    def load_rows(self, after_rowid=0, batch_size=1000) -> Iterator[Tuple[int, SlackMessage]]:
+        """
+        Yield (rowid, message) for rows inserted after `after_rowid`, for
+        consumers following the table incrementally.
+        """
+
+        query = f"SELECT rowid, message, channel, thread_ts, ts, user FROM {self.slack_table} WHERE rowid > ? ORDER BY rowid"
+        for row in self._stream(query, [after_rowid], batch_size):
+            yield row[0], SlackMessage(*row[1:])
+
+    def _stream(self, query: str, params: List, batch_size: int) -> Iterator[Tuple]:
+        with self.lock:
+            cur = self.conn.execute(query, params)
+
+        while True:
+            with self.lock:
+                rows = cur.fetchmany(batch_size)
+            if not rows:
+                return
+            yield from rows
+
+
+class SqliteCache:
+    """
+    Base for local sqlite caches of remote data that are refreshed once older
+    than a given age. Use ":memory:" as `path` for a cache that lives only as
+    long as the process.
+    """
+
+    schema = ""
+
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        # Serializes writers sharing the connection across threads
+        self.lock = threading.RLock()
+        self.conn.executescript(self.schema + """
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        """)
+
+    def mark_refreshed(self):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('refreshed_at', ?)", (str(time.time()),))
+
+    def refreshed_at(self) -> Optional[float]:
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'refreshed_at'").fetchone()
+        return float(row[0]) if row else None
+
+    def is_stale(self, max_age: float) -> bool:
+        """
+        Tell if the cache was last refreshed more than `max_age` seconds back.
+        """
+
+        refreshed_at = self.refreshed_at()
+        return refreshed_at is None or (time.time() - refreshed_at) > max_age
+
+
+class UserDirectory(SqliteCache):
+    """
+    Local copy of workspace users.
+    """
+
+    schema = """
+    CREATE TABLE IF NOT EXISTS users (
+      id TEXT PRIMARY KEY,
+      name TEXT,
+      is_bot INTEGER,
+      is_deleted INTEGER,
+      email TEXT,
+      updated INTEGER
+    );
+    CREATE INDEX IF NOT EXISTS users_email ON users (email);
+    """
+
+    def update(self, members: Iterable[Dict]) -> int:
+        """
+        Update directory from raw slack member objects, writing only the ones
+        with an `updated` timestamp newer than what is stored. Return number of
+        users written.
+        """
+
+        known = dict(self.conn.execute("SELECT id, updated FROM users"))
+
+        rows = []
+        for member in members:
+            updated = member.get("updated", 0)
+            if member["id"] in known and known[member["id"]] >= updated:
+                continue
+
+            profile = member["profile"]
+            rows.append((
+                member["id"], profile["real_name"], member["is_bot"], member["deleted"],
+                profile.get("email"), updated
+            ))
+
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO users VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+        return len(rows)
+
+    @staticmethod
+    def _row_to_user(row) -> SlackUser:
+        return SlackUser(row[0], row[1], is_bot=bool(row[2]), is_deleted=bool(row[3]), email=row[4])
+
+    def get(self, user_id: str) -> Optional[SlackUser]:
+        row = self.conn.execute(
+            "SELECT id, name, is_bot, is_deleted, email FROM users WHERE id = ?", (user_id,)
+        ).fetchone()
+        return self._row_to_user(row) if row else None
+
+    def get_many(self, user_ids: Iterable[str]) -> Dict[str, SlackUser]:
+        """
+        Return users for the given ids. Ids not in directory are left out.
+        """
+
+        user_ids = list(user_ids)
+        users = {}
+
+        # Stay within sqlite's limit on number of bound parameters
+        for i in range(0, len(user_ids), 500):
+            chunk = user_ids[i:i + 500]
+            cur = self.conn.execute(
+                f"SELECT id, name, is_bot, is_deleted, email FROM users WHERE id IN ({', '.join('?' * len(chunk))})",
+                chunk
+            )
+            for row in cur:
+                users[row[0]] = self._row_to_user(row)
+
+        return users
+
+    def iter_users(self, all_users=False) -> Iterator[SlackUser]:
+        query = "SELECT id, name, is_bot, is_deleted, email FROM users"
+        if not all_users:
+            query += " WHERE NOT (is_bot OR is_deleted OR id = 'USLACKBOT')"
+
+        for row in self.conn.execute(query + " ORDER BY id"):
+            yield self._row_to_user(row)
+
+
+class ChannelIndex(SqliteCache):
+    """
+    Local index from conversation names to their ids.
+    """
+
+    schema = """
+    CREATE TABLE IF NOT EXISTS channels (
+      name TEXT PRIMARY KEY,
+      id TEXT
+    );
+    """
+
+    def get(self, name: str) -> Optional[str]:
+        row = self.conn.execute("SELECT id FROM channels WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def update(self, channels: Iterable[Dict]):
+        """
+        Add raw slack conversation objects to the index. Conversations without
+        a name (direct messages) are skipped.
+        """
+
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO channels VALUES (?, ?)",
+                [(ch["name"], ch["id"]) for ch in channels if ch.get("name")]
+            )
+
+    def clear(self):
+        with self.conn:
+            self.conn.execute("DELETE FROM channels")
+
+
+class EventStore(SqliteCache):
+    """
+    Local copy of calendar events, kept as raw API resources keyed by calendar
+    and event id, along with the sync token and time window covered for each
+    calendar.
+    """
+
+    schema = """
+    CREATE TABLE IF NOT EXISTS events (
+      calendar_id TEXT,
+      event_id TEXT,
+      start_ts REAL,
+      end_ts REAL,
+      resource TEXT,
+      PRIMARY KEY (calendar_id, event_id)
+    );
+    CREATE INDEX IF NOT EXISTS events_time ON events (calendar_id, start_ts);
+    CREATE TABLE IF NOT EXISTS sync_state (
+      calendar_id TEXT PRIMARY KEY,
+      sync_token TEXT,
+      window_start REAL,
+      window_end REAL
+    );
+    """
+
+    def get_sync_state(self, calendar_id: str) -> Optional[Tuple[str, float, float]]:
+        """
+        Return sync token and covered window (epoch seconds) for a calendar.
+        """
+
+        return self.conn.execute(
+            "SELECT sync_token, window_start, window_end FROM sync_state WHERE calendar_id = ?", (calendar_id,)
+        ).fetchone()
+
+    def apply(self, calendar_id: str, upserts: Iterable[Tuple[str, float, float, Dict]], deletes: Iterable[str],
+              sync_token: str, window: Tuple[float, float], replace=False):
+        """
+        Write a sync result for a calendar in one transaction. `upserts` are
+        (event id, start ts, end ts, resource) tuples. With `replace`, all
+        events stored earlier for the calendar are dropped first.
+        """
+
+        with self.lock, self.conn:
+            if replace:
+                self.conn.execute("DELETE FROM events WHERE calendar_id = ?", (calendar_id,))
+
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?)",
+                [(calendar_id, event_id, start_ts, end_ts, json.dumps(resource))
+                 for event_id, start_ts, end_ts, resource in upserts]
+            )
+            self.conn.executemany(
+                "DELETE FROM events WHERE calendar_id = ? AND event_id = ?",
+                [(calendar_id, event_id) for event_id in deletes]
+            )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?, ?)",
+                (calendar_id, sync_token, window[0], window[1])
+            )
+
+    def query(self, calendar_id: str, start_ts: float, end_ts: float) -> Iterator[Dict]:
+        """
+        Return resources of events overlapping the window in order of start
+        time.
+        """
+
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT resource FROM events WHERE calendar_id = ? AND start_ts < ? AND end_ts > ? ORDER BY start_ts",
+                (calendar_id, end_ts, start_ts)
+            ).fetchall()
+
+        for row in rows:
+            yield json.loads(row[0])
+
+
+class ActionStore(SqliteCache):
+    """
+    Scheduled slack messages with their delivery status.
+    """
+
+    schema = """
+    CREATE TABLE IF NOT EXISTS actions (
+      id INTEGER PRIMARY KEY,
+      scheduled REAL,
+      message TEXT,
+      channel TEXT,
+      thread_ts TEXT,
+      status TEXT DEFAULT 'pending',
+      sent_ts TEXT,
+      error TEXT
+    );
+    CREATE INDEX IF NOT EXISTS actions_pending ON actions (status, id);
+    """
+
+    def add(self, action: SlackMessageAction) -> int:
+        """
+        Save a pending action and return its id. Naive times are taken as
+        local time.
+        """
+
+        with self.lock, self.conn:
+            cur = self.conn.execute(
+                "INSERT INTO actions (scheduled, message, channel, thread_ts) VALUES (?, ?, ?, ?)",
+                (action.scheduled.timestamp(), action.message, action.channel, action.thread_ts)
+            )
+            return cur.lastrowid
+
+    def add_many(self, actions: Iterable[SlackMessageAction]):
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT INTO actions (scheduled, message, channel, thread_ts) VALUES (?, ?, ?, ?)",
+                [(a.scheduled.timestamp(), a.message, a.channel, a.thread_ts) for a in actions]
+            )
+
+    def load_pending(self, after_id=0) -> Iterator[Tuple[int, SlackMessageAction]]:
+        """
+        Yield (id, action) for pending actions with ids above `after_id`.
+        """
+
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, scheduled, message, channel, thread_ts FROM actions WHERE status = 'pending' AND id > ? ORDER BY id",
+                (after_id,)
+            ).fetchall()
+
+        for action_id, scheduled, message, channel, thread_ts in rows:
+            scheduled_dt = datetime.datetime.fromtimestamp(scheduled, datetime.timezone.utc).astimezone()
+            yield action_id, SlackMessageAction(scheduled_dt, message, channel, thread_ts)
+
+    def mark_sent(self, sent: Iterable[Tuple[int, Optional[str]]]):
+        """
+        Mark actions sent, taking (id, message ts) pairs.
+        """
+
+        with self.lock, self.conn:
+            self.conn.executemany("UPDATE actions SET status = 'sent', sent_ts = ? WHERE id = ?", [(ts, i) for i, ts in sent])
+
+    def mark_failed(self, failed: Iterable[Tuple[int, str]]):
+        """
+        Mark actions failed, taking (id, error) pairs.
+        """
+
+        with self.lock, self.conn:
+            self.conn.executemany("UPDATE actions SET status = 'failed', error = ? WHERE id = ?", [(e, i) for i, e in failed])
+
+    def counts(self) -> Dict[str, int]:
+        return dict(self.conn.execute("SELECT status, COUNT(*) FROM actions GROUP BY status"))
@@ -0,0 +1,251 @@
+"""
+Tracing of outbound API calls. While tracing is on, every call is written
+to a timeline file with its latency, payload size, retries and time spent
+waiting on rate limits, and per method latencies are summarized at the end.
+
+Tracing is off by default and spans are then no-ops.
+"""
+
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+# Upper bounds in seconds of the latency histogram buckets
+HISTOGRAM_BOUNDS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, float("inf")]
+
+_tracer: Optional["Tracer"] = None
+_current: contextvars.ContextVar = contextvars.ContextVar("arwa_trace_span", default=None)
+
+
+class Tracer:
+    """
+    Write trace events to `path` as they finish. Paths ending in `.jsonl` get
+    one event per line, anything else gets a Chrome trace (JSON array format,
+    opens in chrome://tracing or Perfetto). Both hold the same complete
+    events.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.jsonl = path.endswith(".jsonl")
+        self.fp = open(path, "w")
+        self.n_events = 0
+        self.origin = time.perf_counter()
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+
+        self.latencies: Dict[str, List[float]] = {}
+        self.totals: Dict[str, Dict[str, float]] = {}
+
+    def record(self, name: str, category: str, start: float, duration: float, args: Dict):
+        """
+        Record an event that started at `start`, a `time.perf_counter` value,
+        and took `duration` seconds.
+        """
+
+        event = {
+            "name": name, "cat": category, "ph": "X",
+            "ts": round((start - self.origin) * 1e6), "dur": round(duration * 1e6),
+            "pid": self.pid, "tid": threading.get_ident(), "args": args
+        }
+        line = json.dumps(event)
+
+        with self.lock:
+            if self.jsonl:
+                self.fp.write(line + "\n")
+            else:
+                self.fp.write(("[\n" if self.n_events == 0 else ",\n") + line)
+            self.n_events += 1
+
+            self.latencies.setdefault(name, []).append(duration)
+            totals = self.totals.setdefault(name, {})
+            for key, value in args.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    totals[key] = totals.get(key, 0) + value
+            if args.get("error"):
+                totals["errors"] = totals.get("errors", 0) + 1
+
+    def close(self):
+        with self.lock:
+            if not self.jsonl:
+                self.fp.write("[\n]\n" if self.n_events == 0 else "\n]\n")
+            self.fp.close()
+
+    def summary(self) -> List[Dict]:
+        """
+        Return latency stats and histogram counts of each method, slowest in
+        total first.
+        """
+
+        rows = []
+        for name, latencies in self.latencies.items():
+            latencies = sorted(latencies)
+            totals = self.totals.get(name, {})
+
+            def _quantile(q: float) -> float:
+                return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+            histogram = [0] * len(HISTOGRAM_BOUNDS)
+            bucket = 0
+            for latency in latencies:
+                while latency > HISTOGRAM_BOUNDS[bucket]:
+                    bucket += 1
+                histogram[bucket] += 1
+
+            rows.append({
+                "method": name,
+                "calls": len(latencies),
+                "errors": int(totals.get("errors", 0)),
+                "retries": int(totals.get("retries", 0)),
+                "ratelimit_wait": totals.get("ratelimit_wait", 0.0),
+                "bytes": int(totals.get("bytes_sent", 0) + totals.get("bytes_received", 0)),
+                "total": sum(latencies),
+                "p50": _quantile(0.5),
+                "p90": _quantile(0.9),
+                "p99": _quantile(0.99),
+                "max": latencies[-1],
+                "histogram": histogram
+            })
+
+        return sorted(rows, key=lambda row: -row["total"])
+
+
+class Span:
+    """
+    A call being traced. Numbers added with `add` are summed into the event's
+    args.
+    """
+
+    __slots__ = ("tracer", "name", "category", "args", "start", "token")
+
+    def __init__(self, tracer: Tracer, name: str, category: str, args: Dict):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __bool__(self):
+        return True
+
+    def add(self, key: str, value: float):
+        if value:
+            self.args[key] = self.args.get(key, 0) + value
+
+    def __enter__(self):
+        self.token = _current.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.start
+        _current.reset(self.token)
+        if exc is not None:
+            self.args["error"] = str(exc) or exc_type.__name__
+        self.tracer.record(self.name, self.category, self.start, duration, self.args)
+
+
+class _NullSpan:
+    """
+    Span used when tracing is off.
+    """
+
+    def __bool__(self):
+        return False
+
+    def add(self, key: str, value: float):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def start(path: str) -> Tracer:
+    """
+    Start tracing to `path`.
+    """
+
+    global _tracer
+
+    if _tracer is not None:
+        raise RuntimeError("Tracing is already on")
+
+    _tracer = Tracer(path)
+    return _tracer
+
+
+def stop(print_summary=True) -> Optional[Tracer]:
+    """
+    Stop tracing, close the trace file and print the summary to stderr.
+    """
+
+    global _tracer
+
+    tracer, _tracer = _tracer, None
+    if tracer is not None:
+        tracer.close()
+        if print_summary:
+            print_latencies(tracer, file=sys.stderr)
+    return tracer
+
+
+def span(name: str, category: str = "", **args):
+    """
+    Return span for timing a call with `with`. Spans are free when tracing is
+    off so callers don't need to check.
+    """
+
+    if _tracer is None:
+        return _NULL_SPAN
+    return Span(_tracer, name, category, args)
+
+
+def current():
+    """
+    Return the innermost open span of this thread or task, a no-op span if
+    there is none.
+    """
+
+    return _current.get() or _NULL_SPAN
+
+
+def record_wait(name: str, seconds: float):
+    """
+    Record time already spent waiting, like sleeping on a rate limit, as an
+    event ending now.
+    """
+
+    if _tracer is not None and seconds > 0:
+        _tracer.record(name, "wait", time.perf_counter() - seconds, seconds, {"ratelimit_wait": seconds})
+
+
+def print_latencies(tracer: Tracer, file=sys.stdout):
+    from tabulate import tabulate
+
+    rows = tracer.summary()
+    if not rows:
+        return
+
+    print(tabulate(
+        [(r["method"], r["calls"], r["errors"], r["retries"], r["ratelimit_wait"], r["bytes"] / 2 ** 20,
+          r["total"], r["p50"] * 1000, r["p90"] * 1000, r["p99"] * 1000, r["max"] * 1000) for r in rows],
+        headers=["Method", "Calls", "Errors", "Retries", "Wait s", "MB", "Total s", "p50 ms", "p90 ms", "p99 ms", "Max ms"],
+        tablefmt="fancy_grid", floatfmt=".2f"
+    ), file=file)
+
+    labels = [f"<={b * 1000:g}ms" if b < 1 else f"<={b:g}s" for b in HISTOGRAM_BOUNDS[:-1]]
+    labels.append(f">{HISTOGRAM_BOUNDS[-2]:g}s")
+    print(tabulate(
+        [[r["method"]] + r["histogram"] for r in rows],
+        headers=["Method"] + labels,
+        tablefmt="fancy_grid"
+    ), file=file)
@@ -1,8 +1,42 @@
+import dataclasses
 import datetime
+import sys
 from dataclasses import dataclass
-from typing import List, Optional
+from typing import List, Optional, Type, TypeVar
 
+T = TypeVar("T")
 
+
+def _getstate(self):
+    return [getattr(self, f.name) for f in dataclasses.fields(self)]
+
+
+def _setstate(self, state):
+    # object.__setattr__ since frozen dataclasses block setattr
+    for f, value in zip(dataclasses.fields(self), state):
+        object.__setattr__(self, f.name, value)
+
+
+def slotted(cls: Type[T]) -> Type[T]:
+    """
+    Rebuild a dataclass with `__slots__` so that instances don't carry a
+    `__dict__`. This is `dataclass(slots=True)` of python 3.10 for the older
+    versions we support. Apply it over the `dataclass` decorator.
+    """
+
+    names = tuple(f.name for f in dataclasses.fields(cls))
+
+    body = {k: v for k, v in cls.__dict__.items() if k not in names + ("__dict__", "__weakref__")}
+    body["__slots__"] = names
+    body["__getstate__"] = _getstate
+    body["__setstate__"] = _setstate
+
+    slotted_cls = type(cls)(cls.__name__, cls.__bases__, body)
+    slotted_cls.__qualname__ = cls.__qualname__
+    return slotted_cls
+
+
+@slotted
 @dataclass(eq=True, frozen=True)
 class SlackUser:
     id: str
@@ -22,12 +56,16 @@ class SlackMessage:
     message: str
     channel: str
     thread_ts: Optional[str] = None
+    ts: Optional[str] = None
+    user: Optional[str] = None
 
 
+@slotted
 @dataclass
 class CalendarEvent:
     """
-    A time blocked calendar event.
+    A time blocked calendar event. Attendee emails are interned since the same
+    few show up across most events.
     """
 
     name: str
@@ -36,6 +74,11 @@ class CalendarEvent:
     attendees: List[str]
     response_status: Optional[str] = None
 
+    def __post_init__(self):
+        self.attendees = [sys.intern(email) if email else email for email in self.attendees]
+        if self.response_status:
+            self.response_status = sys.intern(self.response_status)
+
 
 @dataclass
 class SlackMessageAction:
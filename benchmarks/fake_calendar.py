@@ -0,0 +1,189 @@
+"""
+Local stand-in for the Calendar API events listing, including the batch
+endpoint, for running calendar code without Google.
+"""
+
+import datetime
+import email.parser
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+from urllib.parse import parse_qs, unquote, urlparse
+
+
+def make_event(event_id: str, start: datetime.datetime, minutes: int, attendees: List[str], summary="meeting") -> Dict:
+    return {
+        "id": event_id,
+        "status": "confirmed",
+        "summary": summary,
+        "description": "x" * 200,
+        "start": {"dateTime": start.isoformat()},
+        "end": {"dateTime": (start + datetime.timedelta(minutes=minutes)).isoformat()},
+        "attendees": [{"email": a, "responseStatus": "accepted"} for a in attendees],
+    }
+
+
+def parse_time(value: str) -> datetime.datetime:
+    return datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def project(item: Dict, fields=None) -> Dict:
+    """
+    Keep only top level keys of an item asked for in `fields`, enough for
+    seeing the effect of projections on payload sizes.
+    """
+
+    if not fields or "items(" not in fields:
+        return item
+
+    wanted = fields.split("items(", 1)[1]
+    keys, depth, name = set(), 0, ""
+    for char in wanted:
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            if depth == 0:
+                break
+            depth -= 1
+        elif char == "," and depth == 0:
+            keys.add(name)
+            name = ""
+        elif depth == 0:
+            name += char
+    keys.add(name)
+
+    return {k: v for k, v in item.items() if k in keys}
+
+
+class FakeCalendarServer:
+    """
+    Serve event listings of `calendars`, a map from calendar id to event
+    resources, over http. Requests, batches, calls and bytes sent are counted
+    in `requests`, `batches`, `calls` and `bytes_sent`. Each call is delayed
+    by `latency` seconds and every `ratelimit_every`th call is answered with a
+    429.
+    """
+
+    def __init__(self, calendars: Dict[str, List[Dict]], latency=0.0, ratelimit_every=0):
+        self.calendars = calendars
+        self.latency = latency
+        self.ratelimit_every = ratelimit_every
+        self.requests = 0
+        self.batches = 0
+        self.bytes_sent = 0
+        self.calls: List[Dict] = []
+        self.lock = threading.Lock()
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}/"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def list_events(self, path: str) -> Tuple[int, Dict]:
+        url = urlparse(path)
+        parts = url.path.split("/")
+        # /calendar/v3/calendars/<id>/events
+        if len(parts) != 6 or parts[3] != "calendars" or parts[5] != "events":
+            return 404, {"error": {"code": 404, "message": "Not Found"}}
+
+        calendar_id = unquote(parts[4])
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+
+        with self.lock:
+            self.calls.append(dict(params, calendarId=calendar_id))
+            n_calls = len(self.calls)
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        if self.ratelimit_every and n_calls % self.ratelimit_every == 0:
+            return 429, {"error": {"code": 429, "message": "Rate Limit Exceeded"}}
+
+        if calendar_id not in self.calendars:
+            return 404, {"error": {"code": 404, "message": "Not Found"}}
+
+        if "syncToken" in params:
+            return 200, {"items": [], "nextSyncToken": str(uuid.uuid4())}
+
+        items = self.calendars[calendar_id]
+        if "timeMin" in params:
+            items = [it for it in items if parse_time(it["end"]["dateTime"]) > parse_time(params["timeMin"])]
+        if "timeMax" in params:
+            items = [it for it in items if parse_time(it["start"]["dateTime"]) < parse_time(params["timeMax"])]
+
+        offset = int(params.get("pageToken", 0))
+        page_size = min(int(params.get("maxResults", 250)), 2500)
+        body: Dict = {"items": [project(it, params.get("fields")) for it in items[offset:offset + page_size]]}
+
+        if offset + page_size < len(items):
+            body["nextPageToken"] = str(offset + page_size)
+        else:
+            body["nextSyncToken"] = str(uuid.uuid4())
+
+        return 200, body
+
+    def run_batch(self, content_type: str, payload: bytes) -> Tuple[str, bytes]:
+        message = email.parser.BytesParser().parsebytes(
+            b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + payload
+        )
+
+        boundary = uuid.uuid4().hex
+        out = []
+        for part in message.get_payload():
+            request_line = part.get_payload().splitlines()[0]
+            _, path, _ = request_line.split(" ")
+            status, body = self.list_events(path)
+
+            content_id = part["Content-ID"].strip("<>")
+            out.append(
+                f"--{boundary}\r\nContent-Type: application/http\r\nContent-ID: <response-{content_id}>\r\n\r\n"
+                f"HTTP/1.1 {status} OK\r\nContent-Type: application/json\r\n\r\n{json.dumps(body)}\r\n"
+            )
+
+        out.append(f"--{boundary}--\r\n")
+        return f"multipart/mixed; boundary={boundary}", "".join(out).encode()
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status: int, content_type: str, body: bytes):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                with server.lock:
+                    server.bytes_sent += len(body)
+
+            def do_GET(self):
+                with server.lock:
+                    server.requests += 1
+                status, body = server.list_events(self.path)
+                self._reply(status, "application/json", json.dumps(body).encode())
+
+            def do_POST(self):
+                payload = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                with server.lock:
+                    server.requests += 1
+                    server.batches += 1
+                content_type, body = server.run_batch(self.headers["Content-Type"], payload)
+                self._reply(200, content_type, body)
+
+        return Handler
@@ -0,0 +1,154 @@
+"""
+Local stand-in for the parts of the Slack Web API that arwa pages through,
+for running slack code without a workspace.
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Set, Tuple
+from urllib.parse import parse_qs, urlparse
+
+
+def make_member(i: int) -> Dict:
+    return {
+        "id": f"U{i:07}",
+        "name": f"user{i}",
+        "deleted": i % 50 == 0,
+        "is_bot": i % 40 == 0,
+        "profile": {"real_name": f"User {i}", "email": f"user{i}@example.com"},
+    }
+
+
+def make_messages(n: int, base_ts=1600000000) -> List[Dict]:
+    """
+    Return `n` messages, newest first like conversations.history.
+    """
+
+    return [
+        {"type": "message", "user": f"U{i % 1000:07}", "text": f"message {i} " + "lorem ipsum " * 8,
+         "ts": f"{base_ts + i}.000100"}
+        for i in range(n - 1, -1, -1)
+    ]
+
+
+class FakeSlackServer:
+    """
+    Serve users.list, conversations.history, conversations.members and
+    conversations.invite over http with cursor pagination.
+
+    Every channel starts out with `members`. Inviting any of `bad_users`
+    fails for that user. Each call is delayed by `latency` seconds and every
+    `ratelimit_every`th call is answered with a 429 asking to retry after
+    `retry_after` seconds. Calls are counted per method in `calls`.
+    """
+
+    def __init__(self, users: List[Dict], messages: Dict[str, List[Dict]], members: List[str] = None,
+                 bad_users: Set[str] = None, latency=0.0, ratelimit_every=0, retry_after=0):
+        self.users = users
+        self.messages = messages
+        self.members = members or []
+        self.bad_users = bad_users or set()
+        self.latency = latency
+        self.ratelimit_every = ratelimit_every
+        self.retry_after = retry_after
+
+        self.channel_members: Dict[str, List[str]] = {}
+        self.calls: Dict[str, int] = {}
+        self.n_calls = 0
+        self.lock = threading.Lock()
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}/api/"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def page(self, items: List, params: Dict, key: str, default_limit=100) -> Dict:
+        offset = int(params.get("cursor") or 0)
+        limit = int(params.get("limit") or default_limit)
+        end = offset + limit
+
+        body = {"ok": True, key: items[offset:end], "has_more": end < len(items)}
+        body["response_metadata"] = {"next_cursor": str(end) if end < len(items) else ""}
+        return body
+
+    def call(self, method: str, params: Dict) -> Tuple[int, Dict]:
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            self.n_calls += 1
+            n_calls = self.n_calls
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        if self.ratelimit_every and n_calls % self.ratelimit_every == 0:
+            return 429, {"ok": False, "error": "ratelimited"}
+
+        if method == "users.list":
+            return 200, self.page(self.users, params, "members")
+
+        elif method == "conversations.history":
+            if params.get("channel") not in self.messages:
+                return 200, {"ok": False, "error": "channel_not_found"}
+            return 200, self.page(self.messages[params["channel"]], params, "messages")
+
+        elif method == "conversations.members":
+            with self.lock:
+                members = list(self.channel_members.get(params["channel"], self.members))
+            return 200, self.page(members, params, "members")
+
+        elif method == "conversations.invite":
+            user_ids = params["users"].split(",")
+            errors = [{"user": uid, "ok": False, "error": "user_is_restricted"} for uid in user_ids if uid in self.bad_users]
+            if errors:
+                return 200, {"ok": False, "error": errors[0]["error"], "errors": errors}
+
+            with self.lock:
+                members = self.channel_members.setdefault(params["channel"], list(self.members))
+                members.extend(uid for uid in user_ids if uid not in members)
+            return 200, {"ok": True, "channel": {"id": params["channel"]}}
+
+        return 404, {"ok": False, "error": "unknown_method"}
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                params = {k: v[0] for k, v in parse_qs(url.query).items()}
+
+                payload = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if payload and "json" in self.headers.get("Content-Type", ""):
+                    params.update(json.loads(payload))
+                elif payload:
+                    params.update({k: v[0] for k, v in parse_qs(payload.decode()).items()})
+
+                status, body = server.call(url.path.rsplit("/", 1)[-1], params)
+
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                if status == 429:
+                    self.send_header("Retry-After", str(server.retry_after))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST
+
+        return Handler
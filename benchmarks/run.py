@@ -0,0 +1,314 @@
+"""
+Offline benchmarks of arwa's slack and calendar code. Slack and Google
+Calendar are replaced by local stand-ins running in a separate process so
+their work doesn't show up in the timings or memory peaks.
+
+Usage:
+  run.py [<workload>...] [--scale=<scale>] [--repeat=<repeat>] [--latency=<latency>]
+         [--ratelimit-every=<ratelimit-every>] [--output-json=<output-json>]
+         [--baseline=<baseline>] [--tolerance=<tolerance>]
+  run.py --list
+
+Options:
+  --scale=<scale>                       Multiplier for the size of every workload [default: 1].
+  --repeat=<repeat>                     Runs to take the best time from [default: 3].
+  --latency=<latency>                   Milliseconds the stand-ins wait before answering a
+                                        call [default: 0].
+  --ratelimit-every=<ratelimit-every>   Answer every nth call with a 429, 0 for never [default: 0].
+  --output-json=<output-json>           Write results here, usable as a baseline later.
+  --baseline=<baseline>                 Results of an earlier run to compare with. Exits with
+                                        status 1 if a workload got slower or bigger.
+  --tolerance=<tolerance>               Fraction by which a workload can be worse than the
+                                        baseline [default: 0.2].
+  --list                                List workloads.
+"""
+
+import contextlib
+import datetime
+import gc
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+from docopt import docopt
+from tabulate import tabulate
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARKS_DIR)
+
+import slack  # noqa: E402
+
+from arwa import calendar_utils  # noqa: E402
+from arwa.calendar_utils import (find_interstices, parse_google_calendar, parse_google_calendars,  # noqa: E402
+                                 report_events_summary)
+from arwa.ratelimit import TokenBucket  # noqa: E402
+from arwa.slack_utils import bulk_invite, get_message_batches, list_users  # noqa: E402
+from arwa.types import CalendarEvent  # noqa: E402
+from fake_calendar import FakeCalendarServer, make_event  # noqa: E402
+from fake_slack import FakeSlackServer, make_member, make_messages  # noqa: E402
+
+# Workload sizes at scale 1
+N_MESSAGES = 100_000
+N_USERS = 20_000
+N_INVITES = 5_000
+N_MEMBERS = 1_000
+N_BAD_USERS = 20
+N_BIG_CALENDAR = 20_000
+N_TEAM = 100
+N_TEAM_CALENDAR = 1_000
+N_SUMMARY_EVENTS = 200_000
+N_DAY_EVENTS = 100_000
+
+BASE = datetime.datetime(2021, 1, 4, 9, tzinfo=datetime.timezone.utc)
+
+SLACK_WORKLOADS = ["get_message_batches", "list_users", "bulk_invite"]
+CALENDAR_WORKLOADS = ["parse_google_calendar", "parse_google_calendars"]
+LOCAL_WORKLOADS = ["report_events_summary", "find_interstices"]
+WORKLOADS = SLACK_WORKLOADS + CALENDAR_WORKLOADS + LOCAL_WORKLOADS
+
+
+def scaled(n: int, scale: float) -> int:
+    return max(1, int(n * scale))
+
+
+def slack_server(scale: float, latency=0.0, ratelimit_every=0) -> FakeSlackServer:
+    users = [make_member(i) for i in range(scaled(N_USERS, scale))]
+    members = [f"U{i:07}" for i in range(scaled(N_MEMBERS, scale))]
+    bad_users = {f"U{i:07}" for i in range(scaled(N_INVITES, scale) - scaled(N_BAD_USERS, scale), scaled(N_INVITES, scale))}
+
+    return FakeSlackServer(
+        users, {"C0": make_messages(scaled(N_MESSAGES, scale))},
+        members=members, bad_users=bad_users, latency=latency, ratelimit_every=ratelimit_every
+    )
+
+
+def team_events(owner: str, n: int, step: datetime.timedelta) -> List[Dict]:
+    events = []
+    for j in range(n):
+        attendees = [owner]
+        if j % 3:
+            attendees.append(f"u{j % N_TEAM}@example.com")
+        if j % 5 == 0:
+            attendees.append("someone@partner.com")
+        events.append(make_event(f"{owner}-{j}", BASE + step * j, 30 + 15 * (j % 4), attendees))
+    return events
+
+
+def calendar_server(scale: float, latency=0.0, ratelimit_every=0) -> FakeCalendarServer:
+    calendars = {"big@example.com": team_events("big@example.com", scaled(N_BIG_CALENDAR, scale), datetime.timedelta(minutes=26))}
+    for i in range(scaled(N_TEAM, scale)):
+        owner = f"u{i}@example.com"
+        calendars[owner] = team_events(owner, N_TEAM_CALENDAR, datetime.timedelta(hours=3))
+
+    return FakeCalendarServer(calendars, latency=latency, ratelimit_every=ratelimit_every)
+
+
+def _serve(conn, make_server: Callable, args):
+    with make_server(*args) as server:
+        conn.send(server.url)
+        conn.recv()
+
+
+@contextlib.contextmanager
+def serve(make_server: Callable, *args):
+    """
+    Run the server made by `make_server(*args)` in a child process and yield
+    its url.
+    """
+
+    context = multiprocessing.get_context("fork")
+    parent_conn, child_conn = context.Pipe()
+    process = context.Process(target=_serve, args=(child_conn, make_server, args), daemon=True)
+    process.start()
+
+    try:
+        yield parent_conn.recv()
+    finally:
+        parent_conn.send("stop")
+        process.join()
+
+
+def local_events(n: int, rng: random.Random) -> List[CalendarEvent]:
+    events = []
+    for i in range(n):
+        start = BASE + datetime.timedelta(minutes=rng.randrange(0, 60 * 24 * 365, 15))
+        attendees = [f"u{rng.randrange(N_TEAM)}@example.com" for _ in range(rng.choice([1, 2, 2, 3, 6]))]
+        if i % 7 == 0:
+            attendees.append("someone@partner.com")
+        events.append(CalendarEvent(
+            str(i), start, start + datetime.timedelta(minutes=rng.choice([15, 30, 60])), attendees,
+            rng.choice(["accepted", "accepted", "tentative", "declined"])
+        ))
+    return events
+
+
+def day_events(n: int, rng: random.Random) -> List[CalendarEvent]:
+    day = BASE.replace(hour=0)
+    events = []
+    for i in range(n):
+        start = day + datetime.timedelta(seconds=rng.randrange(0, 23 * 60 * 60))
+        events.append(CalendarEvent(str(i), start, start + datetime.timedelta(seconds=rng.randrange(1, 120)), []))
+    return events
+
+
+def setup_workload(name: str, scale: float, slack_client=None, calendar_service=None) -> Callable[[], int]:
+    """
+    Return function running the workload once and returning the number of
+    items it went through.
+    """
+
+    if name == "get_message_batches":
+        return lambda: sum(len(batch) for batch in get_message_batches("C0", slack_client))
+
+    elif name == "list_users":
+        return lambda: len(list_users(slack_client, all_users=True))
+
+    elif name == "bulk_invite":
+        # A new channel every run so earlier invites don't turn into skips
+        channel_ids = (f"C{i}" for i in itertools.count(1))
+        user_ids = [f"U{i:07}" for i in range(scaled(N_INVITES, scale))]
+
+        def _invite():
+            summary = bulk_invite(slack_client, next(channel_ids), user_ids, bucket=TokenBucket(1000.0))
+            return len(summary["invited"]) + len(summary["skipped"]) + len(summary["failed"])
+
+        return _invite
+
+    elif name == "parse_google_calendar":
+        end = BASE + datetime.timedelta(days=400)
+        return lambda: len(parse_google_calendar("big@example.com", BASE, end, service=calendar_service))
+
+    elif name == "parse_google_calendars":
+        email_ids = [f"u{i}@example.com" for i in range(scaled(N_TEAM, scale))]
+        end = BASE + datetime.timedelta(days=400)
+
+        def _parse():
+            calendars = parse_google_calendars(email_ids, BASE, end, service=calendar_service)
+            return sum(len(evs) for evs in calendars.values())
+
+        return _parse
+
+    elif name == "report_events_summary":
+        events = local_events(scaled(N_SUMMARY_EVENTS, scale), random.Random(0))
+
+        def _summary():
+            report_events_summary(events)
+            return len(events)
+
+        return _summary
+
+    elif name == "find_interstices":
+        events = day_events(scaled(N_DAY_EVENTS, scale), random.Random(0))
+
+        def _interstices():
+            find_interstices(events)
+            return len(events)
+
+        return _interstices
+
+    raise ValueError(f"Unknown workload {name}")
+
+
+def measure(run: Callable[[], int], repeat: int) -> Dict:
+    """
+    Return the best time of `repeat` runs and the peak memory traced in one
+    more run.
+    """
+
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        n_items = run()
+        timings.append(time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    seconds = min(timings)
+    return {
+        "items": n_items,
+        "seconds": seconds,
+        "items_per_second": n_items / seconds if seconds else float("inf"),
+        "peak_mb": peak / 2 ** 20
+    }
+
+
+def regressions(results: Dict[str, Dict], baseline: Dict[str, Dict], tolerance: float) -> List[str]:
+    found = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+
+        before = baseline[name]
+        if result["items_per_second"] < before["items_per_second"] * (1 - tolerance):
+            found.append(f"{name}: {before['items_per_second']:.0f} -> {result['items_per_second']:.0f} items/s")
+        if result["peak_mb"] > before["peak_mb"] * (1 + tolerance):
+            found.append(f"{name}: {before['peak_mb']:.1f} -> {result['peak_mb']:.1f} MB peak")
+    return found
+
+
+def main():
+    args = docopt(__doc__)
+
+    if args["--list"]:
+        print("\n".join(WORKLOADS))
+        return
+
+    names = args["<workload>"] or WORKLOADS
+    unknown = set(names) - set(WORKLOADS)
+    if unknown:
+        raise ValueError(f"Unknown workloads {', '.join(sorted(unknown))}")
+
+    scale = float(args["--scale"])
+    repeat = int(args["--repeat"])
+    server_args = (float(args["--latency"]) / 1000, int(args["--ratelimit-every"]))
+
+    results: Dict[str, Dict] = {}
+    with contextlib.ExitStack() as stack:
+        slack_client, calendar_service = None, None
+
+        if set(names) & set(SLACK_WORKLOADS):
+            url = stack.enter_context(serve(slack_server, scale, *server_args))
+            slack_client = slack.WebClient("xoxb-bench", base_url=url)
+
+        if set(names) & set(CALENDAR_WORKLOADS):
+            url = stack.enter_context(serve(calendar_server, scale, *server_args))
+            os.environ["ARWA_CALENDAR_API_URL"] = url
+            calendar_service = calendar_utils.get_calendar_service()
+
+        for name in names:
+            results[name] = measure(setup_workload(name, scale, slack_client, calendar_service), repeat)
+
+    print(tabulate(
+        [(name, r["items"], r["seconds"], r["items_per_second"], r["peak_mb"]) for name, r in results.items()],
+        headers=["Workload", "Items", "Seconds", "Items/s", "Peak MB"],
+        tablefmt="fancy_grid", floatfmt=".3f"
+    ))
+
+    if args["--output-json"]:
+        with open(args["--output-json"], "w") as fp:
+            json.dump(results, fp, indent=2)
+
+    if args["--baseline"]:
+        with open(args["--baseline"]) as fp:
+            found = regressions(results, json.load(fp), float(args["--tolerance"]))
+        for regression in found:
+            print(f"Regression in {regression}")
+        if found:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Local stand-ins for Slack and Google Calendar live with the benchmarks
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "benchmarks"))
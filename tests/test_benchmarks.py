@@ -0,0 +1,21 @@
+import json
+import os
+import subprocess
+import sys
+
+BENCHMARKS = os.path.join(os.path.dirname(__file__), "..", "benchmarks", "run.py")
+
+
+def test_benchmarks_run(tmp_path):
+    output = tmp_path / "results.json"
+    subprocess.run(
+        [sys.executable, BENCHMARKS, "--scale=0.01", "--repeat=1", "--ratelimit-every=5", f"--output-json={output}"],
+        capture_output=True, check=True
+    )
+
+    with open(output) as fp:
+        results = json.load(fp)
+
+    assert results["get_message_batches"]["items"] == 1000
+    assert results["bulk_invite"]["items"] == 50
+    assert all(r["items_per_second"] > 0 and r["peak_mb"] > 0 for r in results.values())
@@ -0,0 +1,71 @@
+import threading
+
+from arwa.bulk_post import dispatch_bulk_post, dry_run_bulk_post
+
+
+class FakePostClient:
+    def __init__(self, fail_for=None):
+        self.fail_for = fail_for
+        self.opened = []
+        self.posted = []
+        self.lock = threading.Lock()
+
+    def conversations_open(self, users):
+        with self.lock:
+            self.opened.append(tuple(users))
+        return {"channel": {"id": "D" + "".join(sorted(users))}}
+
+    def chat_postMessage(self, channel, text):
+        if self.fail_for and self.fail_for in text:
+            raise ConnectionError("network blip")
+        with self.lock:
+            self.posted.append((channel, text))
+        return {"ts": "1.000"}
+
+
+TEMPLATE = "Hello {{ name }}"
+ITEMS = [
+    {"user-ids": ["a", "b"], "variables": {"name": "ab"}},
+    {"user-ids": ["b", "a"], "variables": {"name": "ba"}},
+    {"user-ids": ["c"], "variables": {"name": "c"}},
+]
+
+
+def test_dispatch_bulk_post(tmp_path):
+    log = str(tmp_path / "delivered.jsonl")
+
+    client = FakePostClient(fail_for="Hello c")
+    summary = dispatch_bulk_post(client, TEMPLATE, ITEMS, log, n_workers=3)
+
+    assert (summary["delivered"], summary["skipped"], list(summary["failed"])) == (2, 0, [2])
+    assert sorted(client.posted) == [("Dab", "Hello ab"), ("Dab", "Hello ba")]
+    # One open for the same group of users
+    assert len(client.opened) == 2
+
+    client = FakePostClient()
+    summary = dispatch_bulk_post(client, TEMPLATE, ITEMS, log)
+
+    assert (summary["delivered"], summary["skipped"], summary["failed"]) == (1, 2, {})
+    assert client.posted == [("Dc", "Hello c")]
+
+
+def test_dispatch_bulk_post_repeated_item(tmp_path):
+    log = str(tmp_path / "delivered.jsonl")
+    items = [ITEMS[2], ITEMS[0], ITEMS[2]]
+
+    client = FakePostClient()
+    summary = dispatch_bulk_post(client, TEMPLATE, items, log)
+
+    assert (summary["delivered"], summary["skipped"]) == (3, 0)
+    assert client.posted.count(("Dc", "Hello c")) == 2
+
+    # One more repeat only sends the new one
+    client = FakePostClient()
+    summary = dispatch_bulk_post(client, TEMPLATE, items + [ITEMS[2]], log)
+
+    assert (summary["delivered"], summary["skipped"]) == (1, 3)
+    assert client.posted == [("Dc", "Hello c")]
+
+
+def test_dry_run_bulk_post():
+    assert dry_run_bulk_post(TEMPLATE, ITEMS * 10)["items"] == 30
@@ -0,0 +1,86 @@
+import datetime as dt
+import random
+
+import pandas as pd
+import pytest
+import pytz
+
+from arwa.calendar_analytics import CATEGORIES, render_dashboard, weekly_breakdown
+from arwa.calendar_export import events_to_frame, load_calendar_export
+from arwa.calendar_utils import bucket_events, is_day_long_event, report_events_summary
+from arwa.types import CalendarEvent
+
+UTC = dt.timezone.utc
+
+
+def random_events(email, n, rng):
+    colleagues = ["b@example.com", "c@example.com", "d@example.com"]
+    events = []
+    for _ in range(n):
+        start = dt.datetime(2021, 4, 1, tzinfo=UTC) + dt.timedelta(minutes=15 * rng.randrange(4 * 24 * 40))
+        duration = dt.timedelta(minutes=rng.choice([15, 30, 60, 120, 24 * 60]))
+        attendees = [email] + rng.sample(colleagues, rng.randrange(3))
+        if rng.random() < 0.2:
+            attendees.append("x@elsewhere.com")
+        status = rng.choice(["accepted", "accepted", "declined", None])
+        events.append(CalendarEvent("", start, start + duration, attendees, status))
+    return events
+
+
+def test_weekly_breakdown_matches_report():
+    rng = random.Random(0)
+    users = {email: random_events(email, 200, rng) for email in ["a@example.com", "e@example.com"]}
+
+    df = pd.concat([events_to_frame(email, events) for email, events in users.items()], ignore_index=True)
+    breakdown = weekly_breakdown(df, tz=UTC)
+
+    weeks = [dt.datetime(2021, 3, 28, tzinfo=UTC) + dt.timedelta(days=7 * i) for i in range(9)]
+    for email, events in users.items():
+        events = [ev for ev in events if not is_day_long_event(ev)]
+        for week, week_events in zip(weeks, bucket_events(events, weeks)):
+            summary = report_events_summary(week_events)
+            if (email, pd.Timestamp(week)) in breakdown.index:
+                row = breakdown.loc[(email, pd.Timestamp(week))]
+                assert [row[c] for c in CATEGORIES] == pytest.approx([summary[c] for c in CATEGORIES])
+            else:
+                assert summary["total"] == 0
+
+
+def test_render_dashboard(tmp_path):
+    rng = random.Random(0)
+    df = events_to_frame("a@example.com", random_events("a@example.com", 50, rng))
+
+    render_dashboard(weekly_breakdown(df, tz=UTC), str(tmp_path / "dashboard.html"))
+    assert (tmp_path / "dashboard.html").stat().st_size > 0
+
+
+def test_weekly_breakdown_empty(tmp_path):
+    assert weekly_breakdown(load_calendar_export(str(tmp_path)), tz=UTC).empty
+
+    # Users without events in the window
+    events_to_frame("a@example.com", []).to_parquet(tmp_path / "a.parquet", index=False)
+    breakdown = weekly_breakdown(load_calendar_export(str(tmp_path)), tz=UTC)
+
+    assert breakdown.empty
+    assert list(breakdown.columns) == CATEGORIES
+
+
+def test_weekly_breakdown_dst():
+    tz = pytz.timezone("America/New_York")
+
+    def _ev(start, end):
+        return CalendarEvent("", tz.localize(dt.datetime(*start)), tz.localize(dt.datetime(*end)), ["a@example.com"], "accepted")
+
+    events = [
+        # Weeks after the spring and fall changes
+        _ev((2021, 3, 16, 10), (2021, 3, 16, 11)),
+        _ev((2021, 3, 20, 23), (2021, 3, 21, 2)),
+        _ev((2021, 11, 8, 10), (2021, 11, 8, 13)),
+    ]
+
+    breakdown = weekly_breakdown(events_to_frame("a@example.com", events), tz=tz)
+
+    assert [week.to_pydatetime() for _, week in breakdown.index] == [
+        tz.localize(dt.datetime(2021, 3, 14)), tz.localize(dt.datetime(2021, 3, 21)), tz.localize(dt.datetime(2021, 11, 7))
+    ]
+    assert list(breakdown["total"]) == pytest.approx([2, 2, 3])
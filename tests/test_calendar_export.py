@@ -0,0 +1,42 @@
+import datetime as dt
+
+import arwa.calendar_export
+from arwa.calendar_export import export_calendars, read_user_events, user_events_path
+from arwa.types import CalendarEvent
+
+UTC = dt.timezone.utc
+
+
+def fake_parse_google_calendar(email_id, start_time, end_time, store=None):
+    if email_id.startswith("broken"):
+        raise ConnectionError("calendar unavailable")
+
+    return [
+        CalendarEvent("sync", dt.datetime(2021, 4, 16, 18, tzinfo=UTC), dt.datetime(2021, 4, 16, 19, tzinfo=UTC),
+                      [email_id, "b@example.com"], "accepted"),
+        CalendarEvent("focus", dt.datetime(2021, 4, 17, 10, tzinfo=UTC), dt.datetime(2021, 4, 17, 12, tzinfo=UTC),
+                      [email_id], None)
+    ]
+
+
+def test_export_calendars(tmp_path, monkeypatch):
+    monkeypatch.setattr(arwa.calendar_export, "parse_google_calendar", fake_parse_google_calendar)
+
+    emails = ["a@example.com", "c@example.com", "broken@example.com"]
+    start, end = dt.datetime(2021, 4, 1), dt.datetime(2021, 5, 1)
+
+    summary = export_calendars(emails, start, end, str(tmp_path), n_workers=2, max_retries=0)
+    assert sorted(summary["exported"]) == ["a@example.com", "c@example.com"]
+    assert list(summary["failed"]) == ["broken@example.com"]
+
+    events = read_user_events(user_events_path(str(tmp_path), "a@example.com"))
+    assert events == fake_parse_google_calendar("a@example.com", start, end)
+
+    summary = export_calendars(emails, start, end, str(tmp_path), max_retries=0)
+    assert sorted(summary["skipped"]) == ["a@example.com", "c@example.com"]
+    assert summary["exported"] == []
+
+    # Files of another window are exported again
+    summary = export_calendars(emails, end, dt.datetime(2021, 6, 1), str(tmp_path), max_retries=0)
+    assert sorted(summary["exported"]) == ["a@example.com", "c@example.com"]
+    assert summary["skipped"] == []
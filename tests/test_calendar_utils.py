@@ -1,9 +1,18 @@
 import datetime as dt
+import json
+import threading
 from typing import Tuple
 
 import pytest
-from arwa.calendar_utils import is_overlapping
+from googleapiclient.errors import HttpError
+
+from arwa import calendar_utils
+from arwa.calendar_utils import (EVENT_FIELDS, bucket_events, event_duration, event_from_resource, find_free_slots,
+                                 find_interstices, get_calendar_service, is_overlapping, load_credentials,
+                                 parse_google_calendar, parse_google_calendars, sync_calendar)
+from arwa.storage import EventStore
 from arwa.types import CalendarEvent
+from fake_calendar import FakeCalendarServer, make_event
 
 TimeRange = Tuple[dt.datetime, dt.datetime]
 
@@ -36,3 +45,198 @@ def test_is_overlapping(range_a: TimeRange, range_b: TimeRange, overlap: bool):
         CalendarEvent("", range_a[0], range_a[1], []),
         CalendarEvent("", range_b[0], range_b[1], [])
     ) == overlap
+
+
+def test_bucket_events():
+    weeks = [dt.datetime(2021, 4, 4), dt.datetime(2021, 4, 11), dt.datetime(2021, 4, 18)]
+    events = [
+        CalendarEvent("inside", dt.datetime(2021, 4, 5, 10), dt.datetime(2021, 4, 5, 11), []),
+        CalendarEvent("crossing", dt.datetime(2021, 4, 10, 23), dt.datetime(2021, 4, 11, 1), []),
+        CalendarEvent("before", dt.datetime(2021, 4, 1, 10), dt.datetime(2021, 4, 1, 11), []),
+        CalendarEvent("after", dt.datetime(2021, 4, 18, 10), dt.datetime(2021, 4, 18, 11), []),
+    ]
+
+    buckets = bucket_events(events, weeks)
+
+    assert [[ev.name for ev in bucket] for bucket in buckets] == [["inside", "crossing"], ["crossing"]]
+    assert [event_duration(bucket[-1]) for bucket in buckets] == [60, 60]
+
+
+class FakeEventsService:
+    """
+    Stand-in for the Calendar API events collection. Full listings return
+    everything and incremental ones return queued changes.
+    """
+
+    def __init__(self, items):
+        self.items = items
+        self.changes = []
+        self.calls = []
+        self.expired = False
+        self.sync_token = "token"
+
+    def events(self):
+        return self
+
+    def list(self, **kwargs):
+        self.calls.append(kwargs)
+        self.request = kwargs
+        return self
+
+    def execute(self, num_retries=0):
+        if "syncToken" in self.request:
+            if self.expired:
+                raise HttpError(type("Resp", (), {"status": 410, "reason": "Gone"})(), b"")
+            changes, self.changes = self.changes, []
+            return {"items": changes, "nextSyncToken": self.sync_token}
+        return {"items": self.items, "nextSyncToken": self.sync_token}
+
+
+def make_resource(event_id, start_hour, end_hour, status="confirmed"):
+    return {
+        "id": event_id, "status": status, "summary": event_id,
+        "start": {"dateTime": f"2021-04-16T{start_hour:02}:00:00Z"},
+        "end": {"dateTime": f"2021-04-16T{end_hour:02}:00:00Z"},
+        "attendees": [{"email": "a@example.com", "self": True, "responseStatus": "accepted"},
+                      {"email": "b@example.com", "responseStatus": "needsAction"}]
+    }
+
+
+def test_sync_calendar():
+    store = EventStore(":memory:")
+    service = FakeEventsService([make_resource("one", 10, 11), make_resource("two", 12, 13)])
+    utc = dt.timezone.utc
+    start, end = dt.datetime(2021, 4, 16, tzinfo=utc), dt.datetime(2021, 4, 17, tzinfo=utc)
+
+    def _events():
+        return [event_from_resource(r, "a@example.com") for r in store.query("a@example.com", start.timestamp(), end.timestamp())]
+
+    sync_calendar(store, service, "a@example.com", start, end)
+    assert [ev.name for ev in _events()] == ["one", "two"]
+    assert _events()[0].response_status == "accepted"
+    assert "timeMin" in service.calls[-1]
+
+    service.changes = [make_resource("one", 10, 11, status="cancelled"), make_resource("three", 14, 15)]
+    sync_calendar(store, service, "a@example.com", start, end)
+    assert [ev.name for ev in _events()] == ["two", "three"]
+    assert service.calls[-1]["syncToken"] == "token"
+
+    # Expired tokens need a full sync
+    service.expired = True
+    sync_calendar(store, service, "a@example.com", start, end)
+    assert [ev.name for ev in _events()] == ["one", "two"]
+    assert "timeMin" in service.calls[-1]
+
+
+def test_sync_calendar_new_window():
+    store = EventStore(":memory:")
+    service = FakeEventsService([make_resource("one", 10, 11)])
+    utc = dt.timezone.utc
+    day = dt.datetime(2021, 4, 16, tzinfo=utc)
+
+    sync_calendar(store, service, "a@example.com", day - dt.timedelta(days=30), day)
+    sync_calendar(store, service, "a@example.com", day, day + dt.timedelta(days=1))
+
+    # A window outside the stored one is listed on its own, not with the old one
+    assert service.calls[-1]["timeMin"] == day.isoformat()
+    assert store.get_sync_state("a@example.com")[1:] == (day.timestamp(), (day + dt.timedelta(days=1)).timestamp())
+
+    # Once a sync comes back without a token the next run lists the window again
+    service.sync_token = None
+    sync_calendar(store, service, "a@example.com", day, day + dt.timedelta(days=1))
+    assert service.calls[-1]["syncToken"] == "token"
+    sync_calendar(store, service, "a@example.com", day, day + dt.timedelta(days=1))
+    assert "syncToken" not in service.calls[-1] and "timeMin" in service.calls[-1]
+
+
+def test_find_interstices():
+    events = [
+        CalendarEvent("", dt.datetime(2021, 4, 16, 10), dt.datetime(2021, 4, 16, 11), []),
+        CalendarEvent("", dt.datetime(2021, 4, 16, 10, 30), dt.datetime(2021, 4, 16, 12), []),
+        CalendarEvent("", dt.datetime(2021, 4, 16, 14, 0, 30), dt.datetime(2021, 4, 16, 15), []),
+        CalendarEvent("", dt.datetime(2021, 4, 16, 15), dt.datetime(2021, 4, 16, 16), []),
+    ]
+
+    gaps = find_interstices(events)
+    assert [(g.start_time, g.end_time) for g in gaps] == [(dt.datetime(2021, 4, 16, 12), dt.datetime(2021, 4, 16, 14, 0, 30))]
+
+
+def test_find_free_slots():
+    utc = dt.timezone.utc
+
+    def _ev(day, start, end, status="accepted"):
+        return CalendarEvent("", dt.datetime(2021, 4, day, *start, tzinfo=utc), dt.datetime(2021, 4, day, *end, tzinfo=utc), [], status)
+
+    calendars = [
+        [_ev(16, (9,), (10, 30)), _ev(16, (13,), (17,)), _ev(19, (9,), (18,))],
+        [_ev(16, (10,), (11,)), _ev(16, (12,), (13,), status="declined"), _ev(16, (17, 30), (19,))],
+    ]
+
+    # Friday, weekend and a fully booked monday
+    slots = find_free_slots(
+        calendars, dt.datetime(2021, 4, 16, tzinfo=utc), dt.datetime(2021, 4, 20, 10, tzinfo=utc),
+        dt.timedelta(minutes=30), tz=utc
+    )
+
+    assert slots == [
+        (dt.datetime(2021, 4, 16, 11, tzinfo=utc), dt.datetime(2021, 4, 16, 13, tzinfo=utc)),
+        (dt.datetime(2021, 4, 16, 17, tzinfo=utc), dt.datetime(2021, 4, 16, 17, 30, tzinfo=utc)),
+        (dt.datetime(2021, 4, 20, 9, tzinfo=utc), dt.datetime(2021, 4, 20, 10, tzinfo=utc)),
+    ]
+
+
+def test_parse_google_calendars(monkeypatch):
+    base = dt.datetime(2021, 4, 1, tzinfo=dt.timezone.utc)
+    calendars = {
+        f"u{i}@example.com": [
+            make_event(f"{i}-{j}", base + dt.timedelta(hours=j), 30, [f"u{i}@example.com", "x@example.com"])
+            for j in range(3000)
+        ]
+        for i in range(3)
+    }
+    calendars["u2@example.com"].reverse()
+
+    with FakeCalendarServer(calendars) as server:
+        monkeypatch.setenv("ARWA_CALENDAR_API_URL", server.url)
+        monkeypatch.setattr(calendar_utils, "_local", threading.local())
+
+        events = parse_google_calendars(list(calendars), base, base + dt.timedelta(days=200))
+
+        # Two pages for each calendar in two batch requests
+        assert server.requests == 2
+        assert all(call["maxResults"] == "2500" and call["fields"] == EVENT_FIELDS for call in server.calls)
+        assert {email: len(evs) for email, evs in events.items()} == {email: 3000 for email in calendars}
+        assert events["u1@example.com"][0].attendees == ["u1@example.com", "x@example.com"]
+        assert [ev.start_time for ev in events["u2@example.com"][:2]] == [base, base + dt.timedelta(hours=1)]
+
+        assert len(parse_google_calendar("u1@example.com", base, base + dt.timedelta(days=1))) == 24
+        assert server.requests == 3
+        assert get_calendar_service() is get_calendar_service()
+
+
+def test_load_credentials(tmp_path):
+    with open(tmp_path / "token.json", "w") as fp:
+        json.dump({"token": "ya29.token", "refresh_token": "1//refresh", "client_id": "id", "client_secret": "secret",
+                   "expiry": "2999-01-01T00:00:00Z"}, fp)
+
+    # No flow is run while the saved token is good
+    credentials = load_credentials(str(tmp_path))
+    assert (credentials.token, credentials.refresh_token) == ("ya29.token", "1//refresh")
+
+
+def test_parse_google_calendars_ratelimited(monkeypatch):
+    base = dt.datetime(2021, 4, 1, tzinfo=dt.timezone.utc)
+    calendars = {
+        f"u{i}@example.com": [make_event(f"{i}-{j}", base + dt.timedelta(hours=j), 30, []) for j in range(10)]
+        for i in range(4)
+    }
+
+    monkeypatch.setattr(calendar_utils.time, "sleep", lambda seconds: None)
+
+    with FakeCalendarServer(calendars, ratelimit_every=3) as server:
+        monkeypatch.setenv("ARWA_CALENDAR_API_URL", server.url)
+        monkeypatch.setattr(calendar_utils, "_local", threading.local())
+
+        events = parse_google_calendars(list(calendars), base, base + dt.timedelta(days=1))
+        assert {email: len(evs) for email, evs in events.items()} == {email: 10 for email in calendars}
+        assert len(server.calls) > len(calendars)
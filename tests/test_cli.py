@@ -0,0 +1,52 @@
+import subprocess
+import sys
+
+import pytest
+from docopt import docopt
+
+from arwa import cli
+from arwa.commands import calendar, slack
+
+HEAVY_MODULES = [
+    "pandas", "plotly", "slack", "googleapiclient", "google_auth_oauthlib", "jinja2", "yaml",
+    "IP2Location", "aiohttp", "numpy", "tabulate"
+]
+
+# Microseconds, cumulative import time of arwa.cli
+IMPORT_BUDGET = 100_000
+
+
+def import_times(*argv):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", "arwa", *argv],
+        capture_output=True, text=True, check=True
+    )
+
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_help_is_light():
+    times = import_times("--help")
+
+    for module in HEAVY_MODULES:
+        assert module not in times
+    assert times["arwa.cli"] < IMPORT_BUDGET
+
+
+@pytest.mark.parametrize("usage", [line.strip() for line in cli.__doc__.split("Options:")[0].splitlines()
+                                   if line.strip().startswith("arwa ")])
+def test_every_usage_has_handler(usage):
+    argv = [
+        "<x>" if word.startswith("<") else word.split("=")[0] + "=x" if word.startswith("--") else word
+        for word in usage.split()[1:] if not word.startswith("[")
+    ]
+    args = docopt(cli.__doc__, argv=argv)
+    commands = slack.COMMANDS if args["slack"] else calendar.COMMANDS
+
+    assert sum(bool(args[command]) for command in commands) == 1
@@ -0,0 +1,82 @@
+import datetime as dt
+import random
+from typing import Tuple
+
+import numpy as np
+import pytest
+
+from arwa.event_index import EventIndex
+from arwa.types import CalendarEvent
+
+TimeRange = Tuple[dt.datetime, dt.datetime]
+
+
+@pytest.mark.parametrize("range_a, range_b, overlap", [
+    ((dt.datetime(2021, 4, 16, 18), dt.datetime(2021, 4, 16, 19)),
+     (dt.datetime(2021, 4, 16, 18), dt.datetime(2021, 4, 16, 19)),
+     True),
+    ((dt.datetime(2021, 4, 16, 18), dt.datetime(2021, 4, 16, 19)),
+     (dt.datetime(2021, 4, 16, 19), dt.datetime(2021, 4, 16, 20)),
+     False),
+    ((dt.datetime(2021, 4, 16, 18), dt.datetime(2021, 4, 16, 19)),
+     (dt.datetime(2021, 4, 16, 17), dt.datetime(2021, 4, 16, 18)),
+     False),
+    ((dt.datetime(2021, 4, 16, 18), dt.datetime(2021, 4, 16, 19)),
+     (dt.datetime(2021, 2, 16, 18), dt.datetime(2021, 2, 16, 19)),
+     False),
+    ((dt.datetime(2021, 4, 16, 18), dt.datetime(2021, 4, 16, 19)),
+     (dt.datetime(2021, 4, 16, 18, 40), dt.datetime(2021, 4, 16, 20)),
+     True),
+    ((dt.datetime(2021, 4, 16, 18), dt.datetime(2021, 4, 16, 19)),
+     (dt.datetime(2021, 4, 16, 17, 40), dt.datetime(2021, 4, 16, 18, 30)),
+     True),
+    ((dt.datetime(2021, 4, 16, 18), dt.datetime(2021, 4, 16, 19)),
+     (dt.datetime(2021, 4, 16, 18, 40), dt.datetime(2021, 4, 16, 18, 50)),
+     True)
+])
+def test_overlaps(range_a: TimeRange, range_b: TimeRange, overlap: bool):
+    index = EventIndex([CalendarEvent("", range_b[0], range_b[1], [])])
+    assert index.overlaps(*range_a) == overlap
+    assert bool(index.overlapping_events(CalendarEvent("", range_a[0], range_a[1], []))) == overlap
+
+
+def test_stab():
+    events = [
+        CalendarEvent("a", dt.datetime(2021, 4, 16, 18), dt.datetime(2021, 4, 16, 19), []),
+        CalendarEvent("b", dt.datetime(2021, 4, 16, 18, 30), dt.datetime(2021, 4, 16, 20), []),
+        CalendarEvent("empty", dt.datetime(2021, 4, 16, 19), dt.datetime(2021, 4, 16, 19), []),
+    ]
+    index = EventIndex(events)
+
+    assert len(index) == 2
+    assert [ev.name for ev in index.stab(dt.datetime(2021, 4, 16, 18, 45))] == ["a", "b"]
+    assert [ev.name for ev in index.stab(dt.datetime(2021, 4, 16, 19))] == ["b"]
+    assert index.stab(dt.datetime(2021, 4, 16, 20)) == []
+
+
+def test_against_brute_force():
+    rng = random.Random(0)
+    base = dt.datetime(2021, 1, 1, tzinfo=dt.timezone.utc)
+
+    events = []
+    for i in range(100_000):
+        start = base + dt.timedelta(minutes=rng.randrange(0, 365 * 24 * 60))
+        events.append(CalendarEvent(str(i), start, start + dt.timedelta(minutes=rng.choice([15, 30, 60, 600])), []))
+
+    index = EventIndex(events)
+    starts = np.array([ev.start_time.timestamp() for ev in events])
+    ends = np.array([ev.end_time.timestamp() for ev in events])
+
+    for _ in range(200):
+        qs = base.timestamp() + rng.randrange(0, 365 * 24 * 3600)
+        qe = qs + rng.choice([0, 60, 3600, 7 * 24 * 3600])
+
+        if qe == qs:
+            expected = np.flatnonzero((starts <= qs) & (ends > qs))
+            found = index.stab(qs)
+        else:
+            expected = np.flatnonzero((starts < qe) & (ends > qs))
+            found = index.overlapping(qs, qe)
+            assert index.overlaps(qs, qe) == bool(len(expected))
+
+        assert sorted(int(ev.name) for ev in found) == sorted(expected.tolist())
@@ -0,0 +1,46 @@
+import datetime as dt
+import time
+
+from arwa.calendar_utils import report_events_summary
+from arwa.event_table import EventTable, StringTable
+from arwa.types import CalendarEvent
+
+TZ = dt.timezone.utc
+
+
+def test_event_table():
+    events = [
+        CalendarEvent("sync", dt.datetime(2021, 4, 16, 18, tzinfo=TZ), dt.datetime(2021, 4, 16, 19, tzinfo=TZ),
+                      ["a@example.com", "b@example.com"], "accepted"),
+        CalendarEvent("focus", dt.datetime(2021, 4, 16, 9, tzinfo=TZ), dt.datetime(2021, 4, 16, 11, tzinfo=TZ),
+                      ["a@example.com"], "accepted"),
+        CalendarEvent("external", dt.datetime(2021, 4, 17, 9, tzinfo=TZ), dt.datetime(2021, 4, 17, 9, 30, tzinfo=TZ),
+                      ["a@example.com", "c@other.com", "d@other.com"]),
+    ]
+
+    strings = StringTable()
+    table = EventTable.from_events(events, strings=strings)
+
+    assert len(table) == 3
+    assert list(table) == events
+    assert table[-1] == events[-1]
+    assert len(strings) == 8
+    assert table.durations().tolist() == [60, 120, 30]
+    assert report_events_summary(list(table)) == report_events_summary(events)
+
+    # Strings are shared with further tables
+    EventTable.from_events(events[:1], strings=strings)
+    assert len(strings) == 8
+
+
+def test_event_table_day_long_local_midnight(monkeypatch):
+    monkeypatch.setenv("TZ", "America/New_York")
+    time.tzset()
+    try:
+        ooo = CalendarEvent("ooo", dt.date(2021, 4, 16), dt.date(2021, 4, 17), ["a@example.com"])
+        table = EventTable.from_events([ooo])
+        assert table[0].start_time.replace(tzinfo=None) == dt.datetime(2021, 4, 16)
+        assert table[0].end_time.utcoffset() == dt.timedelta(hours=-4)
+    finally:
+        monkeypatch.undo()
+        time.tzset()
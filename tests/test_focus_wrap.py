@@ -0,0 +1,79 @@
+import datetime as dt
+
+from arwa.calendar_utils import event_from_resource
+from arwa.focus_wrap import MERGED_BLOCK_NAME, insert_events, plan_focus_blocks
+from arwa.types import CalendarEvent
+
+TZ = dt.timezone.utc
+
+
+def meeting(name, start_hour, start_minute, end_hour, end_minute):
+    return CalendarEvent(
+        name,
+        dt.datetime(2021, 4, 16, start_hour, start_minute, tzinfo=TZ),
+        dt.datetime(2021, 4, 16, end_hour, end_minute, tzinfo=TZ),
+        ["a@example.com", "b@example.com"]
+    )
+
+
+class FakeBatchService:
+    """
+    Stand-in for the Calendar API service recording inserted events.
+    """
+
+    def __init__(self):
+        self.inserted = []
+        self.batches = 0
+
+    def events(self):
+        return self
+
+    def insert(self, calendarId, body):
+        return body
+
+    def new_batch_http_request(self, callback):
+        service = self
+        requests = []
+
+        class Batch:
+            def add(self, request, request_id):
+                requests.append((request_id, request))
+
+            def execute(self):
+                service.batches += 1
+                for request_id, body in requests:
+                    service.inserted.append(body)
+                    callback(request_id, body, None)
+
+        return Batch()
+
+
+def test_plan_focus_blocks():
+    events = [
+        meeting("standup", 10, 0, 10, 15),
+        meeting("review", 10, 30, 11, 30),
+        meeting("lunch", 12, 0, 13, 0),
+        meeting("sync", 13, 0, 13, 15),
+    ]
+
+    blocks = plan_focus_blocks(events)
+
+    assert [(b.name, b.start_time.time().isoformat("minutes"), b.end_time.time().isoformat("minutes")) for b in blocks] == [
+        ("ARWA: Preparation Block", "09:45", "10:00"),
+        (MERGED_BLOCK_NAME, "10:15", "10:30"),
+        (MERGED_BLOCK_NAME, "11:30", "12:00"),
+        ("ARWA: Closure Block", "13:15", "13:30"),
+    ]
+
+
+def test_rerun_makes_no_writes():
+    events = [meeting("standup", 10, 0, 10, 15), meeting("review", 15, 0, 16, 0)]
+    service = FakeBatchService()
+
+    blocks = plan_focus_blocks(events)
+    assert insert_events(service, blocks, batch_size=3) == {"inserted": 4, "failed": []}
+    assert service.batches == 2
+
+    # Blocks come back from the calendar without attendees
+    events += [event_from_resource(body, "a@example.com") for body in service.inserted]
+    assert plan_focus_blocks(events) == []
@@ -0,0 +1,29 @@
+from types import SimpleNamespace
+
+from arwa.geo import GeoLocator, geo_report
+from arwa.types import SlackUser
+
+
+class FakeLocator(GeoLocator):
+    def __init__(self):
+        self.calls = []
+        self.lookup = self._lookup
+
+    def _lookup(self, ip):
+        self.calls.append(ip)
+        return SimpleNamespace(country_long="India" if ip.startswith("10.") else "Japan", region="-", city="-")
+
+
+def test_geo_report():
+    locator = FakeLocator()
+    access = {
+        SlackUser("U1", "b"): {"ip": "10.0.0.1", "date_last": 2},
+        SlackUser("U2", "a"): {"ip": "10.0.0.1", "date_last": 3},
+        SlackUser("U3", "c"): {"ip": "20.0.0.1", "date_last": 4},
+        SlackUser("U4", "d"): {"date_last": 5},
+    }
+
+    rows = geo_report(access, locator)
+
+    assert sorted(locator.calls) == ["10.0.0.1", "20.0.0.1"]
+    assert [(row["user_id"], row["country"]) for row in rows] == [("U4", None), ("U2", "India"), ("U1", "India"), ("U3", "Japan")]
@@ -0,0 +1,89 @@
+import asyncio
+import datetime as dt
+import time
+
+from arwa.scheduler import Scheduler
+from arwa.storage import ActionStore
+from arwa.types import SlackMessageAction
+
+
+class FakeAsyncClient:
+    def __init__(self):
+        self.sent = []
+
+    async def chat_postMessage(self, channel, text, thread_ts=None):
+        await asyncio.sleep(0.01)
+        if channel == "C-gone":
+            raise RuntimeError("channel_not_found")
+        self.sent.append((time.time(), channel, text))
+        return {"ok": True, "ts": str(time.time())}
+
+
+def at(seconds: float) -> dt.datetime:
+    return dt.datetime.now().astimezone() + dt.timedelta(seconds=seconds)
+
+
+def test_scheduler(tmp_path):
+    path = str(tmp_path / "actions.db")
+
+    store = ActionStore(path)
+    store.add(SlackMessageAction(at(-60), "overdue", "C1"))
+    store.add(SlackMessageAction(at(3600), "later", "C1"))
+    store.add_many(SlackMessageAction(at(0.2), f"bulk {i}", "C1") for i in range(5000))
+
+    client = FakeAsyncClient()
+    start = time.time()
+
+    async def _main():
+        # A fresh store as after a restart
+        scheduler = Scheduler(client, ActionStore(path), concurrency=200, refresh_interval=0.1)
+
+        async def _drive():
+            await asyncio.sleep(0.3)
+            scheduler.add(SlackMessageAction(at(0.2), "added", "C1"))
+            scheduler.add(SlackMessageAction(at(0.2), "broken", "C-gone"))
+            # Added from another process
+            store.add(SlackMessageAction(at(0.3), "external", "C2"))
+            await asyncio.sleep(1.5)
+            scheduler.stop.set()
+
+        await asyncio.gather(scheduler.run(), _drive())
+        return scheduler
+
+    scheduler = asyncio.run(_main())
+
+    texts = [text for _, _, text in client.sent]
+    assert texts[0] == "overdue"
+    assert "later" not in texts
+    assert {"added", "external"} <= set(texts)
+    assert len(texts) == 5003
+    assert scheduler.n_sent == 5003
+    # Leaving out the one overdue from before the start
+    assert sorted(t for t, _, text in client.sent if text.startswith("bulk"))[-1] - start < 1.5
+
+    assert store.counts() == {"sent": 5003, "failed": 1, "pending": 1}
+    assert [action.message for _, action in store.load_pending()] == ["later"]
+
+
+def test_scheduler_external_insert_before_add(tmp_path):
+    store = ActionStore(str(tmp_path / "actions.db"))
+    client = FakeAsyncClient()
+
+    async def _main():
+        scheduler = Scheduler(client, ActionStore(str(tmp_path / "actions.db")), refresh_interval=0.05)
+
+        async def _drive():
+            await asyncio.sleep(0.1)
+            # Another process inserts just before this one adds, so the
+            # external action has the lower id and isn't loaded yet
+            store.add(SlackMessageAction(at(0.1), "external", "C2"))
+            scheduler.add(SlackMessageAction(at(0.1), "added", "C1"))
+            await asyncio.sleep(0.5)
+            scheduler.stop.set()
+
+        await asyncio.gather(scheduler.run(), _drive())
+
+    asyncio.run(_main())
+
+    assert sorted(text for _, _, text in client.sent) == ["added", "external"]
+    assert store.counts() == {"sent": 2}
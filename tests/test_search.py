@@ -0,0 +1,58 @@
+import gzip
+import json
+import os
+
+from arwa.search import SearchIndex
+from arwa.storage import SqliteDB
+from arwa.types import SlackMessage
+
+
+def write_jsonl(path, messages, mode="w"):
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, mode + "t") as fp:
+        for message in messages:
+            fp.write(json.dumps(message) + "\n")
+
+
+def test_search_index(tmp_path):
+    shard = str(tmp_path / "C1.jsonl.gz")
+    export = str(tmp_path / "C2.jsonl")
+    write_jsonl(shard, [{"ts": "1.0", "user": "U1", "text": "deploying the search service today"}])
+    write_jsonl(export, [{"ts": "2.0", "user": "U2", "text": "search is slow on large exports"}])
+
+    index = SearchIndex(":memory:")
+    assert index.index_export(shard) == 1
+    assert index.index_export(export) == 1
+
+    # Nothing new, nothing indexed
+    assert index.index_export(shard) == 0
+    assert index.index_export(export) == 0
+
+    write_jsonl(export, [{"ts": "3.0", "user": "U1", "text": "deployed a fix"}], mode="a")
+    assert index.index_export(export) == 1
+
+    # Rewritten exports are indexed again from the start
+    write_jsonl(export, [{"ts": "4.0", "user": "U3", "text": "fresh export"}])
+    os.utime(export, (0, 0))
+    assert index.index_export(export) == 1
+
+    results = index.search("deploy")
+    assert [(r["channel"], r["ts"]) for r in results] == [("C1", "1.0")]
+    assert index.search("search", channel="C2") == []
+    assert index.search("fresh")[0]["user"] == "U3"
+
+    # Not valid query syntax
+    assert index.search("search (") != []
+
+
+def test_search_index_store(tmp_path):
+    db = SqliteDB(str(tmp_path / "arwa.db"))
+    db.save_messages([SlackMessage("standup notes", "C1", ts="1.0", user="U1")])
+
+    index = SearchIndex(":memory:")
+    assert index.index_store(db) == 1
+    assert index.index_store(db) == 0
+
+    db.save_messages([SlackMessage("more standup notes", "C1", ts="2.0", user="U2")])
+    assert index.index_store(db) == 1
+    assert [r["ts"] for r in index.search("standup")] == ["1.0", "2.0"]
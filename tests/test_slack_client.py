@@ -0,0 +1,84 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from slack.errors import SlackApiError
+
+from arwa.slack_client import ArwaWebClient, AsyncArwaWebClient
+from arwa.slack_utils import get_conversation_members
+
+
+class RateLimitingHandler(BaseHTTPRequestHandler):
+    """
+    Answers every other call with a 429.
+    """
+
+    calls = 0
+    always = False
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        type(self).calls += 1
+
+        if self.always or self.calls % 2:
+            status, body = 429, {"ok": False, "error": "ratelimited"}
+        else:
+            status, body = 200, {"ok": True, "members": ["U0"]}
+
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if status == 429:
+            self.send_header("Retry-After", "0")
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def slack_server():
+    RateLimitingHandler.calls = 0
+    RateLimitingHandler.always = False
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RateLimitingHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/api/"
+    server.shutdown()
+
+
+def test_client_retries_ratelimited(slack_server):
+    client = ArwaWebClient("xoxb-sync", base_url=slack_server)
+
+    for _ in range(3):
+        assert client.chat_postMessage(channel="C0", text="hi")["members"] == ["U0"]
+    assert RateLimitingHandler.calls == 6
+
+
+def test_async_client_retries_ratelimited(slack_server):
+    async def _run():
+        client = AsyncArwaWebClient("xoxb-async", base_url=slack_server)
+        responses = await asyncio.gather(*[client.chat_postMessage(channel="C0", text="hi") for _ in range(3)])
+        await client.close()
+        return responses
+
+    responses = asyncio.run(_run())
+    assert [r["members"] for r in responses] == [["U0"]] * 3
+    assert RateLimitingHandler.calls == 6
+
+
+def test_helpers_leave_retries_to_client(slack_server):
+    RateLimitingHandler.always = True
+    client = ArwaWebClient("xoxb-helpers", base_url=slack_server, max_retries=2)
+
+    with pytest.raises(SlackApiError):
+        list(get_conversation_members("C0", client))
+
+    # Only the client's own retries, none stacked on top by the helper
+    assert RateLimitingHandler.calls == 3
@@ -0,0 +1,109 @@
+import json
+import os
+import sys
+
+import jsonlines
+import pytest
+
+from arwa.ratelimit import TokenBucket
+from arwa.slack_export import (export_channel_shard, export_conversation, export_workspace, load_checkpoint,
+                               open_compressed)
+
+
+class FakeHistoryClient:
+    """
+    Conversation with 25 messages, newest first, in pages of 10. Every fifth
+    message starts a thread with two replies.
+    """
+
+    def __init__(self, fail_on_cursor=None):
+        self.messages = []
+        for i in range(25, 0, -1):
+            message = {"ts": f"{i}.000", "text": f"message {i}"}
+            if i % 5 == 0:
+                message.update({"thread_ts": message["ts"], "reply_count": 2})
+            self.messages.append(message)
+        self.fail_on_cursor = fail_on_cursor
+
+    def conversations_history(self, channel, limit, oldest=None, cursor=None):
+        if cursor and cursor == self.fail_on_cursor:
+            self.fail_on_cursor = None
+            raise ConnectionError("network blip")
+
+        messages = [m for m in self.messages if oldest is None or float(m["ts"]) > float(oldest)]
+        start = int(cursor or 0)
+        page = messages[start:start + 10]
+        has_more = start + 10 < len(messages)
+        return {
+            "messages": page,
+            "has_more": has_more,
+            "response_metadata": {"next_cursor": str(start + 10) if has_more else ""}
+        }
+
+    def users_conversations(self, exclude_archived, types, limit, cursor=None):
+        channels = [{"id": f"C{i}", "name": f"channel-{i}"} for i in range(3)]
+        return {"channels": channels, "response_metadata": {"next_cursor": ""}}
+
+    def conversations_replies(self, channel, ts, limit, cursor=None):
+        parent = {"ts": ts, "thread_ts": ts, "reply_count": 2}
+        replies = [{"ts": f"{ts}{i}", "thread_ts": ts, "text": "reply"} for i in (1, 2)]
+        return {"messages": [parent] + replies, "has_more": False}
+
+
+def test_export_conversation_resume(tmp_path):
+    output = str(tmp_path / "export.jsonl")
+    client = FakeHistoryClient(fail_on_cursor="20")
+
+    with pytest.raises(ConnectionError):
+        export_conversation(client, "C0", output, threads=True, n_workers=2)
+
+    assert load_checkpoint(output)["cursor"] == "20"
+
+    export_conversation(client, "C0", output, resume=True, threads=True, n_workers=2)
+
+    with jsonlines.open(output) as reader:
+        ts = [m["ts"] for m in reader]
+
+    assert len(ts) == len(set(ts)) == 25 + 5 * 2
+    assert load_checkpoint(output)["complete"]
+
+    # An incremental run only fetches what came after the last export
+    client.messages.insert(0, {"ts": "26.000", "text": "message 26"})
+    assert export_conversation(client, "C0", output, resume=True) == 1
+
+
+def test_export_workspace(tmp_path):
+    client = FakeHistoryClient()
+    entries = export_workspace(client, str(tmp_path), concurrency=2, bucket=TokenBucket(1000))
+
+    assert [it["name"] for it in entries] == ["channel-0", "channel-1", "channel-2"]
+
+    with open(tmp_path / "manifest.json") as fp:
+        manifest = json.load(fp)
+
+    for entry in manifest["channels"]:
+        assert (entry["messages"], entry["oldest_ts"], entry["latest_ts"]) == (25, "1.000", "25.000")
+        with open_compressed(str(tmp_path / entry["shard"])) as fp:
+            assert len(list(jsonlines.Reader(fp))) == 25
+
+
+def test_export_workspace_failed_channel(tmp_path):
+    client = FakeHistoryClient(fail_on_cursor="10")
+    entries = export_workspace(client, str(tmp_path), concurrency=1, bucket=TokenBucket(1000))
+
+    assert [("error" in it) for it in entries] == [True, False, False]
+    # Nothing is left behind of the channel that failed
+    assert sorted(os.listdir(tmp_path)) == ["C1.jsonl.gz", "C2.jsonl.gz", "manifest.json"]
+
+
+def test_export_workspace_missing_codec(tmp_path, monkeypatch):
+    monkeypatch.setitem(sys.modules, "zstandard", None)
+    client = FakeHistoryClient()
+
+    with pytest.raises(RuntimeError, match="arwa\\[zstd\\]"):
+        export_workspace(client, str(tmp_path), compression="zstd", bucket=TokenBucket(1000))
+
+    # The codec error comes through from a shard too
+    with pytest.raises(RuntimeError, match="arwa\\[zstd\\]"):
+        export_channel_shard(client, {"id": "C0"}, str(tmp_path), "zstd", TokenBucket(1000))
+    assert os.listdir(tmp_path) == []
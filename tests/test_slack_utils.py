@@ -0,0 +1,215 @@
+from typing import Dict, List
+
+import pytest
+from slack.errors import SlackApiError
+from slack.web.slack_response import SlackResponse
+
+from arwa.ratelimit import TokenBucket
+from arwa.slack_utils import (bulk_invite, channel_name_to_id, last_user_access, list_users,
+                              list_users_from_usergroups, refresh_user_directory)
+from arwa.storage import ChannelIndex, UserDirectory
+
+
+def make_response(data: Dict, status_code=200, headers=None) -> SlackResponse:
+    return SlackResponse(
+        client=None, http_verb="POST", api_url="", req_args={},
+        data=data, headers=headers or {}, status_code=status_code
+    )
+
+
+class FakeInviteClient:
+    def __init__(self, members: List[str], bad_users: List[str], n_ratelimits=0):
+        self.members = members
+        self.bad_users = set(bad_users)
+        self.n_ratelimits = n_ratelimits
+        self.invite_calls: List[List[str]] = []
+
+    def conversations_members(self, channel, limit, cursor=None):
+        if cursor is None:
+            return make_response({"ok": True, "members": self.members[:1], "response_metadata": {"next_cursor": "next"}})
+        return make_response({"ok": True, "members": self.members[1:], "response_metadata": {"next_cursor": ""}})
+
+    def conversations_invite(self, channel, users):
+        self.invite_calls.append(users)
+
+        if self.n_ratelimits:
+            self.n_ratelimits -= 1
+            response = make_response({"ok": False, "error": "ratelimited"}, 429, {"Retry-After": "0"})
+            raise SlackApiError("ratelimited", response)
+
+        bad = [u for u in users if u in self.bad_users]
+        if bad:
+            response = make_response({
+                "ok": False, "error": "cant_invite",
+                "errors": [{"user": u, "ok": False, "error": "cant_invite"} for u in bad]
+            })
+            raise SlackApiError("cant_invite", response)
+
+        return make_response({"ok": True})
+
+
+def test_bulk_invite():
+    client = FakeInviteClient(members=["U0", "U1"], bad_users=["U5"], n_ratelimits=1)
+    user_ids = [f"U{i}" for i in range(10)]
+
+    summary = bulk_invite(client, "C0", user_ids, batch_size=4, bucket=TokenBucket(1000))
+
+    assert sorted(summary["skipped"]) == ["U0", "U1"]
+    assert sorted(summary["invited"]) == [f"U{i}" for i in range(2, 10) if i != 5]
+    assert summary["failed"] == {"U5": "cant_invite"}
+
+    # Two batches, one rate limited retry and one retry for the rest of the
+    # batch with the bad user
+    assert len(client.invite_calls) == 4
+    assert not any(("U0" in call or "U1" in call) for call in client.invite_calls)
+
+
+def test_bulk_invite_channel_error():
+    class MissingChannelClient(FakeInviteClient):
+        def conversations_invite(self, channel, users):
+            self.invite_calls.append(users)
+            raise SlackApiError("channel_not_found", make_response({"ok": False, "error": "channel_not_found"}))
+
+    client = MissingChannelClient(members=[], bad_users=[])
+    summary = bulk_invite(client, "C0", [f"U{i}" for i in range(10)], batch_size=4, bucket=TokenBucket(1000))
+
+    assert summary["failed"] == {f"U{i}": "channel_not_found" for i in range(10)}
+    # No bisecting, one call per batch
+    assert len(client.invite_calls) == 3
+
+
+class FakeUsersClient:
+    def __init__(self, n_users: int, page_size: int):
+        self.members = [
+            {"id": f"U{i}", "updated": 100, "is_bot": i == 0, "deleted": False,
+             "profile": {"real_name": f"user {i}", "email": f"user{i}@example.com"}}
+            for i in range(n_users)
+        ]
+        self.page_size = page_size
+        self.n_calls = 0
+        self.info_calls: List[str] = []
+
+    def users_list(self, limit, cursor=None):
+        self.n_calls += 1
+        start = int(cursor or 0)
+        end = start + self.page_size
+        next_cursor = str(end) if end < len(self.members) else ""
+        return {"members": self.members[start:end], "response_metadata": {"next_cursor": next_cursor}}
+
+    def users_info(self, user):
+        self.info_calls.append(user)
+        return {"user": {"id": user, "updated": 100, "is_bot": False, "deleted": False, "profile": {"real_name": "guest"}}}
+
+    def usergroups_list(self, include_users):
+        return {"usergroups": [
+            {"handle": "team-a", "users": ["U1", "U2", "U3"]},
+            {"handle": "team-b", "users": ["U3", "U4", "G1"]}
+        ]}
+
+
+def test_list_users_pagination():
+    client = FakeUsersClient(n_users=7, page_size=3)
+    users = list_users(client)
+
+    assert client.n_calls == 3
+    assert [u.id for u in users] == [f"U{i}" for i in range(1, 7)]
+    assert len(list_users(client, all_users=True)) == 7
+
+
+def test_user_directory_refresh():
+    client = FakeUsersClient(n_users=7, page_size=3)
+    directory = UserDirectory(":memory:")
+
+    assert refresh_user_directory(directory, client) == 7
+    assert refresh_user_directory(directory, client) == 0
+
+    client.members[3]["updated"] = 200
+    client.members[3]["profile"]["real_name"] = "renamed"
+    assert refresh_user_directory(directory, client) == 1
+
+    assert directory.get("U3").name == "renamed"
+    assert [u.id for u in directory.iter_users()] == [f"U{i}" for i in range(1, 7)]
+    assert set(directory.get_many(["U1", "U2", "U100"])) == {"U1", "U2"}
+
+
+def test_list_users_from_usergroups():
+    client = FakeUsersClient(n_users=7, page_size=3)
+    directory = UserDirectory(":memory:")
+
+    groups = list_users_from_usergroups(client, ["team-a", "team-b"], directory)
+
+    assert [u.id for u in groups["team-a"]] == ["U1", "U2", "U3"]
+    assert [u.name for u in groups["team-b"]] == ["user 3", "user 4", "guest"]
+    assert client.n_calls == 3
+    assert client.info_calls == ["G1"]
+
+    # Directory is fresh and now knows about the guest too
+    list_users_from_usergroups(client, ["team-b"], directory)
+    assert client.n_calls == 3
+    assert client.info_calls == ["G1"]
+
+
+class FakeConversationsClient:
+    def __init__(self):
+        self.channels = [{"id": f"C{i}", "name": f"channel-{i}"} for i in range(5)] + [{"id": "D0", "user": "U0"}]
+        self.n_calls = 0
+
+    def users_conversations(self, types, exclude_archived, limit, cursor=None):
+        self.n_calls += 1
+        start = int(cursor or 0)
+        next_cursor = str(start + 2) if start + 2 < len(self.channels) else ""
+        return {"channels": self.channels[start:start + 2], "response_metadata": {"next_cursor": next_cursor}}
+
+
+def test_channel_name_to_id():
+    client = FakeConversationsClient()
+    index = ChannelIndex(":memory:")
+
+    assert channel_name_to_id("channel-0", client, index) == "C0"
+    assert client.n_calls == 3
+
+    # Served from the index
+    assert channel_name_to_id("channel-4", client, index) == "C4"
+    assert client.n_calls == 3
+
+    # Misses walk the pages only till the channel is found
+    client.channels.insert(0, {"id": "C5", "name": "channel-5"})
+    assert channel_name_to_id("channel-5", client, index) == "C5"
+    assert client.n_calls == 4
+
+    with pytest.raises(ValueError):
+        channel_name_to_id("channel-6", client, index)
+
+
+class FakeAccessLogsClient:
+    def __init__(self, n_pages: int, page_size: int):
+        # Latest logins first, every user shows up on many pages
+        self.logins = [
+            {"user_id": f"U{i % 7}", "username": f"user{i % 7}", "ip": f"10.0.0.{i % 7}", "date_last": 10000 - i}
+            for i in range(n_pages * page_size)
+        ]
+        self.page_size = page_size
+        self.pages: List[int] = []
+
+    def team_accessLogs(self, count, page):
+        self.pages.append(page)
+        start = (page - 1) * self.page_size
+        return make_response({
+            "ok": True, "logins": self.logins[start:start + self.page_size],
+            "paging": {"pages": len(self.logins) // self.page_size, "page": page}
+        })
+
+
+def test_last_user_access():
+    client = FakeAccessLogsClient(n_pages=20, page_size=3)
+    bucket = TokenBucket(1000)
+
+    access = last_user_access(client, user_ids=[f"U{i}" for i in range(7)], n_workers=2, bucket=bucket)
+
+    assert {user.id: login["date_last"] for user, login in access.items()} == {f"U{i}": 10000 - i for i in range(7)}
+    # Stopped after the wave that had the last unseen user
+    assert sorted(client.pages) == [1, 2, 3]
+
+    client.pages = []
+    assert len(last_user_access(client, n_workers=4, bucket=bucket)) == 7
+    assert sorted(client.pages) == list(range(1, 21))
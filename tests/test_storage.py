@@ -0,0 +1,52 @@
+import sqlite3
+
+from arwa.storage import SqliteDB
+from arwa.types import SlackMessage
+
+
+def test_sqlite_db_migrates_old_tables(tmp_path):
+    path = str(tmp_path / "arwa.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE slack_rtm (message TEXT, channel TEXT, thread_ts TEXT)")
+    conn.execute("INSERT INTO slack_rtm VALUES ('old', 'C1', NULL)")
+    conn.commit()
+    conn.close()
+
+    with SqliteDB(path) as db:
+        db.save_message(SlackMessage("new", "C1", ts="1618574400.000100", user="U1"))
+
+    with SqliteDB(path) as db:
+        assert list(db.load_messages()) == [
+            SlackMessage("old", "C1"),
+            SlackMessage("new", "C1", ts="1618574400.000100", user="U1")
+        ]
+        assert db.conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_sqlite_db_batches(tmp_path):
+    path = str(tmp_path / "arwa.db")
+    db = SqliteDB(path, commit_size=100, commit_interval=3600)
+
+    msgs = [
+        SlackMessage(f"m{i}", f"C{i % 2}", thread_ts="1618574400.000000" if i % 10 == 0 else None,
+                     ts=f"{1618574400 + i}.000000")
+        for i in range(250)
+    ]
+    db.save_messages(msgs[:50])
+    db.save_messages(msgs[50:])
+
+    # Only the batch crossing the threshold is committed
+    other = sqlite3.connect(path)
+    assert other.execute("SELECT COUNT(*) FROM slack_rtm").fetchone()[0] == 250
+    db.save_messages(msgs[:1])
+    assert other.execute("SELECT COUNT(*) FROM slack_rtm").fetchone()[0] == 250
+    db.flush()
+    assert other.execute("SELECT COUNT(*) FROM slack_rtm").fetchone()[0] == 251
+
+    assert [m.message for m in db.load_messages(channel="C1", oldest="1618574500.000000", batch_size=7)] == [
+        f"m{i}" for i in range(101, 250, 2)
+    ]
+    assert [m.message for m in db.load_messages(thread_ts="1618574400.000000", latest="1618574430.000000")] == [
+        "m0", "m10", "m20", "m0"
+    ]
+    db.close()
@@ -0,0 +1,30 @@
+import dataclasses
+import datetime as dt
+import pickle
+
+import pytest
+
+from arwa.types import CalendarEvent, SlackUser
+
+
+def test_slotted_dataclasses():
+    user = SlackUser("U1", "lepisma", email="lepisma@example.com")
+    ev = CalendarEvent("sync", dt.datetime(2021, 4, 16, 18), dt.datetime(2021, 4, 16, 19), ["a@example.com"])
+
+    for obj in [user, ev]:
+        assert not hasattr(obj, "__dict__")
+        assert pickle.loads(pickle.dumps(obj)) == obj
+
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        user.name = "other"  # type: ignore
+
+    assert dataclasses.replace(user, name="other").name == "other"
+    assert {user, dataclasses.replace(user)} == {user}
+
+
+def test_attendees_are_interned():
+    emails = ["".join(["a", "@example.com"]) for _ in range(2)]
+    evs = [CalendarEvent("", dt.datetime(2021, 4, 16, 18), dt.datetime(2021, 4, 16, 19), [email]) for email in emails]
+
+    assert emails[0] is not emails[1]
+    assert evs[0].attendees[0] is evs[1].attendees[0]